@@ -6,6 +6,7 @@ from pwnagotchi.ui.components import LabeledValue
 from pwnagotchi.ui.view import BLACK
 import logging
 import os
+import sys
 import shutil
 import subprocess
 from datetime import datetime
@@ -13,6 +14,15 @@ import socket
 import fnmatch
 import json
 
+_plugin_dir = os.path.dirname(os.path.abspath(__file__))
+if _plugin_dir not in sys.path:
+    sys.path.append(_plugin_dir)
+try:
+    from handshake_catalog import open_catalog
+except ImportError:
+    def open_catalog(handshake_dir):
+        return None
+
 class git_backup(plugins.Plugin):
     __author__ = 'WPA2'
     __version__ = '2.1.0.3'
@@ -50,6 +60,7 @@ class git_backup(plugins.Plugin):
     def __init__(self):
         self.ready = False
         self.ui_status = "---"
+        self.handshake_dir = None
 
     def _load_status(self):
         """Load status from JSON file"""
@@ -94,6 +105,9 @@ class git_backup(plugins.Plugin):
         self.ready = True
         logging.info(f"[git-backup] Ready - interval: {self.options.get('interval', 2)}h, repo: {self.github_repo}")
 
+    def on_config_changed(self, config):
+        self.handshake_dir = config.get('bettercap', {}).get('handshakes')
+
     def on_ui_setup(self, ui):
         if self.show_status:
             pos = self.options.get('position', (ui.width() - 35, 0))
@@ -247,7 +261,7 @@ class git_backup(plugins.Plugin):
 
         return copied_count
 
-    def _copy_single_file(self, src_path):
+    def _copy_single_file(self, src_path, src_sig=None):
         """Copy a single file to backup directory if changed"""
         if self._should_exclude(src_path):
             return 0
@@ -257,14 +271,18 @@ class git_backup(plugins.Plugin):
         dest_path = os.path.join(self.BACKUP_DIR, rel_path)
 
         # Skip if destination exists and is same or newer (unchanged)
-        if os.path.exists(dest_path):
-            src_mtime = os.path.getmtime(src_path)
-            dest_mtime = os.path.getmtime(dest_path)
-            src_size = os.path.getsize(src_path)
-            dest_size = os.path.getsize(dest_path)
+        try:
+            dest_stat = os.stat(dest_path)
+        except FileNotFoundError:
+            dest_stat = None
+        if dest_stat is not None:
+            if src_sig is None:
+                src_stat = os.stat(src_path)
+                src_sig = (src_stat.st_size, src_stat.st_mtime_ns)
+            src_size, src_mtime_ns = src_sig
 
             # Skip if same size and dest is same age or newer
-            if src_size == dest_size and dest_mtime >= src_mtime:
+            if src_size == dest_stat.st_size and dest_stat.st_mtime_ns >= src_mtime_ns:
                 return 0
 
         os.makedirs(os.path.dirname(dest_path), exist_ok=True)
@@ -275,15 +293,27 @@ class git_backup(plugins.Plugin):
         """Recursively copy a directory to backup"""
         copied = 0
 
+        # the handshake catalog already knows size and mtime of the captures, saves a stat per file.
+        # The walk still decides what gets copied: the catalog leaves out dotfiles, subdirectories
+        # and files written within its settle delay.
+        known = {}
+        catalog_root = None
+        if self.handshake_dir and os.path.abspath(src_dir) == os.path.abspath(self.handshake_dir):
+            catalog = open_catalog(self.handshake_dir)
+            if catalog is not None:
+                known = {name: (size, mtime_ns) for name, size, mtime_ns in catalog.entries()}
+                catalog_root = os.path.abspath(src_dir)
+
         for root, dirs, files in os.walk(src_dir):
             # Filter out excluded directories in-place
             dirs[:] = [d for d in dirs if not self._should_exclude(os.path.join(root, d))]
+            at_catalog_root = os.path.abspath(root) == catalog_root
 
             for filename in files:
                 src_file = os.path.join(root, filename)
                 if not self._should_exclude(src_file):
                     try:
-                        copied += self._copy_single_file(src_file)
+                        copied += self._copy_single_file(src_file, known.get(filename) if at_catalog_root else None)
                     except (PermissionError, OSError) as e:
                         logging.debug(f"[git-backup] Could not copy {src_file}: {e}")
 
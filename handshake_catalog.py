@@ -0,0 +1,470 @@
+import ctypes
+import ctypes.util
+import glob
+import hashlib
+import logging
+import os
+import select
+import sqlite3
+import stat
+import struct
+import threading
+import time
+
+# Shared index of the bettercap handshakes directory. Not a plugin by itself,
+# the other plugins import it and share one catalog per directory:
+#
+#   catalog = handshake_catalog.open_catalog(config['bettercap']['handshakes'])
+#   if catalog is not None:
+#       catalog.count('pcap')
+
+DEFAULT_DB_DIR = '/root'
+CAPTURE_EXTENSIONS = ('pcap', '22000', '16800')
+COMPOUND_EXTENSIONS = ('net-pos.json', 'paw-gps.json', 'gps.json', 'geo.json')
+SORT_COLUMNS = {'name': 'f.name', 'mtime': 'f.mtime_ns', 'size': 'f.size'}
+POLL_INTERVAL = 60
+SETTLE_DELAY = 0.5
+
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_DELETE | IN_DELETE_SELF
+EVENT_HEADER = struct.Struct('iIII')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS files (
+    name TEXT PRIMARY KEY,
+    stem TEXT NOT NULL,
+    ext TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS files_stem ON files (stem);
+CREATE INDEX IF NOT EXISTS files_ext_mtime ON files (ext, mtime_ns);
+CREATE INDEX IF NOT EXISTS files_ext_name ON files (ext, name);
+CREATE INDEX IF NOT EXISTS files_ext_size ON files (ext, size);
+CREATE TABLE IF NOT EXISTS handshakes (
+    stem TEXT PRIMARY KEY,
+    ssid TEXT NOT NULL,
+    bssid TEXT NOT NULL,
+    ssid_key TEXT NOT NULL,
+    exts TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    cracked INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS handshakes_bssid ON handshakes (bssid);
+CREATE INDEX IF NOT EXISTS handshakes_ssid ON handshakes (ssid COLLATE NOCASE);
+CREATE INDEX IF NOT EXISTS handshakes_key ON handshakes (ssid_key, bssid);
+CREATE INDEX IF NOT EXISTS handshakes_mtime ON handshakes (mtime_ns);
+CREATE TABLE IF NOT EXISTS counters (key TEXT PRIMARY KEY, value INTEGER NOT NULL);
+CREATE TRIGGER IF NOT EXISTS files_insert AFTER INSERT ON files BEGIN
+    INSERT INTO counters (key, value) VALUES ('files', 1) ON CONFLICT (key) DO UPDATE SET value = value + 1;
+    INSERT INTO counters (key, value) VALUES ('ext:' || NEW.ext, 1) ON CONFLICT (key) DO UPDATE SET value = value + 1;
+END;
+CREATE TRIGGER IF NOT EXISTS files_delete AFTER DELETE ON files BEGIN
+    UPDATE counters SET value = value - 1 WHERE key IN ('files', 'ext:' || OLD.ext);
+END;
+CREATE TRIGGER IF NOT EXISTS handshakes_insert AFTER INSERT ON handshakes BEGIN
+    INSERT INTO counters (key, value) VALUES ('handshakes', 1) ON CONFLICT (key) DO UPDATE SET value = value + 1;
+    INSERT INTO counters (key, value) VALUES ('cracked', NEW.cracked) ON CONFLICT (key) DO UPDATE SET value = value + NEW.cracked;
+END;
+CREATE TRIGGER IF NOT EXISTS handshakes_delete AFTER DELETE ON handshakes BEGIN
+    UPDATE counters SET value = value - 1 WHERE key = 'handshakes';
+    UPDATE counters SET value = value - OLD.cracked WHERE key = 'cracked';
+END;
+CREATE TRIGGER IF NOT EXISTS handshakes_cracked AFTER UPDATE OF cracked ON handshakes
+WHEN OLD.cracked != NEW.cracked BEGIN
+    UPDATE counters SET value = value + NEW.cracked - OLD.cracked WHERE key = 'cracked';
+END;
+"""
+
+_catalogs = {}
+_catalogs_lock = threading.Lock()
+_failed = set()
+
+
+def default_db_path(handshake_dir):
+    """Database file of one directory, the tables hold a single directory each."""
+    digest = hashlib.sha1(os.path.realpath(handshake_dir).encode('utf-8', 'surrogateescape')).hexdigest()[:12]
+    return os.path.join(DEFAULT_DB_DIR, f'.handshake_catalog-{digest}.db')
+
+
+def get_catalog(handshake_dir, db_path=None):
+    """Return the shared, running catalog for handshake_dir, creating it on first use."""
+    handshake_dir = os.path.realpath(handshake_dir)
+    with _catalogs_lock:
+        catalog = _catalogs.get(handshake_dir)
+        if catalog is None:
+            catalog = HandshakeCatalog(handshake_dir, db_path)
+            catalog.start()
+            _catalogs[handshake_dir] = catalog
+        return catalog
+
+
+def open_catalog(handshake_dir):
+    """Like get_catalog, but None when the catalog can't be opened so callers scan the directory instead.
+
+    A failure is remembered, the database isn't retried (and the error logged) on every call.
+    """
+    handshake_dir = os.path.realpath(handshake_dir)
+    if handshake_dir in _failed:
+        return None
+    try:
+        return get_catalog(handshake_dir)
+    except Exception as e:
+        logging.error(f"[catalog] unavailable for {handshake_dir}: {e}")
+        _failed.add(handshake_dir)
+        return None
+
+
+def normalize_ssid(ssid):
+    return ssid.replace("_", "").replace(" ", "").replace(".", "")
+
+
+def split_name(name):
+    for ext in COMPOUND_EXTENSIONS:
+        if name.endswith('.' + ext):
+            return name[:-len(ext) - 1], ext
+    stem, dot, ext = name.rpartition('.')
+    if not dot:
+        return name, ''
+    return stem, ext
+
+
+def split_stem(stem):
+    # capture names are SSID_BSSID, the SSID itself may contain underscores
+    ssid, sep, bssid = stem.rpartition('_')
+    if not sep:
+        return stem, ''
+    return ssid, bssid.lower()
+
+
+def potfile_keys(path):
+    """Yield normalized (ssid, bssid) pairs from a wpa-sec or hashcat 22000 potfile."""
+    with open(path, 'r', encoding='utf-8', errors='ignore') as f:
+        for line in f:
+            fields = line.strip().split(':')
+            if len(fields) < 4:
+                continue
+            if len(fields[0]) == 12:
+                # wpa-sec: bssid:station:ssid:password
+                bssid, ssid = fields[0], fields[2]
+            else:
+                # hashcat: mic:bssid:station:ssid:password
+                bssid, ssid = fields[1], fields[3]
+            yield normalize_ssid(ssid), bssid.lower()
+
+
+class Inotify:
+    """Minimal ctypes binding for a single non-recursive directory watch."""
+
+    def __init__(self, path):
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        if libc.inotify_add_watch(self.fd, os.fsencode(path), WATCH_MASK) < 0:
+            errno = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(errno, f'inotify_add_watch failed for {path}')
+
+    def read(self, timeout):
+        """Return (mask, name) events, waiting at most timeout seconds for the first one."""
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        events = []
+        offset = 0
+        while offset + EVENT_HEADER.size <= len(data):
+            _, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b'\0').decode('utf-8', 'surrogateescape')
+            offset += length
+            events.append((mask, name))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+class HandshakeCatalog:
+    def __init__(self, handshake_dir, db_path=None):
+        self.handshake_dir = handshake_dir
+        self.db_path = db_path = db_path or default_db_path(handshake_dir)
+        self.lock = threading.RLock()
+        self.db = sqlite3.connect(db_path, check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.executescript(SCHEMA)
+        self.db.execute('CREATE TEMP TABLE IF NOT EXISTS cracked_keys (ssid_key TEXT, bssid TEXT, PRIMARY KEY (ssid_key, bssid))')
+        self.cracked_keys = set()
+        self.running = False
+        self.thread = None
+        self.listeners = []
+        with self.lock, self.db:
+            row = self.db.execute("SELECT value FROM meta WHERE key = 'directory'").fetchone()
+            if row is None or row[0] != handshake_dir:
+                self.db.execute('DELETE FROM files')
+                self.db.execute('DELETE FROM handshakes')
+                self.db.execute('DELETE FROM counters')
+                self.db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('directory', ?)", (handshake_dir,))
+
+    def start(self):
+        self.reconcile()
+        self.running = True
+        self.thread = threading.Thread(target=self.watch, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+
+    def add_listener(self, callback):
+        """callback(changed_names, removed_names) runs on the watcher thread after each applied batch."""
+        self.listeners.append(callback)
+
+    def remove_listener(self, callback):
+        if callback in self.listeners:
+            self.listeners.remove(callback)
+
+    # -- maintenance --------------------------------------------------------
+
+    def reconcile(self):
+        """Full scan of the directory, brings the tables in line with what is on disk."""
+        started = time.time()
+        on_disk = {}
+        try:
+            with os.scandir(self.handshake_dir) as it:
+                for entry in it:
+                    if entry.name.startswith('.') or not entry.is_file():
+                        continue
+                    st = entry.stat()
+                    on_disk[entry.name] = (st.st_size, st.st_mtime_ns)
+        except OSError as e:
+            logging.error(f"[catalog] cannot scan {self.handshake_dir}: {e}")
+            return
+        with self.lock:
+            known = {name: (size, mtime) for name, size, mtime in self.db.execute('SELECT name, size, mtime_ns FROM files')}
+            changed = [name for name, sig in on_disk.items() if known.get(name) != sig]
+            removed = [name for name in known if name not in on_disk]
+            self.apply(changed, removed, on_disk, potfiles_changed=True)
+        logging.info(f"[catalog] {len(on_disk)} files indexed in {time.time() - started:.1f}s "
+                     f"({len(changed)} changed, {len(removed)} removed)")
+
+    def refresh(self, names):
+        """Re-stat the given file names, for callers that know about a change before the watcher does."""
+        stats = {}
+        removed = []
+        for name in names:
+            try:
+                st = os.stat(os.path.join(self.handshake_dir, name))
+            except FileNotFoundError:
+                removed.append(name)
+                continue
+            if name.startswith('.') or not stat.S_ISREG(st.st_mode):
+                # same files as reconcile() lists, a directory by that name is no entry either
+                removed.append(name)
+                continue
+            stats[name] = (st.st_size, st.st_mtime_ns)
+        with self.lock:
+            self.apply(list(stats), removed, stats,
+                       potfiles_changed=any(split_name(n)[1] == 'potfile' for n in names))
+
+    def apply(self, changed, removed, stats, potfiles_changed=False):
+        stems = set()
+        with self.lock, self.db:
+            for name in removed:
+                self.db.execute('DELETE FROM files WHERE name = ?', (name,))
+                stems.add(split_name(name)[0])
+            for name in changed:
+                size, mtime_ns = stats[name]
+                stem, ext = split_name(name)
+                self.db.execute(
+                    'INSERT INTO files (name, stem, ext, size, mtime_ns) VALUES (?, ?, ?, ?, ?) '
+                    'ON CONFLICT (name) DO UPDATE SET size = excluded.size, mtime_ns = excluded.mtime_ns',
+                    (name, stem, ext, size, mtime_ns))
+                stems.add(stem)
+            for stem in stems:
+                self._refresh_stem(stem)
+            if potfiles_changed:
+                self._reload_potfiles()
+        if changed or removed:
+            for callback in self.listeners:
+                try:
+                    callback(changed, removed)
+                except Exception as e:
+                    logging.error(f"[catalog] listener failed: {e}")
+
+    def _refresh_stem(self, stem):
+        placeholders = ','.join('?' * len(CAPTURE_EXTENSIONS))
+        rows = self.db.execute(
+            f'SELECT ext, size, mtime_ns FROM files WHERE stem = ? AND ext IN ({placeholders}) ORDER BY ext',
+            (stem,) + CAPTURE_EXTENSIONS).fetchall()
+        if not rows:
+            self.db.execute('DELETE FROM handshakes WHERE stem = ?', (stem,))
+            return
+        ssid, bssid = split_stem(stem)
+        ssid_key = normalize_ssid(ssid)
+        self.db.execute(
+            'INSERT INTO handshakes (stem, ssid, bssid, ssid_key, exts, size, mtime_ns, cracked) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?) '
+            'ON CONFLICT (stem) DO UPDATE SET exts = excluded.exts, size = excluded.size, mtime_ns = excluded.mtime_ns',
+            (stem, ssid, bssid, ssid_key, ','.join(r[0] for r in rows),
+             sum(r[1] for r in rows), max(r[2] for r in rows), int((ssid_key, bssid) in self.cracked_keys)))
+
+    def _reload_potfiles(self):
+        keys = set()
+        for path in glob.glob(os.path.join(self.handshake_dir, '*.potfile')):
+            try:
+                keys.update(potfile_keys(path))
+            except OSError as e:
+                logging.error(f"[catalog] cannot read {path}: {e}")
+        self.cracked_keys = keys
+        self.db.execute('DELETE FROM cracked_keys')
+        self.db.executemany('INSERT OR IGNORE INTO cracked_keys (ssid_key, bssid) VALUES (?, ?)', keys)
+        self.db.execute(
+            'UPDATE handshakes SET cracked = 1 - cracked WHERE cracked != EXISTS ('
+            'SELECT 1 FROM cracked_keys c WHERE c.ssid_key = handshakes.ssid_key AND c.bssid = handshakes.bssid)')
+
+    def watch(self):
+        try:
+            inotify = Inotify(self.handshake_dir)
+        except (OSError, AttributeError) as e:
+            logging.warning(f"[catalog] inotify unavailable ({e}), rescanning every {POLL_INTERVAL}s")
+            inotify = None
+
+        while self.running:
+            if inotify is None:
+                time.sleep(POLL_INTERVAL)
+                self.reconcile()
+                continue
+            events = inotify.read(1.0)
+            if not events:
+                continue
+            # let a burst of writes settle and apply it as one transaction
+            time.sleep(SETTLE_DELAY)
+            events.extend(inotify.read(0))
+            names = set()
+            rescan = False
+            for mask, name in events:
+                if mask & (IN_Q_OVERFLOW | IN_DELETE_SELF | IN_IGNORED):
+                    rescan = True
+                elif name and not name.startswith('.'):
+                    names.add(name)
+            try:
+                if rescan:
+                    self.reconcile()
+                elif names:
+                    self.refresh(names)
+            except Exception as e:
+                logging.error(f"[catalog] failed to apply changes: {e}")
+        if inotify is not None:
+            inotify.close()
+
+    # -- queries ------------------------------------------------------------
+
+    def _counter(self, key):
+        with self.lock:
+            row = self.db.execute('SELECT value FROM counters WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else 0
+
+    def count(self, ext=None):
+        """Number of files, optionally only those with the given extension."""
+        return self._counter(f'ext:{ext}' if ext else 'files')
+
+    def handshake_count(self):
+        return self._counter('handshakes')
+
+    def cracked_count(self):
+        return self._counter('cracked')
+
+    def entries(self, ext=None, newer_than_ns=None):
+        """List of (name, size, mtime_ns) ordered by name."""
+        query = 'SELECT name, size, mtime_ns FROM files'
+        clauses, params = [], []
+        if ext:
+            clauses.append('ext = ?')
+            params.append(ext)
+        if newer_than_ns is not None:
+            clauses.append('mtime_ns > ?')
+            params.append(newer_than_ns)
+        if clauses:
+            query += ' WHERE ' + ' AND '.join(clauses)
+        with self.lock:
+            return self.db.execute(query + ' ORDER BY name', params).fetchall()
+
+    def stat(self, name):
+        """(size, mtime_ns) of a file as last seen, or None."""
+        with self.lock:
+            return self.db.execute('SELECT size, mtime_ns FROM files WHERE name = ?', (name,)).fetchone()
+
+    def validators(self, name):
+        """(etag, last_modified) for a file from its indexed size and mtime, or None if it is not indexed."""
+        signature = self.stat(name)
+        if signature is None:
+            return None
+        size, mtime_ns = signature
+        return f"{mtime_ns:x}-{size:x}", mtime_ns / 1e9
+
+    def uncracked(self, exts=CAPTURE_EXTENSIONS):
+        """List of (name, ext, size, mtime_ns) for capture files whose network is in no potfile."""
+        placeholders = ','.join('?' * len(exts))
+        with self.lock:
+            return self.db.execute(
+                'SELECT f.name, f.ext, f.size, f.mtime_ns FROM files f JOIN handshakes h ON h.stem = f.stem '
+                f'WHERE h.cracked = 0 AND h.bssid != \'\' AND f.ext IN ({placeholders}) ORDER BY f.name',
+                tuple(exts)).fetchall()
+
+    def lookup(self, bssid=None, ssid=None):
+        """Handshakes matching a BSSID (any separators) and/or an SSID, as dicts."""
+        clauses, params = [], []
+        if bssid:
+            clauses.append('bssid = ?')
+            params.append(bssid.replace(':', '').replace('-', '').lower())
+        if ssid:
+            clauses.append('ssid = ? COLLATE NOCASE')
+            params.append(ssid)
+        query = 'SELECT stem, ssid, bssid, exts, size, mtime_ns, cracked FROM handshakes'
+        if clauses:
+            query += ' WHERE ' + ' AND '.join(clauses)
+        with self.lock:
+            rows = self.db.execute(query, params).fetchall()
+        return [dict(zip(('stem', 'ssid', 'bssid', 'exts', 'size', 'mtime_ns', 'cracked'), row)) for row in rows]
+
+    def page(self, ext=None, search=None, prefix=False, sort='name', descending=False, offset=0, limit=100):
+        """One page of files joined with their handshake, filtered on SSID/BSSID. Returns (total, rows)."""
+        clauses, params = [], []
+        if ext:
+            clauses.append('f.ext = ?')
+            params.append(ext)
+        if search:
+            escaped = search.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+            bssid = escaped.replace(':', '').replace('-', '').lower()
+            pattern = '{}%' if prefix else '%{}%'
+            clauses.append("(h.ssid LIKE ? ESCAPE '\\' OR h.bssid LIKE ? ESCAPE '\\')")
+            params += [pattern.format(escaped), pattern.format(bssid)]
+        where = ' WHERE ' + ' AND '.join(clauses) if clauses else ''
+        order = f"{SORT_COLUMNS.get(sort, 'f.name')} {'DESC' if descending else 'ASC'}"
+        with self.lock:
+            if search:
+                total = self.db.execute(
+                    f'SELECT COUNT(*) FROM files f LEFT JOIN handshakes h ON h.stem = f.stem{where}', params).fetchone()[0]
+            else:
+                total = self.count(ext)
+            rows = self.db.execute(
+                'SELECT f.name, f.stem, h.ssid, h.bssid, f.size, f.mtime_ns FROM files f '
+                f'LEFT JOIN handshakes h ON h.stem = f.stem{where} ORDER BY {order} LIMIT ? OFFSET ?',
+                params + [limit, offset]).fetchall()
+        return total, [dict(zip(('name', 'stem', 'ssid', 'bssid', 'size', 'mtime_ns'), row)) for row in rows]
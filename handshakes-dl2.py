@@ -1,7 +1,7 @@
 import logging
 import json
 import os
-import glob
+import sys
 
 import pwnagotchi
 import pwnagotchi.plugins as plugins
@@ -9,6 +9,16 @@ import pwnagotchi.plugins as plugins
 from flask import abort
 from flask import send_from_directory
 from flask import render_template_string
+from flask import jsonify
+
+_plugin_dir = os.path.dirname(os.path.abspath(__file__))
+if _plugin_dir not in sys.path:
+    sys.path.append(_plugin_dir)
+try:
+    from handshake_catalog import open_catalog
+except ImportError:
+    def open_catalog(handshake_dir):
+        return None
 
 TEMPLATE = """
 {% extends "base.html" %}
@@ -28,47 +38,158 @@ TEMPLATE = """
             border: 1px solid #ddd;
             margin-bottom: 12px;
         }
+        #controls {
+            margin-bottom: 12px;
+        }
+        #viewport {
+            height: 70vh;
+            overflow-y: auto;
+            position: relative;
+            border: 1px solid #ddd;
+        }
+        #spacer {
+            position: relative;
+        }
+        #spacer .file {
+            position: absolute;
+            left: 0;
+            right: 0;
+            height: {{ row_height }}px;
+            line-height: {{ row_height }}px;
+            padding: 0 12px;
+            overflow: hidden;
+            white-space: nowrap;
+            text-overflow: ellipsis;
+        }
     </style>
 {% endblock %}
 {% block script %}
-    var shakeList = document.getElementById('list');
+    var ROW_HEIGHT = {{ row_height }};
+    var PAGE_SIZE = {{ page_size }};
+    var viewport = document.getElementById('viewport');
+    var spacer = document.getElementById('spacer');
     var filter = document.getElementById('filter');
-    var filterVal = filter.value.toUpperCase();
+    var matchMode = document.getElementById('match');
+    var sortBy = document.getElementById('sort');
+    var sortOrder = document.getElementById('order');
+    var summary = document.getElementById('summary');
+    var total = 0;
+    var pages = {};
+    var generation = 0;
+    var debounce = null;
 
-    filter.onkeyup = function() {
-        document.body.style.cursor = 'progress';
-        var table, tr, tds, td, i, txtValue;
-        filterVal = filter.value.toUpperCase();
-        li = shakeList.getElementsByTagName("li");
-        for (i = 0; i < li.length; i++) {
-            txtValue = li[i].textContent || li[i].innerText;
-            if (txtValue.toUpperCase().indexOf(filterVal) > -1) {
-                li[i].style.display = "list-item";
-            } else {
-                li[i].style.display = "none";
+    function query(offset) {
+        return '/plugins/handshakes-dl/api/handshakes?offset=' + offset + '&limit=' + PAGE_SIZE +
+            '&q=' + encodeURIComponent(filter.value) + '&match=' + matchMode.value +
+            '&sort=' + sortBy.value + '&order=' + sortOrder.value;
+    }
+
+    function fetchPage(page) {
+        if (pages[page]) {
+            return;
+        }
+        var requested = generation;
+        pages[page] = 'loading';
+        fetch(query(page * PAGE_SIZE)).then(function(r) { return r.json(); }).then(function(data) {
+            if (requested !== generation) {
+                return;
+            }
+            pages[page] = data.items;
+            setTotal(data.total);
+            render();
+        }).catch(function() {
+            delete pages[page];
+        });
+    }
+
+    function setTotal(count) {
+        total = count;
+        spacer.style.height = (total * ROW_HEIGHT) + 'px';
+        summary.textContent = total + ' handshakes';
+    }
+
+    function render() {
+        var first = Math.floor(viewport.scrollTop / ROW_HEIGHT);
+        var last = Math.min(total, first + Math.ceil(viewport.clientHeight / ROW_HEIGHT) + 1);
+        var html = '';
+        for (var i = first; i < last; i++) {
+            var page = Math.floor(i / PAGE_SIZE);
+            var items = pages[page];
+            if (!items) {
+                fetchPage(page);
+                continue;
+            }
+            if (items === 'loading') {
+                continue;
             }
+            var item = items[i - page * PAGE_SIZE];
+            if (!item) {
+                continue;
+            }
+            var stem = encodeURIComponent(item.stem);
+            html += '<div class="file" style="top:' + (i * ROW_HEIGHT) + 'px">' +
+                '<a href="/plugins/handshakes-dl/' + stem + '">' + escapeHtml(item.stem) + '</a></div>';
         }
-        document.body.style.cursor = 'default';
+        spacer.innerHTML = html;
+    }
+
+    function escapeHtml(text) {
+        var div = document.createElement('div');
+        div.textContent = text;
+        return div.innerHTML;
+    }
+
+    function reload() {
+        generation++;
+        pages = {};
+        viewport.scrollTop = 0;
+        fetchPage(0);
     }
 
+    viewport.onscroll = render;
+    window.onresize = render;
+    filter.onkeyup = function() {
+        clearTimeout(debounce);
+        debounce = setTimeout(reload, 250);
+    };
+    matchMode.onchange = reload;
+    sortBy.onchange = reload;
+    sortOrder.onchange = reload;
+    reload();
 {% endblock %}
 
 {% block content %}
-    <input type="text" id="filter" placeholder="Search for ..." title="Type in a filter">
-    <ul id="list" data-role="listview" style="list-style-type:disc;">
-        {% for handshake in handshakes %}
-            <li class="file">
-                <a href="/plugins/handshakes-dl/{{handshake}}">{{handshake}}</a>
-            </li>
-        {% endfor %}
-    </ul>
+    <input type="text" id="filter" placeholder="Search SSID or BSSID ..." title="Type in a filter">
+    <div id="controls">
+        <select id="match">
+            <option value="substring">contains</option>
+            <option value="prefix">starts with</option>
+        </select>
+        <select id="sort">
+            <option value="name">name</option>
+            <option value="mtime">date</option>
+            <option value="size">size</option>
+        </select>
+        <select id="order">
+            <option value="asc">ascending</option>
+            <option value="desc">descending</option>
+        </select>
+        <span id="summary"></span>
+    </div>
+    <div id="viewport">
+        <div id="spacer"></div>
+    </div>
 {% endblock %}
 """
 
+PAGE_SIZE = 100
+MAX_PAGE_SIZE = 500
+ROW_HEIGHT = 32
+
 
 class HandshakesDL2(plugins.Plugin):
     __author__ = 'me@sayakb.com'
-    __version__ = '0.2.1'
+    __version__ = '0.3.0'
     __license__ = 'GPL3'
     __description__ = 'Download handshake captures from web-ui.'
 
@@ -82,20 +203,76 @@ class HandshakesDL2(plugins.Plugin):
         self.config = config
         self.ready = True
 
+    def get_catalog(self):
+        return open_catalog(self.config['bettercap']['handshakes'])
+
+    def list_handshakes(self, request):
+        try:
+            offset = max(0, int(request.args.get("offset", 0)))
+            limit = min(MAX_PAGE_SIZE, max(1, int(request.args.get("limit", PAGE_SIZE))))
+        except ValueError:
+            abort(400)
+        search = request.args.get("q", "").strip()
+        prefix = request.args.get("match", "substring") == "prefix"
+        sort = request.args.get("sort", "name")
+        descending = request.args.get("order", "asc") == "desc"
+
+        catalog = self.get_catalog()
+        if catalog:
+            total, rows = catalog.page('pcap', search, prefix, sort, descending, offset, limit)
+        else:
+            total, rows = self.scan_page(search, prefix, sort, descending, offset, limit)
+        items = [{'stem': row['stem'], 'ssid': row['ssid'], 'bssid': row['bssid'],
+                  'size': row['size'], 'mtime': row['mtime_ns'] // 1000000000} for row in rows]
+        return jsonify(total=total, offset=offset, items=items)
+
+    def scan_page(self, search, prefix, sort, descending, offset, limit):
+        # fallback without the catalog, costs a full directory scan per page
+        rows = []
+        needle = search.lower()
+        needle_bssid = needle.replace(':', '').replace('-', '')
+        with os.scandir(self.config['bettercap']['handshakes']) as it:
+            for entry in it:
+                if not entry.name.endswith('.pcap') or not entry.is_file():
+                    continue
+                stem = entry.name[:-5]
+                ssid, _, bssid = stem.rpartition('_')
+                if needle:
+                    fields = (ssid.lower(), needle), (bssid.lower(), needle_bssid)
+                    if prefix and not any(value.startswith(n) for value, n in fields):
+                        continue
+                    if not prefix and not any(n in value for value, n in fields):
+                        continue
+                st = entry.stat()
+                rows.append({'name': entry.name, 'stem': stem, 'ssid': ssid, 'bssid': bssid,
+                             'size': st.st_size, 'mtime_ns': st.st_mtime_ns})
+        key = {'mtime': 'mtime_ns', 'size': 'size'}.get(sort, 'name')
+        rows.sort(key=lambda row: row[key], reverse=descending)
+        return len(rows), rows[offset:offset + limit]
+
     def on_webhook(self, path, request):
         if not self.ready:
             return "Plugin not ready"
 
         if path == "/" or not path:
-            handshakes = glob.glob(os.path.join(self.config['bettercap']['handshakes'], "*.pcap"))
-            handshakes = [os.path.basename(path)[:-5] for path in handshakes]
-            return render_template_string(TEMPLATE, title="Handshakes | " + pwnagotchi.name(), handshakes=handshakes)
+            return render_template_string(TEMPLATE, title="Handshakes | " + pwnagotchi.name(),
+                                          page_size=PAGE_SIZE, row_height=ROW_HEIGHT)
+
+        elif path == "api/handshakes":
+            return self.list_handshakes(request)
 
         else:
             dir = self.config['bettercap']['handshakes']
             try:
                 logging.info(f"[HandshakesDL2] serving {dir}/{path}.pcap")
-                return send_from_directory(dir, path+'.pcap', as_attachment=True)
+                # conditional send_file answers If-None-Match/If-Modified-Since with 304 and Range with 206
+                catalog = self.get_catalog()
+                validators = catalog.validators(path + '.pcap') if catalog else None
+                if validators:
+                    etag, last_modified = validators
+                    return send_from_directory(dir, path+'.pcap', as_attachment=True, conditional=True,
+                                               etag=etag, last_modified=last_modified)
+                return send_from_directory(dir, path+'.pcap', as_attachment=True, conditional=True)
             except FileNotFoundError:
                 abort(404)
                 
\ No newline at end of file
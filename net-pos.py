@@ -1,11 +1,354 @@
 import logging
 import json
+import math
 import os
+import sqlite3
+import sys
 import threading
 import requests
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import pwnagotchi.plugins as plugins
-from pwnagotchi.utils import StatusFile
+
+_plugin_dir = os.path.dirname(os.path.abspath(__file__))
+if _plugin_dir not in sys.path:
+    sys.path.append(_plugin_dir)
+try:
+    from handshake_catalog import open_catalog
+except ImportError:
+    def open_catalog(handshake_dir):
+        return None
+
+
+class ReportLedger:
+    """Append-only record of the net-pos files that already have a position.
+
+    One path per line, loaded into a set on start. New entries are buffered
+    and appended in batches, so a backlog of N files costs O(N) bytes written
+    instead of rewriting the whole list after every file.
+    """
+
+    BATCH_SIZE = 25
+
+    def __init__(self, path, legacy_path=None):
+        self.path = path
+        self.reported = set()
+        self.pending = []
+        if not os.path.exists(path) and legacy_path:
+            self._migrate(legacy_path)
+        try:
+            with open(path, 'r') as ledger:
+                self.reported.update(line.rstrip('\n') for line in ledger if line.strip())
+        except FileNotFoundError:
+            pass
+
+    def _migrate(self, legacy_path):
+        # one-time import of the old StatusFile json ({"reported": [...]})
+        try:
+            with open(legacy_path, 'r') as legacy:
+                reported = json.load(legacy).get('reported', [])
+        except (OSError, ValueError, AttributeError):
+            return
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as ledger:
+            for np_file in dict.fromkeys(reported):
+                ledger.write(np_file + '\n')
+            ledger.flush()
+            os.fsync(ledger.fileno())
+        os.replace(tmp_path, self.path)
+        logging.info("NET-POS: Migrated %d reported files from %s to %s", len(reported), legacy_path, self.path)
+
+    def __contains__(self, np_file):
+        return np_file in self.reported
+
+    def add(self, np_file):
+        if np_file in self.reported:
+            return
+        self.reported.add(np_file)
+        self.pending.append(np_file)
+        if len(self.pending) >= self.BATCH_SIZE:
+            self.commit()
+
+    def commit(self):
+        if not self.pending:
+            return
+        with open(self.path, 'a') as ledger:
+            ledger.write(''.join(np_file + '\n' for np_file in self.pending))
+            ledger.flush()
+            os.fsync(ledger.fileno())
+        self.pending = []
+
+
+class GeoCache:
+    """Resolved positions keyed by the sorted set of BSSIDs they were resolved from.
+
+    Captures made at the same spot see nearly the same access points, so a new
+    set reuses a stored position when its Jaccard overlap with a cached set is
+    at least `similarity`. Entries expire after `max_age` seconds and the least
+    recently used ones are dropped above `max_entries`.
+    """
+
+    def __init__(self, path, similarity=0.6, max_age=30 * 86400, max_entries=2000):
+        self.path = path
+        self.similarity = similarity
+        self.max_age = max_age
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.by_bssid = {}
+        self.stats = {'hits': 0, 'near_hits': 0, 'misses': 0}
+        self.dirty = False
+        try:
+            with open(path, 'r') as cache_file:
+                data = json.load(cache_file)
+            self.stats.update(data.get('stats', {}))
+            for entry in data.get('entries', []):
+                self._insert(entry)
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, AttributeError) as e:
+            logging.error("NET-POS: Ignoring unreadable cache %s: %s", path, e)
+        self._evict()
+
+    @staticmethod
+    def bssids(netpos):
+        return frozenset(ap['macAddress'].lower() for ap in netpos.get('wifiAccessPoints', [])
+                         if ap.get('macAddress'))
+
+    @staticmethod
+    def fingerprint(bssids):
+        return ','.join(sorted(bssids))
+
+    def _insert(self, entry):
+        fingerprint = self.fingerprint(entry['bssids'])
+        self.entries[fingerprint] = entry
+        for bssid in entry['bssids']:
+            self.by_bssid.setdefault(bssid, set()).add(fingerprint)
+
+    def _remove(self, fingerprint):
+        entry = self.entries.pop(fingerprint)
+        for bssid in entry['bssids']:
+            fingerprints = self.by_bssid.get(bssid)
+            if fingerprints is not None:
+                fingerprints.discard(fingerprint)
+                if not fingerprints:
+                    del self.by_bssid[bssid]
+
+    def _evict(self):
+        now = time.time()
+        for fingerprint, entry in list(self.entries.items()):
+            if now - entry['created'] > self.max_age:
+                self._remove(fingerprint)
+                self.dirty = True
+        if len(self.entries) > self.max_entries:
+            by_use = sorted(self.entries, key=lambda f: self.entries[f]['used'])
+            for fingerprint in by_use[:len(self.entries) - self.max_entries]:
+                self._remove(fingerprint)
+            self.dirty = True
+
+    def lookup(self, bssids):
+        if not bssids:
+            return None
+        with self.lock:
+            fingerprint = self.fingerprint(bssids)
+            entry = self.entries.get(fingerprint)
+            if entry is not None:
+                self.stats['hits'] += 1
+            else:
+                # only cached sets sharing at least one BSSID can overlap
+                best = 0.0
+                candidates = set()
+                for bssid in bssids:
+                    candidates.update(self.by_bssid.get(bssid, ()))
+                for candidate in candidates:
+                    cached = self.entries[candidate]['bssids']
+                    overlap = len(bssids.intersection(cached)) / len(bssids.union(cached))
+                    if overlap >= self.similarity and overlap > best:
+                        best, entry = overlap, self.entries[candidate]
+                if entry is None:
+                    self.stats['misses'] += 1
+                    self.dirty = True
+                    return None
+                self.stats['near_hits'] += 1
+            entry['used'] = time.time()
+            self.dirty = True
+            return dict(entry['geo'])
+
+    def add(self, bssids, geo):
+        if not bssids or 'location' not in geo:
+            return
+        geo = {k: v for k, v in geo.items() if k != 'ts'}
+        now = time.time()
+        with self.lock:
+            self._insert({'bssids': sorted(bssids), 'geo': geo, 'created': now, 'used': now})
+            self.dirty = True
+
+    def hit_rate(self):
+        lookups = self.stats['hits'] + self.stats['near_hits'] + self.stats['misses']
+        return (self.stats['hits'] + self.stats['near_hits']) / lookups if lookups else 0.0
+
+    def save(self):
+        with self.lock:
+            if not self.dirty:
+                return
+            self._evict()
+            data = {'stats': self.stats, 'entries': list(self.entries.values())}
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'w') as cache_file:
+                json.dump(data, cache_file)
+                cache_file.flush()
+                os.fsync(cache_file.fileno())
+            os.replace(tmp_path, self.path)
+            self.dirty = False
+
+
+class APStore:
+    """Positions of access points learned from earlier Geolocation API results.
+
+    Every resolved capture places the access points it saw at the returned
+    location, weighted by their signal strength and the accuracy of the answer.
+    A new capture with enough known access points is then located offline by
+    the weighted centroid of those points, after dropping the ones that fall
+    outside the densest grid cell and its neighbours (moved or mislearned APs).
+    The grid cell of every AP is stored with it, indexed, whenever its position
+    is learned.
+    """
+
+    CELL_SIZE = 0.01  # degrees, roughly one kilometre
+
+    def __init__(self, path, min_aps=3):
+        self.min_aps = min_aps
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.create_function('grid_cell', 1, self.grid_cell)
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS aps (
+                bssid TEXT PRIMARY KEY,
+                lat REAL NOT NULL,
+                lng REAL NOT NULL,
+                accuracy REAL NOT NULL,
+                weight REAL NOT NULL,
+                samples INTEGER NOT NULL,
+                updated REAL NOT NULL,
+                cell_lat INTEGER,
+                cell_lng INTEGER
+            );
+            CREATE TABLE IF NOT EXISTS sources (name TEXT PRIMARY KEY);
+        """)
+        columns = set(row[1] for row in self.db.execute("PRAGMA table_info(aps)"))
+        if 'cell_lat' not in columns:
+            # stores from before the cells were kept
+            with self.db:
+                self.db.execute("ALTER TABLE aps ADD COLUMN cell_lat INTEGER")
+                self.db.execute("ALTER TABLE aps ADD COLUMN cell_lng INTEGER")
+                self.db.execute("UPDATE aps SET cell_lat = grid_cell(lat), cell_lng = grid_cell(lng)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS aps_cell ON aps (cell_lat, cell_lng)")
+        self.sources = set(row[0] for row in self.db.execute("SELECT name FROM sources"))
+
+    @classmethod
+    def grid_cell(cls, degrees):
+        return int(math.floor(degrees / cls.CELL_SIZE))
+
+    @staticmethod
+    def signal_weight(netpos_ap):
+        # path loss makes the distance grow ~10^(-rssi/20), weigh by the inverse
+        rssi = netpos_ap.get('signalStrength', -80)
+        return 10 ** ((rssi + 100) / 20.0)
+
+    @staticmethod
+    def distance(lat1, lng1, lat2, lng2):
+        x = math.radians(lng2 - lng1) * math.cos(math.radians((lat1 + lat2) / 2))
+        y = math.radians(lat2 - lat1)
+        return 6371000 * math.hypot(x, y)
+
+    def learn(self, name, netpos, geo):
+        with self.lock:
+            if name in self.sources:
+                return
+            location = geo.get('location') if isinstance(geo, dict) else None
+            # positions estimated by this store are never fed back into it
+            if location and not geo.get('offline'):
+                accuracy = max(float(geo.get('accuracy', 100)), 1.0)
+                now = time.time()
+                for netpos_ap in netpos.get('wifiAccessPoints', []):
+                    if not netpos_ap.get('macAddress'):
+                        continue
+                    bssid = netpos_ap['macAddress'].lower()
+                    weight = self.signal_weight(netpos_ap) / accuracy
+                    row = self.db.execute("SELECT lat, lng, accuracy, weight, samples FROM aps WHERE bssid = ?",
+                                          (bssid,)).fetchone()
+                    if row is None:
+                        lat, lng, ap_accuracy, total, samples = location['lat'], location['lng'], accuracy, weight, 1
+                    else:
+                        total = row[3] + weight
+                        lat = (row[0] * row[3] + location['lat'] * weight) / total
+                        lng = (row[1] * row[3] + location['lng'] * weight) / total
+                        ap_accuracy = (row[2] * row[3] + accuracy * weight) / total
+                        samples = row[4] + 1
+                    self.db.execute("INSERT OR REPLACE INTO aps VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                    (bssid, lat, lng, ap_accuracy, total, samples, now,
+                                     self.grid_cell(lat), self.grid_cell(lng)))
+            self.db.execute("INSERT OR IGNORE INTO sources VALUES (?)", (name,))
+            self.sources.add(name)
+
+    def ingest(self, geo_files):
+        learned = 0
+        for geo_file in geo_files:
+            name = os.path.basename(geo_file)
+            if name in self.sources:
+                continue
+            try:
+                with open(geo_file, 'r') as gf:
+                    geo = json.load(gf)
+                with open(geo_file.replace('.geo.json', '.net-pos.json'), 'r') as nf:
+                    netpos = json.load(nf)
+            except (OSError, ValueError):
+                # no matching net-pos file or unreadable, nothing to learn from it
+                geo, netpos = {}, {}
+            self.learn(name, netpos, geo)
+            learned += 1
+        if learned:
+            with self.lock:
+                self.db.commit()
+            logging.debug("NET-POS: Learned access point positions from %d geo files", learned)
+
+    def estimate(self, netpos):
+        observed = {}
+        for netpos_ap in netpos.get('wifiAccessPoints', []):
+            if netpos_ap.get('macAddress'):
+                observed[netpos_ap['macAddress'].lower()] = self.signal_weight(netpos_ap)
+        if len(observed) < self.min_aps:
+            return None
+        with self.lock:
+            placeholders = ','.join('?' * len(observed))
+            rows = self.db.execute("SELECT bssid, lat, lng, accuracy, cell_lat, cell_lng FROM aps "
+                                   f"WHERE bssid IN ({placeholders})", list(observed)).fetchall()
+        if len(rows) < self.min_aps:
+            return None
+
+        cells = {}
+        for bssid, lat, lng, accuracy, cell_lat, cell_lng in rows:
+            cells.setdefault((cell_lat, cell_lng), []).append((observed[bssid] / max(accuracy, 1.0), lat, lng, accuracy))
+
+        def neighbourhood(cell):
+            return [ap for dx in (-1, 0, 1) for dy in (-1, 0, 1) for ap in cells.get((cell[0] + dx, cell[1] + dy), ())]
+
+        densest = max(cells, key=lambda cell: sum(ap[0] for ap in neighbourhood(cell)))
+        known = neighbourhood(densest)
+        if len(known) < self.min_aps:
+            return None
+
+        total = sum(ap[0] for ap in known)
+        lat = sum(ap[0] * ap[1] for ap in known) / total
+        lng = sum(ap[0] * ap[2] for ap in known) / total
+        accuracy = sum(ap[0] * (ap[3] + self.distance(lat, lng, ap[1], ap[2])) for ap in known) / total
+        return {'location': {'lat': lat, 'lng': lng}, 'accuracy': round(accuracy, 1), 'offline': True}
+
+    def close(self):
+        with self.lock:
+            self.db.close()
 
 
 class NetPos(plugins.Plugin):
@@ -22,11 +365,17 @@ class NetPos(plugins.Plugin):
     API_URL = 'https://www.googleapis.com/geolocation/v1/geolocate?key={api}'
     #https://github.com/do-ki/pwnagotchi/blob/master/pwnagotchi/plugins/default/net-pos.py
     def __init__(self):
-        self.skip = list()
+        self.skip = set()
         self.ready = False
         self.lock = threading.Lock()
         self.report_path = '/root/.net_pos_saved'
-        self.report = StatusFile(self.report_path, data_format='json')
+        self.ledger_path = '/root/.net_pos_reported'
+        self.ledger = None
+        self.session = None
+        self.cache = None
+        self.aps = None
+        self.workers = 4
+        self.display_interval = 5
 
     def on_loaded(self):
         if 'api_key' not in self.options or not self.options['api_key']:
@@ -36,7 +385,19 @@ class NetPos(plugins.Plugin):
             self.API_URL = self.options['api_url']
         if 'status_file' in self.options:
             self.report_path = self.options['status_file']
-            self.report = StatusFile(self.report_path, data_format='json')
+        if 'ledger_file' in self.options:
+            self.ledger_path = self.options['ledger_file']
+        self.ledger = ReportLedger(self.ledger_path, legacy_path=self.report_path)
+        self.workers = max(1, int(self.options.get('workers', self.workers)))
+        self.display_interval = self.options.get('display_interval', self.display_interval)
+        self.session = self._make_session()
+        self.cache = GeoCache(self.options.get('cache_file', '/root/.net_pos_cache.json'),
+                              similarity=self.options.get('cache_similarity', 0.6),
+                              max_age=self.options.get('cache_max_age', 30) * 86400,
+                              max_entries=self.options.get('cache_max_entries', 2000))
+        if self.options.get('offline', True):
+            self.aps = APStore(self.options.get('ap_db', '/root/.net_pos_aps.db'),
+                               min_aps=self.options.get('offline_min_aps', 3))
 
         self.ready = True
         logging.info("NET-POS: Plugin loaded successfully.")
@@ -51,49 +412,72 @@ class NetPos(plugins.Plugin):
 
             config = agent.config()
             display = agent.view()
-            reported = self.report.data_field_or('reported', default=list())
             handshake_dir = config['bettercap']['handshakes']
 
-            all_files = os.listdir(handshake_dir)
-            all_np_files = [os.path.join(handshake_dir, f)
-                            for f in all_files if f.endswith('.net-pos.json')]
-            new_np_files = set(all_np_files) - set(reported) - set(self.skip)
+            all_np_files = self._list_files(handshake_dir, 'net-pos.json')
+            if self.aps is not None:
+                self.aps.ingest(self._list_files(handshake_dir, 'geo.json'))
+            new_np_files = [np_file for np_file in all_np_files
+                            if np_file not in self.ledger and np_file not in self.skip]
 
             if new_np_files:
                 logging.debug("NET-POS: Found %d new net-pos files. Fetching positions ...", len(new_np_files))
                 display.set('status', f"Found {len(new_np_files)} new net-pos files. Fetching positions ...")
                 display.update(force=True)
 
-                for idx, np_file in enumerate(new_np_files):
-                    geo_file = np_file.replace('.net-pos.json', '.geo.json')
-                    if os.path.exists(geo_file):
-                        reported.append(np_file)
-                        self.report.update(data={'reported': reported})
-                        continue
+                pending = []
+                for np_file in new_np_files:
+                    if os.path.exists(np_file.replace('.net-pos.json', '.geo.json')):
+                        self.ledger.add(np_file)
+                    else:
+                        pending.append(np_file)
 
-                    try:
-                        geo_data = self._get_geo_data(np_file)
-                    except requests.exceptions.RequestException as req_e:
-                        logging.error("NET-POS: %s - RequestException: %s", np_file, req_e)
-                        self.skip.append(np_file)
-                        continue
-                    except json.JSONDecodeError as js_e:
-                        logging.error("NET-POS: %s - JSONDecodeError: %s, removing it...", np_file, js_e)
-                        os.remove(np_file)
-                        continue
-                    except OSError as os_e:
-                        logging.error("NET-POS: %s - OSError: %s", np_file, os_e)
-                        self.skip.append(np_file)
-                        continue
+                done = 0
+                last_display = time.monotonic()
+                try:
+                    with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                        futures = {executor.submit(self._get_geo_data, np_file): np_file for np_file in pending}
+                        for future in as_completed(futures):
+                            np_file = futures[future]
+                            done += 1
+                            try:
+                                geo_data = future.result()
+                            except requests.exceptions.RequestException as req_e:
+                                logging.error("NET-POS: %s - RequestException: %s", np_file, req_e)
+                                self.skip.add(np_file)
+                                continue
+                            except json.JSONDecodeError as js_e:
+                                logging.error("NET-POS: %s - JSONDecodeError: %s, removing it...", np_file, js_e)
+                                os.remove(np_file)
+                                continue
+                            except OSError as os_e:
+                                logging.error("NET-POS: %s - OSError: %s", np_file, os_e)
+                                self.skip.add(np_file)
+                                continue
 
-                    with open(geo_file, 'w+t') as sf:
-                        json.dump(geo_data, sf)
+                            geo_file = np_file.replace('.net-pos.json', '.geo.json')
+                            with open(geo_file, 'w+t') as sf:
+                                json.dump(geo_data, sf)
 
-                    reported.append(np_file)
-                    self.report.update(data={'reported': reported})
+                            self.ledger.add(np_file)
 
-                    display.set('status', f"Fetching positions ({idx + 1}/{len(new_np_files)})")
-                    display.update(force=True)
+                            # every forced refresh redraws the whole e-ink panel, keep them a few seconds apart
+                            now = time.monotonic()
+                            if now - last_display >= self.display_interval or done == len(pending):
+                                last_display = now
+                                display.set('status', f"Fetching positions ({done}/{len(pending)})")
+                                display.update(force=True)
+                finally:
+                    self.ledger.commit()
+                    if self.aps is not None:
+                        self.aps.ingest(self._list_files(handshake_dir, 'geo.json'))
+                    try:
+                        self.cache.save()
+                    except OSError as os_e:
+                        logging.error("NET-POS: Could not save the position cache: %s", os_e)
+                logging.info("NET-POS: Position cache hit rate %.0f%% (%d exact, %d near, %d misses)",
+                             self.cache.hit_rate() * 100, self.cache.stats['hits'],
+                             self.cache.stats['near_hits'], self.cache.stats['misses'])
 
     def on_handshake(self, agent, filename, access_point, client_station):
         netpos = self._get_netpos(agent)
@@ -109,6 +493,25 @@ class NetPos(plugins.Plugin):
                 json.dump(netpos, net_pos_file)
         except OSError as os_e:
             logging.error("NET-POS: %s", os_e)
+            return
+
+        # locate the capture right away when enough of its access points are already known
+        geo_data = self.aps.estimate(netpos) if self.aps is not None else None
+        if geo_data is not None:
+            geo_data["ts"] = netpos["ts"]
+            geo_filename = netpos_filename.replace('.net-pos.json', '.geo.json')
+            logging.debug("NET-POS: Saving offline position to %s", geo_filename)
+            try:
+                with open(geo_filename, 'w+t') as geo_file:
+                    json.dump(geo_data, geo_file)
+            except OSError as os_e:
+                logging.error("NET-POS: %s", os_e)
+
+    def _list_files(self, handshake_dir, ext):
+        catalog = open_catalog(handshake_dir)
+        if catalog is not None:
+            return [os.path.join(handshake_dir, name) for name, _, _ in catalog.entries(ext)]
+        return [os.path.join(handshake_dir, f) for f in os.listdir(handshake_dir) if f.endswith('.' + ext)]
 
     def _get_netpos(self, agent):
         aps = agent.get_access_points()
@@ -120,6 +523,21 @@ class NetPos(plugins.Plugin):
             })
         return netpos
 
+    def _make_session(self):
+        # one keep-alive connection per worker, 429 and 5xx answers are retried with backoff
+        retry_options = dict(total=3, backoff_factor=1, status_forcelist=(429, 500, 502, 503, 504),
+                             respect_retry_after_header=True)
+        try:
+            retry = Retry(allowed_methods=frozenset(['POST']), **retry_options)
+        except TypeError:
+            # urllib3 < 1.26
+            retry = Retry(method_whitelist=frozenset(['POST']), **retry_options)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.workers, max_retries=retry)
+        session = requests.Session()
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
+
     def _get_geo_data(self, path, timeout=30):
         geourl = self.API_URL.format(api=self.options['api_key'])
 
@@ -129,11 +547,23 @@ class NetPos(plugins.Plugin):
         except (json.JSONDecodeError, OSError) as e:
             raise e
 
-        try:
-            result = requests.post(geourl, json=data, timeout=timeout)
-            return_geo = result.json()
-            if data.get("ts"):
-                return_geo["ts"] = data["ts"]
-            return return_geo
-        except requests.exceptions.RequestException as req_e:
-            raise req_e
\ No newline at end of file
+        bssids = self.cache.bssids(data)
+        return_geo = self.cache.lookup(bssids)
+        if return_geo is None and self.aps is not None:
+            return_geo = self.aps.estimate(data)
+        if return_geo is None:
+            try:
+                result = self.session.post(geourl, json=data, timeout=timeout)
+                return_geo = result.json()
+            except requests.exceptions.RequestException as req_e:
+                raise req_e
+            self.cache.add(bssids, return_geo)
+        if data.get("ts"):
+            return_geo["ts"] = data["ts"]
+        return return_geo
+
+    def on_unload(self, ui):
+        if self.session is not None:
+            self.session.close()
+        if self.aps is not None:
+            self.aps.close()
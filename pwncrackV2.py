@@ -1,12 +1,145 @@
 import time
 import os
+import json
+import sys
+import shutil
 import subprocess
+import threading
 import requests
 import logging
 import socket
+from concurrent.futures import ThreadPoolExecutor
 from pwnagotchi.plugins import Plugin
 import pwnagotchi
 
+_plugin_dir = os.path.dirname(os.path.abspath(__file__))
+if _plugin_dir not in sys.path:
+    sys.path.append(_plugin_dir)
+try:
+    from handshake_catalog import open_catalog
+except ImportError:
+    def open_catalog(handshake_dir):
+        return None
+
+class ConversionCache:
+    """hc22000 output of every capture, keyed by file name, size and mtime, converted on a bounded worker pool."""
+
+    def __init__(self, cache_dir, workers=None):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+        self.executor = ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 1)
+        self.lock = threading.Lock()
+        self.pending = {}
+
+    def cache_path(self, pcap_path):
+        st = os.stat(pcap_path)
+        return os.path.join(self.cache_dir, f"{os.path.basename(pcap_path)}.{st.st_size}.{st.st_mtime_ns}.hc22000")
+
+    def submit(self, pcap_path):
+        # every worker runs its own hcxpcapngtool process
+        with self.lock:
+            future = self.pending.get(pcap_path)
+            if future is None or future.done():
+                future = self.executor.submit(self._convert, pcap_path)
+                self.pending[pcap_path] = future
+            return future
+
+    def _convert(self, pcap_path):
+        out_path = self.cache_path(pcap_path)
+        if os.path.exists(out_path):
+            return out_path
+        tmp_path = out_path + '.tmp'
+        subprocess.run(['hcxpcapngtool', '-o', tmp_path, pcap_path], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        if not os.path.exists(tmp_path):
+            # no hashes in this capture, remember that too
+            open(tmp_path, 'w').close()
+        os.replace(tmp_path, out_path)
+        return out_path
+
+    def outputs(self, pcap_paths):
+        """Cached hc22000 files for the given captures, converting only the ones not seen before."""
+        futures = [(path, self.submit(path)) for path in pcap_paths]
+        outputs = []
+        for path, future in futures:
+            try:
+                outputs.append(future.result())
+            except Exception as e:
+                logging.error(f"[pwncrack] Conversion failed for {path}: {e}")
+        with self.lock:
+            self.pending = {path: future for path, future in self.pending.items() if not future.done()}
+        self._prune(outputs)
+        return outputs
+
+    def _prune(self, current):
+        # drop outputs of older versions of the captures we just looked at
+        current = set(os.path.basename(path) for path in current)
+        names = set(name.rsplit('.', 3)[0] for name in current)
+        for name in os.listdir(self.cache_dir):
+            if name not in current and name.rsplit('.', 3)[0] in names:
+                os.remove(os.path.join(self.cache_dir, name))
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
+
+
+PER_PAGE = 100
+MAX_PER_PAGE = 1000
+
+RESULTS_TEMPLATE = '''<!DOCTYPE html><html lang="en"><head><meta charset="UTF-8"><meta name="csrf_token" content="{{ csrf_token() }}"><link href="https://fonts.cdnfonts.com/css/white-rabbit-2" rel="stylesheet"><title>{{ title }}</title><style>body{height:100%;background-color:#333;color:#fff;direction:ltr;font-family:"White Rabbit","Courier New",Courier,monospace;font-size:2em;font-variant-numeric:slashed-zero;text-align:center;text-shadow:0 1px 3px rgba(0,0,0,.5);unicode-bidi:bidi-override}h1,h3{color:#0C0;padding-bottom:10px;text-shadow:-1px-1px 0 rgba(0,0,0,.3)}a{color:#0C0;text-decoration:none}a:hover{font-weight:bold;text-decoration:underline}table{width:50%;border-collapse:collapse;margin:20px auto}table th,table td{border:1px solid#1e1e1e;padding:1rem;text-align:left;font-size:1.5rem}table thead{background-color:#1e1e1e}input{font-family:inherit;font-size:1.2rem;background-color:#1e1e1e;color:#fff;border:1px solid#0C0;padding:.3rem}.note{font-size:1em;margin-top:20px;line-height:1.5em}small{font-size:1.2rem;margin-bottom:1rem;display:block;line-height:1.5rem}@media(max-width:1199.98px){table{width:80%}table th,table td{font-size:2.5rem}}</style></head><body>
+{% macro link(p) %}?page={{ p }}&per_page={{ per_page }}{% if q %}&q={{ q|urlencode }}{% endif %}{% endmacro %}
+{% if error %}
+<p>Error loading results: {{ error }}</p>
+{% elif not exists %}
+<h3>No downloaded passwords yet.</h3>
+{% else %}
+<h1>Results</h1>
+<form method="get"><input type="text" name="q" value="{{ q }}" placeholder="search AP or password"> <input type="submit" value="Search"></form>
+<small>{{ total }} result{{ '' if total == 1 else 's' }}{% if q %} for "{{ q }}"{% endif %}</small>
+<table><thead><tr><th>AP</th><th>Pass</th></tr></thead><tbody>
+{% for ap, password in rows %}<tr><td>{{ ap }}</td><td>{{ password }}</td></tr>
+{% endfor %}</tbody></table>
+{% if pages > 1 %}<small>{% if page > 1 %}<a href="{{ link(1) }}">&laquo;</a> <a href="{{ link(page - 1) }}">&lsaquo;</a>{% endif %} page {{ page }} of {{ pages }} {% if page < pages %}<a href="{{ link(page + 1) }}">&rsaquo;</a> <a href="{{ link(pages) }}">&raquo;</a>{% endif %}</small>{% endif %}
+{% endif %}
+<div class="note"><p><a href="https://pwncrack.org" target="_blank">pwncrack.org</a><br />key: {{ key }}</p><p><a href="https://pwncrack.org/nets.html" target="_blank">Your Nets</a> | <a href="https://pwncrack.org/leaderboard.html" target="_blank">Leaderboard</a> | <a href="https://pwncrack.org/stats.html" target="_blank">Global Stats</a></p></div></body></html>'''
+
+
+class PotfileCache:
+    """Parsed (AP, password) rows of the potfile, re-read only when the file changes."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.signature = None
+        self.rows = []
+
+    def get(self, path):
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return None
+        signature = (st.st_ino, st.st_size, st.st_mtime_ns)
+        with self.lock:
+            if signature != self.signature:
+                rows = []
+                with open(path, 'r', errors='replace') as file:
+                    for line in file:
+                        bits = line.strip().split(":")
+                        # passwords may contain colons themselves
+                        if len(bits) >= 5:
+                            AP = bits[3]
+                            Pass = ":".join(bits[4:])
+                            rows.append((AP, Pass, f'{AP}\n{Pass}'.lower()))
+                self.rows = rows
+                self.signature = signature
+            return self.rows
+
+    def query(self, path, q=''):
+        rows = self.get(path)
+        if rows is None:
+            return None
+        q = q.lower()
+        return [(AP, Pass) for AP, Pass, needle in rows if not q or q in needle]
+
+
 class UploadConvertPluginV2(Plugin):
     __author__ = 'Terminatoror'
     __version__ = '1.0.1.5'
@@ -19,6 +152,10 @@ class UploadConvertPluginV2(Plugin):
         self.timewait = 600
         self.last_run_time = 0
         self.key = ""
+        self.results = PotfileCache()
+        self.results_template = None
+        self.timeout = 30
+        self.cache = None
 
     def on_loaded(self):
         logging.info('[pwncrack] loading')
@@ -31,6 +168,15 @@ class UploadConvertPluginV2(Plugin):
         self.potfile_path = os.path.join(self.handshake_dir, 'cracked.pwncrack.potfile')
         self.last_upload_path = os.path.join(self.handshake_dir, '.pwncrack_last_up')
         self.timewait = self.options.get('timewait', 600)
+        if self.cache is None:
+            self.cache = ConversionCache(os.path.join(self.handshake_dir, '.pwncrack_cache'),
+                                         self.options.get('workers'))
+
+    def on_handshake(self, agent, filename, access_point, client_station):
+        # convert right away so the upload only has to concatenate
+        if self.cache and self.options.get('convert_on_capture', True) and \
+                not any(item in os.path.basename(filename) for item in self.whitelist):
+            self.cache.submit(filename)
 
     def on_internet_available(self, agent):
         display = agent.view()
@@ -54,20 +200,33 @@ class UploadConvertPluginV2(Plugin):
         except Exception as e:
             logging.error(f"[pwncrack] Error occurred during upload process: {e}", exc_info=True)
 
+    def _new_pcap_files(self, last_up_time):
+        # pcaps changed since the last upload, excluding files matching whitelist items
+        catalog = open_catalog(self.handshake_dir)
+        if catalog is not None:
+            names = [name for name, _, _ in catalog.entries('pcap', newer_than_ns=int(last_up_time * 1e9))]
+        else:
+            names = [f for f in os.listdir(self.handshake_dir)
+                     if f.endswith('.pcap') and os.path.getmtime(os.path.join(self.handshake_dir, f)) > last_up_time]
+        return [f for f in names if not any(item in f for item in self.whitelist)]
+
     def _convert_and_upload(self):
         # Convert all .pcap files to .hc22000, excluding files matching whitelist items
         last_up_time = os.path.getmtime(self.last_upload_path) if os.path.isfile(self.last_upload_path) else 0
-        pcap_files = [f for f in os.listdir(self.handshake_dir)
-                      if f.endswith('.pcap') and os.path.getmtime(os.path.join(self.handshake_dir,f)) > last_up_time and not any(item in f for item in self.whitelist)]
+        pcap_files = self._new_pcap_files(last_up_time)
         if pcap_files:
             tmp_file = os.path.join(self.handshake_dir, '.pwncrack_uploading')
             with open(tmp_file, 'w') as fout:
                 fout.write("\n".join(pcap_files))
 
-            # write list of files to a temporary marker file. move to real path if success
-            for pcap_file in pcap_files:
-                subprocess.run(['hcxpcapngtool', '-o', self.combined_file, os.path.join(self.handshake_dir, pcap_file)])
-                self.last_run_time = time.time()   # because it can take a while with a lot of pcaps
+            # conversions are cached per capture, a retry after a failed upload converts nothing
+            pcap_paths = [os.path.join(self.handshake_dir, f) for f in pcap_files]
+            outputs = self.cache.outputs(pcap_paths)
+            with open(self.combined_file, 'wb') as combined:
+                for output in outputs:
+                    with open(output, 'rb') as part:
+                        shutil.copyfileobj(part, combined)
+            self.last_run_time = time.time()   # because it can take a while with a lot of pcaps
 
             # Ensure the combined file is created
             if not os.path.exists(self.combined_file):
@@ -90,47 +249,112 @@ class UploadConvertPluginV2(Plugin):
             logging.info("[pwncrack] No .pcap files found to convert (or all files are whitelisted).")
 
     def _download_potfile(self):
-        response = requests.get(self.potfile_url, params={'key': self.key})
-        if response.status_code == 200:
-            with open(self.potfile_path, 'w') as file:
-                file.write(response.text)
-            logging.info(f"[pwncrack] Potfile downloaded to {self.potfile_path}")
-        else:
-            logging.error(f"[pwncrack] Failed to download potfile: {response.status_code}")
-            logging.error(f"[pwncrack] {response.json()}")  # Log the error message from the server
+        # conditional GET, the validators of the last download are kept next to the potfile
+        meta_path = self.potfile_path + '.http'
+        download_path = self.potfile_path + '.download'
+        try:
+            with open(meta_path, 'r') as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            meta = {}
+        headers = {}
+        if os.path.isfile(self.potfile_path):
+            if meta.get('etag'):
+                headers['If-None-Match'] = meta['etag']
+            if meta.get('last_modified'):
+                headers['If-Modified-Since'] = meta['last_modified']
+        try:
+            with requests.get(self.potfile_url, params={'key': self.key}, headers=headers,
+                              timeout=self.timeout, stream=True) as response:
+                if response.status_code == 304:
+                    logging.info("[pwncrack] Potfile not modified since last download")
+                    return
+                if response.status_code != 200:
+                    logging.error(f"[pwncrack] Failed to download potfile: {response.status_code}")
+                    logging.error(f"[pwncrack] {response.text}")
+                    return
+                with open(download_path, 'wb') as out:
+                    for chunk in response.iter_content(chunk_size=64 * 1024):
+                        out.write(chunk)
+                meta = {'etag': response.headers.get('ETag'), 'last_modified': response.headers.get('Last-Modified')}
+            added = self._merge_potfile(download_path)
+            with open(meta_path, 'w') as f:
+                json.dump(meta, f)
+            logging.info(f"[pwncrack] Potfile downloaded, {added} new lines merged into {self.potfile_path}")
+        except requests.RequestException as e:
+            logging.error(f"[pwncrack] Network error downloading potfile: {e}")
+        finally:
+            if os.path.exists(download_path):
+                os.remove(download_path)
+
+    def _merge_potfile(self, download_path):
+        """Append lines we don't have yet, swapping the file in whole so readers never see a partial write."""
+        known = set()
+        if os.path.isfile(self.potfile_path):
+            with open(self.potfile_path, 'rb') as f:
+                known = set(line.strip() for line in f if line.strip())
+        new_lines = []
+        with open(download_path, 'rb') as f:
+            for line in f:
+                line = line.strip()
+                if line and line not in known:
+                    known.add(line)
+                    new_lines.append(line)
+        if not new_lines:
+            return 0
+        tmp_path = self.potfile_path + '.tmp'
+        with open(tmp_path, 'w+b') as out:
+            if os.path.isfile(self.potfile_path):
+                with open(self.potfile_path, 'rb') as f:
+                    shutil.copyfileobj(f, out)
+                if out.tell():
+                    out.seek(-1, os.SEEK_END)
+                    if out.read(1) != b'\n':
+                        out.write(b'\n')
+            out.write(b'\n'.join(new_lines) + b'\n')
+            out.flush()
+            os.fsync(out.fileno())
+        os.replace(tmp_path, self.potfile_path)
+        return len(new_lines)
 
     def on_unload(self, ui):
         logging.info('[pwncrack] unloading')
+        if self.cache:
+            self.cache.shutdown()
 
     def on_webhook(self, path, request):
-        from flask import abort
-        from flask import render_template_string
-        html_head = '<!DOCTYPE html><html lang="en"><head><meta charset="UTF-8"><meta name="csrf_token" content="{{ csrf_token() }}"><link href="https://fonts.cdnfonts.com/css/white-rabbit-2" rel="stylesheet"><title>#title#</title><style>body{height:100%;background-color:#333;color:#fff;direction:ltr;font-family:"White Rabbit","Courier New",Courier,monospace;font-size:2em;font-variant-numeric:slashed-zero;text-align:center;text-shadow:0 1px 3px rgba(0,0,0,.5);unicode-bidi:bidi-override}h1,h3{color:#0C0;padding-bottom:10px;text-shadow:-1px-1px 0 rgba(0,0,0,.3)}a{color:#0C0;text-decoration:none}a:hover{font-weight:bold;text-decoration:underline}table{width:50%;border-collapse:collapse;margin:20px auto}table th,table td{border:1px solid#1e1e1e;padding:1rem;text-align:left;font-size:1.5rem}table thead{background-color:#1e1e1e}.note{font-size:1em;margin-top:20px;line-height:1.5em}small{font-size:1.2rem;margin-bottom:1rem;display:block;line-height:1.5rem}@media(max-width:1199.98px){table{width:80%}table th,table td{font-size:2.5rem}}</style></head><body>'
-        html_foot = f'<div class="note"><p><a href="https://pwncrack.org" target="_blank">pwncrack.org</a><br />key: {self.key}</p><p><a href="https://pwncrack.org/nets.html" target="_blank">Your Nets</a> | <a href="https://pwncrack.org/leaderboard.html" target="_blank">Leaderboard</a> | <a href="https://pwncrack.org/stats.html" target="_blank">Global Stats</a></p></div></body></html>'
-        if not os.path.isfile(self.potfile_path):
-            html_page  = html_head.replace('#title#','pwncrack | No Passwords!')
-            html_page += '<h3>No downloaded passwords yet.</h3>'
-            html_page += html_foot
-            return render_template_string(html_page), 200
+        from flask import abort, current_app, jsonify, render_template
+        if request.method != "GET":
+            abort(405)
+        if path == "/" or not path:
+            api = False
+        elif path == "api/results":
+            api = True
+        else:
+            abort(404)
+        if self.results_template is None:
+            self.results_template = current_app.jinja_env.from_string(RESULTS_TEMPLATE)
+        q = request.args.get('q', '').strip()
+        try:
+            per_page = min(MAX_PER_PAGE, max(1, int(request.args.get('per_page', PER_PAGE))))
+            page = max(1, int(request.args.get('page', 1)))
+        except ValueError:
+            per_page, page = PER_PAGE, 1
         try:
-            if request.method == "GET":
-                if path == "/" or not path:
-                    html_page  = html_head.replace('#title#','pwncrack | Passwords!')
-                    html_page += '<h1>Results</h1><table><thead><tr><th>AP</th><th>Pass</th></tr></thead><tbody>'
-                    with open(self.potfile_path, 'r') as file:
-                        for line in file:
-                            bits = line.strip().split(":")
-                            if len(bits) >= 5:
-                                _,_,_,AP,Pass = bits
-                                html_page += f'<tr><td>{AP}</td><td>{Pass}</td></tr>'
-                    html_page += '</tbody></table>'
-                    html_page += html_foot
-                    return render_template_string(html_page), 200
-                else:
-                    abort(404)
+            rows = self.results.query(self.potfile_path, q)
+            exists = rows is not None
+            total = len(rows) if exists else 0
+            pages = max(1, (total + per_page - 1) // per_page)
+            page = min(page, pages)
+            rows = rows[(page - 1) * per_page:page * per_page] if exists else []
+            if api:
+                return jsonify(total=total, page=page, pages=pages, per_page=per_page, q=q,
+                               results=[{'ap': AP, 'password': Pass} for AP, Pass in rows])
+            title = 'pwncrack | Passwords!' if exists else 'pwncrack | No Passwords!'
+            return render_template(self.results_template, title=title, exists=exists, error=None, rows=rows, q=q,
+                                   total=total, page=page, pages=pages, per_page=per_page, key=self.key), 200
         except Exception as e:
             logging.error(f"[pwncrack] {repr(e)}")
-            html_page  = html_head.replace('#title#','pwncrack | Error!')
-            html_page += repr(e)
-            html_page += html_foot
-            return render_template_string(html_page), 404
+            if api:
+                return jsonify(error=repr(e)), 500
+            return render_template(self.results_template, title='pwncrack | Error!', error=repr(e), key=self.key), 500
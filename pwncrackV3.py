@@ -1,10 +1,344 @@
 import time
 import os
+import json
+import sys
+import shutil
+import mmap
+import gzip
+import hashlib
 import subprocess
+import threading
 import requests
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from pwnagotchi.plugins import Plugin
 
+_plugin_dir = os.path.dirname(os.path.abspath(__file__))
+if _plugin_dir not in sys.path:
+    sys.path.append(_plugin_dir)
+try:
+    from handshake_catalog import open_catalog
+except ImportError:
+    def open_catalog(handshake_dir):
+        return None
+
+class ConversionCache:
+    """hc22000 output of every capture, keyed by file name, size and mtime, converted on a bounded worker pool."""
+
+    def __init__(self, cache_dir, workers=None):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+        self.executor = ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 1)
+        self.lock = threading.Lock()
+        self.pending = {}
+
+    def cache_path(self, pcap_path):
+        st = os.stat(pcap_path)
+        return os.path.join(self.cache_dir, f"{os.path.basename(pcap_path)}.{st.st_size}.{st.st_mtime_ns}.hc22000")
+
+    def submit(self, pcap_path):
+        # every worker runs its own hcxpcapngtool process
+        with self.lock:
+            future = self.pending.get(pcap_path)
+            if future is None or future.done():
+                future = self.executor.submit(self._convert, pcap_path)
+                self.pending[pcap_path] = future
+            return future
+
+    def _convert(self, pcap_path):
+        out_path = self.cache_path(pcap_path)
+        if os.path.exists(out_path):
+            return out_path
+        tmp_path = out_path + '.tmp'
+        subprocess.run(['hcxpcapngtool', '-o', tmp_path, pcap_path], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        if not os.path.exists(tmp_path):
+            # no hashes in this capture, remember that too
+            open(tmp_path, 'w').close()
+        os.replace(tmp_path, out_path)
+        return out_path
+
+    def outputs(self, pcap_paths):
+        """Cached hc22000 files for the given captures, converting only the ones not seen before."""
+        futures = [(path, self.submit(path)) for path in pcap_paths]
+        outputs = []
+        for path, future in futures:
+            try:
+                outputs.append(future.result())
+            except Exception as e:
+                logging.error(f"[pwncrack] Conversion failed for {path}: {e}")
+        with self.lock:
+            self.pending = {path: future for path, future in self.pending.items() if not future.done()}
+        self._prune(outputs)
+        return outputs
+
+    def _prune(self, current):
+        # drop outputs of older versions of the captures we just looked at
+        current = set(os.path.basename(path) for path in current)
+        names = set(name.rsplit('.', 3)[0] for name in current)
+        for name in os.listdir(self.cache_dir):
+            if name not in current and name.rsplit('.', 3)[0] in names:
+                os.remove(os.path.join(self.cache_dir, name))
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
+
+
+class BloomFilter:
+    def __init__(self, capacity, hashes=7):
+        # ~10 bits per entry keeps false positives around 1%
+        self.size = max(64 * 1024, capacity * 10)
+        self.hashes = hashes
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, digest):
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:16], 'little') | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, digest):
+        for pos in self._positions(digest):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, digest):
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(digest))
+
+
+class UploadLedger:
+    """Digests of every hc22000 line the server accepted.
+
+    A sorted, compacted file is searched in place, lines accepted since the last
+    compaction sit in an append-only log loaded into a set, and a Bloom filter
+    in front answers most lookups for new lines without touching either.
+    """
+
+    DIGEST_SIZE = 16
+    COMPACT_AFTER = 4096
+
+    def __init__(self, path):
+        self.path = path
+        self.log_path = path + '.log'
+        self.lock = threading.Lock()
+        self.load()
+
+    @classmethod
+    def digest(cls, line):
+        return hashlib.blake2b(line.strip(), digest_size=cls.DIGEST_SIZE).digest()
+
+    def _read_records(self, path):
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return []
+        usable = len(data) - len(data) % self.DIGEST_SIZE
+        return [data[i:i + self.DIGEST_SIZE] for i in range(0, usable, self.DIGEST_SIZE)]
+
+    def load(self):
+        with self.lock:
+            self.compacted = os.path.getsize(self.path) // self.DIGEST_SIZE if os.path.exists(self.path) else 0
+            self.recent = set(self._read_records(self.log_path))
+            self.bloom = BloomFilter(self.compacted + len(self.recent) + self.COMPACT_AFTER)
+            for digest in self.recent:
+                self.bloom.add(digest)
+            if self.compacted:
+                with open(self.path, 'rb') as f:
+                    while True:
+                        chunk = f.read(self.DIGEST_SIZE * 4096)
+                        if not chunk:
+                            break
+                        for i in range(0, len(chunk) - self.DIGEST_SIZE + 1, self.DIGEST_SIZE):
+                            self.bloom.add(chunk[i:i + self.DIGEST_SIZE])
+
+    def _in_compacted(self, digest):
+        if not self.compacted:
+            return False
+        with open(self.path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+            lo, hi = 0, self.compacted
+            while lo < hi:
+                mid = (lo + hi) // 2
+                record = m[mid * self.DIGEST_SIZE:(mid + 1) * self.DIGEST_SIZE]
+                if record == digest:
+                    return True
+                if record < digest:
+                    lo = mid + 1
+                else:
+                    hi = mid
+        return False
+
+    def __contains__(self, digest):
+        with self.lock:
+            if digest not in self.bloom:
+                return False
+            return digest in self.recent or self._in_compacted(digest)
+
+    def add_all(self, digests):
+        with self.lock:
+            new = [d for d in digests if d not in self.recent]
+            with open(self.log_path, 'ab') as f:
+                f.write(b''.join(new))
+                f.flush()
+                os.fsync(f.fileno())
+            for digest in new:
+                self.recent.add(digest)
+                self.bloom.add(digest)
+        if len(self.recent) >= self.COMPACT_AFTER:
+            self.compact()
+
+    def compact(self):
+        """Merge the log into the sorted file, dropping duplicates."""
+        with self.lock:
+            merged = sorted(set(self._read_records(self.path)) | self.recent)
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'wb') as f:
+                f.write(b''.join(merged))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+            open(self.log_path, 'wb').close()
+            logging.info(f"[pwncrack] Compacted upload ledger to {len(merged)} entries")
+        self.load()
+
+
+class UploadSpool:
+    """Gzip-compressed chunks of hash lines waiting for the server, kept on disk until acknowledged.
+
+    A chunk the server keeps rejecting is moved to the dead/ subdirectory so
+    the chunks after it still go out; moving it back retries it.
+    """
+
+    def __init__(self, spool_dir, chunk_lines=500):
+        self.spool_dir = spool_dir
+        self.dead_dir = os.path.join(spool_dir, 'dead')
+        self.chunk_lines = chunk_lines
+        os.makedirs(spool_dir, exist_ok=True)
+        # a chunk without its digests was interrupted while being written
+        for name in os.listdir(spool_dir):
+            base, ext = os.path.splitext(name)
+            if name.endswith('.tmp') or (ext == '.gz' and not os.path.exists(os.path.join(spool_dir, base + '.digests'))):
+                os.remove(os.path.join(spool_dir, name))
+
+    def _path(self, name, ext):
+        return os.path.join(self.spool_dir, name + ext)
+
+    def pending(self):
+        """Chunk names in the order they were spooled."""
+        return sorted(name[:-len('.digests')] for name in os.listdir(self.spool_dir) if name.endswith('.digests'))
+
+    def pending_digests(self):
+        digests = set()
+        for name in self.pending():
+            digests.update(self.read_digests(name))
+        return digests
+
+    def read_digests(self, name):
+        with open(self._path(name, '.digests'), 'rb') as f:
+            data = f.read()
+        size = UploadLedger.DIGEST_SIZE
+        return [data[i:i + size] for i in range(0, len(data) - size + 1, size)]
+
+    def read_payload(self, name):
+        with open(self._path(name, '.gz'), 'rb') as f:
+            return f.read()
+
+    def _write(self, path, data):
+        with open(path + '.tmp', 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + '.tmp', path)
+
+    def add(self, lines, digests):
+        stamp = int(time.time() * 1000)
+        for seq, start in enumerate(range(0, len(lines), self.chunk_lines)):
+            name = f"{stamp:013d}-{seq:04d}"
+            payload = b''.join(line + b'\n' for line in lines[start:start + self.chunk_lines])
+            self._write(self._path(name, '.gz'), gzip.compress(payload))
+            self._write(self._path(name, '.digests'), b''.join(digests[start:start + self.chunk_lines]))
+
+    def ack(self, name):
+        os.remove(self._path(name, '.digests'))
+        os.remove(self._path(name, '.gz'))
+        if os.path.exists(self._path(name, '.attempts')):
+            os.remove(self._path(name, '.attempts'))
+
+    def reject(self, name):
+        """Record one more rejected upload of a chunk, returns how many there were."""
+        try:
+            with open(self._path(name, '.attempts'), 'r') as f:
+                attempts = int(f.read() or 0) + 1
+        except (OSError, ValueError):
+            attempts = 1
+        self._write(self._path(name, '.attempts'), str(attempts).encode())
+        return attempts
+
+    def bury(self, name):
+        os.makedirs(self.dead_dir, exist_ok=True)
+        for ext in ('.gz', '.digests'):
+            os.replace(self._path(name, ext), os.path.join(self.dead_dir, name + ext))
+        os.remove(self._path(name, '.attempts'))
+
+UPLOAD_MAX_ATTEMPTS = 5
+GZIP_RETRY_AFTER = 7 * 24 * 3600
+
+
+PER_PAGE = 100
+MAX_PER_PAGE = 1000
+
+RESULTS_TEMPLATE = '''<!DOCTYPE html><html lang="en"><head><meta charset="UTF-8"><link href="https://fonts.cdnfonts.com/css/white-rabbit-2" rel="stylesheet"><title>{{ title }}</title><style>body{height:100%;background-color:#333;color:#fff;direction:ltr;font-family:"White Rabbit","Courier New",Courier,monospace;font-size:2em;font-variant-numeric:slashed-zero;text-align:center;text-shadow:0 1px 3px rgba(0,0,0,.5);unicode-bidi:bidi-override}h1,h3{color:#0C0;padding-bottom:10px;text-shadow:-1px-1px 0 rgba(0,0,0,.3)}a{color:#0C0;text-decoration:none}a:hover{font-weight:bold;text-decoration:underline}table{width:50%;border-collapse:collapse;margin:20px auto}table th,table td{border:1px solid#1e1e1e;padding:1rem;text-align:left;font-size:1.5rem}table thead{background-color:#1e1e1e}input{font-family:inherit;font-size:1.2rem;background-color:#1e1e1e;color:#fff;border:1px solid#0C0;padding:.3rem}.note{font-size:1em;margin-top:20px;line-height:1.5em}small{font-size:1.2rem;margin-bottom:1rem;display:block;line-height:1.5rem}@media(max-width:1199.98px){table{width:80%}table th,table td{font-size:2.5rem}}</style></head><body>
+{% macro link(p) %}?page={{ p }}&per_page={{ per_page }}{% if q %}&q={{ q|urlencode }}{% endif %}{% endmacro %}
+{% if error %}
+<p>Error loading results: {{ error }}</p>
+{% elif not exists %}
+<h3>No downloaded passwords yet.</h3>
+{% else %}
+<h1>Results</h1>
+<form method="get"><input type="text" name="q" value="{{ q }}" placeholder="search AP or password"> <input type="submit" value="Search"></form>
+<small>{{ total }} result{{ '' if total == 1 else 's' }}{% if q %} for "{{ q }}"{% endif %}</small>
+<table><thead><tr><th>AP</th><th>Pass</th></tr></thead><tbody>
+{% for ap, password in rows %}<tr><td>{{ ap }}</td><td>{{ password }}</td></tr>
+{% endfor %}</tbody></table>
+{% if pages > 1 %}<small>{% if page > 1 %}<a href="{{ link(1) }}">&laquo;</a> <a href="{{ link(page - 1) }}">&lsaquo;</a>{% endif %} page {{ page }} of {{ pages }} {% if page < pages %}<a href="{{ link(page + 1) }}">&rsaquo;</a> <a href="{{ link(pages) }}">&raquo;</a>{% endif %}</small>{% endif %}
+{% endif %}
+<div class="note"><p><a href="https://pwncrack.org" target="_blank">pwncrack.org</a><br />key: {{ key }}</p><p><a href="https://pwncrack.org/nets.html" target="_blank">Your Nets</a> | <a href="https://pwncrack.org/leaderboard.html" target="_blank">Leaderboard</a> | <a href="https://pwncrack.org/stats.html" target="_blank">Global Stats</a></p></div></body></html>'''
+
+
+class PotfileCache:
+    """Parsed (AP, password) rows of the potfile, re-read only when the file changes."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.signature = None
+        self.rows = []
+
+    def get(self, path):
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return None
+        signature = (st.st_ino, st.st_size, st.st_mtime_ns)
+        with self.lock:
+            if signature != self.signature:
+                rows = []
+                with open(path, 'r', errors='replace') as file:
+                    for line in file:
+                        bits = line.strip().split(":")
+                        # passwords may contain colons themselves
+                        if len(bits) >= 5:
+                            AP = bits[3]
+                            Pass = ":".join(bits[4:])
+                            rows.append((AP, Pass, f'{AP}\n{Pass}'.lower()))
+                self.rows = rows
+                self.signature = signature
+            return self.rows
+
+    def query(self, path, q=''):
+        rows = self.get(path)
+        if rows is None:
+            return None
+        q = q.lower()
+        return [(AP, Pass) for AP, Pass, needle in rows if not q or q in needle]
+
+
 class UploadConvertPlugin(Plugin):
     __author__ = 'Terminatoror'
     __version__ = '1.0.2'
@@ -18,7 +352,13 @@ class UploadConvertPlugin(Plugin):
         self.timewait = 600
         self.last_run_time = 0
         self.key = ""
+        self.results = PotfileCache()
+        self.results_template = None
         self.timeout = 30  # Added standard timeout for web requests
+        self.cache = None
+        self.ledger = None
+        self.spool = None
+        self.session = requests.Session()  # keep-alive across chunks and runs
 
     def on_loaded(self):
         logging.info('[pwncrack] loading')
@@ -27,10 +367,24 @@ class UploadConvertPlugin(Plugin):
         self.handshake_dir = config["bettercap"].get("handshakes")
         self.key = self.options.get('key', "")
         self.whitelist = config["main"].get("whitelist", [])
-        self.combined_file = os.path.join(self.handshake_dir, 'combined.hc22000')
         self.potfile_path = os.path.join(self.handshake_dir, 'cracked.pwncrack.potfile')
         self.last_upload_path = os.path.join(self.handshake_dir, '.pwncrack_last_up')
+        self.plain_uploads_path = os.path.join(self.handshake_dir, '.pwncrack_plain_uploads')
         self.timewait = self.options.get('timewait', 600)
+        if self.cache is None:
+            self.cache = ConversionCache(os.path.join(self.handshake_dir, '.pwncrack_cache'),
+                                         self.options.get('workers'))
+        if self.ledger is None:
+            self.ledger = UploadLedger(os.path.join(self.handshake_dir, '.pwncrack_ledger'))
+        if self.spool is None:
+            self.spool = UploadSpool(os.path.join(self.handshake_dir, '.pwncrack_spool'),
+                                     self.options.get('chunk_lines', 500))
+
+    def on_handshake(self, agent, filename, access_point, client_station):
+        # convert right away so the upload only has to concatenate
+        if self.cache and self.options.get('convert_on_capture', True) and \
+                not any(item in os.path.basename(filename) for item in self.whitelist):
+            self.cache.submit(filename)
 
     def on_internet_available(self, agent):
         current_time = time.time()
@@ -54,107 +408,232 @@ class UploadConvertPlugin(Plugin):
         except Exception as e:
             logging.error(f"[pwncrack] Error occurred during upload process: {e}", exc_info=True)
 
+    def _new_pcap_files(self, last_up_time):
+        # pcaps changed since the last upload, excluding files matching whitelist items
+        catalog = open_catalog(self.handshake_dir)
+        if catalog is not None:
+            names = [name for name, _, _ in catalog.entries('pcap', newer_than_ns=int(last_up_time * 1e9))]
+        else:
+            names = [f for f in os.listdir(self.handshake_dir)
+                     if f.endswith('.pcap') and os.path.getmtime(os.path.join(self.handshake_dir, f)) > last_up_time]
+        return [f for f in names if not any(item in f for item in self.whitelist)]
+
     def _convert_and_upload(self):
         last_up_time = os.path.getmtime(self.last_upload_path) if os.path.isfile(self.last_upload_path) else 0
         
-        pcap_files = [
-            f for f in os.listdir(self.handshake_dir)
-            if f.endswith('.pcap') 
-            and os.path.getmtime(os.path.join(self.handshake_dir, f)) > last_up_time 
-            and not any(item in f for item in self.whitelist)
-        ]
+        pcap_files = self._new_pcap_files(last_up_time)
         
-        if not pcap_files:
+        if pcap_files:
+            self._spool_new_hashes(pcap_files)
+        else:
             logging.info("[pwncrack] No .pcap files found to convert (or all files are whitelisted).")
-            return
+        self._flush_spool()
 
+    def _spool_new_hashes(self, pcap_files):
         tmp_file = os.path.join(self.handshake_dir, '.pwncrack_uploading')
         with open(tmp_file, 'w') as fout:
             fout.write("\n".join(pcap_files))
 
         try:
-            # OPTIMIZATION: Pass all pcap files to hcxpcapngtool at once instead of looping
+            # conversions are cached per capture, a retry after a failed upload converts nothing
             pcap_paths = [os.path.join(self.handshake_dir, f) for f in pcap_files]
-            cmd = ['hcxpcapngtool', '-o', self.combined_file] + pcap_paths
-            subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-            
-            self.last_run_time = time.time()
-
-            if not os.path.exists(self.combined_file) or os.path.getsize(self.combined_file) == 0:
-                logging.info("[pwncrack] No valid handshakes extracted from pcaps.")
-                os.rename(tmp_file, self.last_upload_path)  # Mark as processed anyway
-                return
+            outputs = self.cache.outputs(pcap_paths)
+            # only spool lines the server has not accepted and that are not already waiting
+            seen = self.spool.pending_digests()
+            lines, digests = [], []
+            for output in outputs:
+                with open(output, 'rb') as part:
+                    for line in part:
+                        line = line.strip()
+                        if not line:
+                            continue
+                        digest = UploadLedger.digest(line)
+                        if digest in seen or digest in self.ledger:
+                            continue
+                        seen.add(digest)
+                        lines.append(line)
+                        digests.append(digest)
 
-            with open(self.combined_file, 'rb') as file:
-                files = {'handshake': file}
-                data = {'key': self.key}
-                response = requests.post(self.server_url, files=files, data=data, timeout=self.timeout)
+            self.last_run_time = time.time()
 
-            if response.status_code == 200:
-                logging.info(f"[pwncrack] Upload successful: {response.text}")
-                os.rename(tmp_file, self.last_upload_path)
+            if lines:
+                self.spool.add(lines, digests)
+                logging.info(f"[pwncrack] Spooled {len(lines)} new hashes for upload.")
             else:
-                logging.error(f"[pwncrack] Upload failed with status {response.status_code}: {response.text}")
-
+                logging.info("[pwncrack] No new handshakes to upload.")
+            # the hashes are safe in the spool now, the pcaps count as processed
+            os.rename(tmp_file, self.last_upload_path)
         finally:
-            # Ensure cleanup happens even if upload fails
-            if os.path.exists(self.combined_file):
-                os.remove(self.combined_file)
-            if os.path.exists(tmp_file) and not os.path.exists(self.last_upload_path):
-                # If tmp_file wasn't renamed, clean it up so we don't pollute the dir
+            if os.path.exists(tmp_file):
                 os.remove(tmp_file)
 
+    def _upload(self, name, payload, compress):
+        """POST one chunk, returns the HTTP status or None when the server could not be reached."""
+        if compress:
+            files = {'handshake': (f'{name}.hc22000.gz', payload, 'application/gzip')}
+        else:
+            files = {'handshake': (f'{name}.hc22000', gzip.decompress(payload), 'application/octet-stream')}
+        try:
+            response = self.session.post(self.server_url, files=files, data={'key': self.key}, timeout=self.timeout)
+        except requests.RequestException as e:
+            logging.error(f"[pwncrack] Upload interrupted: {e}")
+            return None
+        if response.status_code != 200:
+            logging.error(f"[pwncrack] Upload failed with status {response.status_code}: {response.text}")
+        return response.status_code
+
+    def _compress_uploads(self):
+        if not self.options.get('compress_uploads', True):
+            return False
+        # after the server turned gzip down, plain uploads only, with a new try once a week
+        try:
+            return time.time() - os.path.getmtime(self.plain_uploads_path) > GZIP_RETRY_AFTER
+        except OSError:
+            return True
+
+    def _flush_spool(self):
+        """Upload spooled chunks oldest first; a chunk leaves the spool once the server answers 200.
+
+        Unreachable or failing servers (5xx, 429) stop the run, the rest is
+        retried later. Any other answer rejects that chunk: a gzip part is sent
+        again plain right away, and if that goes through gzip is switched off for
+        the server. A chunk rejected UPLOAD_MAX_ATTEMPTS times moves to the dead
+        letter directory, the ones after it carry on.
+        """
+        pending = self.spool.pending()
+        compress = self._compress_uploads()
+        for done, name in enumerate(pending):
+            payload = self.spool.read_payload(name)
+            status = self._upload(name, payload, compress)
+            if compress and status is not None and status != 200 and status < 500 and status != 429:
+                status = self._upload(name, payload, False)
+                if status == 200:
+                    logging.warning("[pwncrack] Server did not take the gzip upload, uploading plain from now on")
+                    compress = False
+                    with open(self.plain_uploads_path, 'w'):
+                        pass
+            if status is None or status >= 500 or status == 429:
+                logging.error(f"[pwncrack] {len(pending) - done} chunks left in spool")
+                return
+            if status != 200:
+                attempts = self.spool.reject(name)
+                if attempts >= UPLOAD_MAX_ATTEMPTS:
+                    self.spool.bury(name)
+                    logging.error(f"[pwncrack] Chunk {name} rejected {attempts} times, moved to {self.spool.dead_dir}")
+                continue
+            digests = self.spool.read_digests(name)
+            self.ledger.add_all(digests)
+            self.spool.ack(name)
+            logging.info(f"[pwncrack] Upload successful ({len(digests)} hashes)")
+
     def _download_potfile(self):
+        # conditional GET, the validators of the last download are kept next to the potfile
+        meta_path = self.potfile_path + '.http'
+        download_path = self.potfile_path + '.download'
         try:
-            response = requests.get(self.potfile_url, params={'key': self.key}, timeout=self.timeout)
-            if response.status_code == 200:
-                with open(self.potfile_path, 'w') as file:
-                    file.write(response.text)
-                logging.info(f"[pwncrack] Potfile downloaded to {self.potfile_path}")
-            else:
-                logging.error(f"[pwncrack] Failed to download potfile: {response.status_code}")
-                logging.error(f"[pwncrack] {response.text}")
+            with open(meta_path, 'r') as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            meta = {}
+        headers = {}
+        if os.path.isfile(self.potfile_path):
+            if meta.get('etag'):
+                headers['If-None-Match'] = meta['etag']
+            if meta.get('last_modified'):
+                headers['If-Modified-Since'] = meta['last_modified']
+        try:
+            with self.session.get(self.potfile_url, params={'key': self.key}, headers=headers,
+                                  timeout=self.timeout, stream=True) as response:
+                if response.status_code == 304:
+                    logging.info("[pwncrack] Potfile not modified since last download")
+                    return
+                if response.status_code != 200:
+                    logging.error(f"[pwncrack] Failed to download potfile: {response.status_code}")
+                    logging.error(f"[pwncrack] {response.text}")
+                    return
+                with open(download_path, 'wb') as out:
+                    for chunk in response.iter_content(chunk_size=64 * 1024):
+                        out.write(chunk)
+                meta = {'etag': response.headers.get('ETag'), 'last_modified': response.headers.get('Last-Modified')}
+            added = self._merge_potfile(download_path)
+            with open(meta_path, 'w') as f:
+                json.dump(meta, f)
+            logging.info(f"[pwncrack] Potfile downloaded, {added} new lines merged into {self.potfile_path}")
         except requests.RequestException as e:
             logging.error(f"[pwncrack] Network error downloading potfile: {e}")
+        finally:
+            if os.path.exists(download_path):
+                os.remove(download_path)
+
+    def _merge_potfile(self, download_path):
+        """Append lines we don't have yet, swapping the file in whole so readers never see a partial write."""
+        known = set()
+        if os.path.isfile(self.potfile_path):
+            with open(self.potfile_path, 'rb') as f:
+                known = set(line.strip() for line in f if line.strip())
+        new_lines = []
+        with open(download_path, 'rb') as f:
+            for line in f:
+                line = line.strip()
+                if line and line not in known:
+                    known.add(line)
+                    new_lines.append(line)
+        if not new_lines:
+            return 0
+        tmp_path = self.potfile_path + '.tmp'
+        with open(tmp_path, 'w+b') as out:
+            if os.path.isfile(self.potfile_path):
+                with open(self.potfile_path, 'rb') as f:
+                    shutil.copyfileobj(f, out)
+                if out.tell():
+                    out.seek(-1, os.SEEK_END)
+                    if out.read(1) != b'\n':
+                        out.write(b'\n')
+            out.write(b'\n'.join(new_lines) + b'\n')
+            out.flush()
+            os.fsync(out.fileno())
+        os.replace(tmp_path, self.potfile_path)
+        return len(new_lines)
 
     def on_unload(self, ui):
         logging.info('[pwncrack] unloading')
+        if self.cache:
+            self.cache.shutdown()
+        self.session.close()
 
     def on_webhook(self, path, request):
-        from flask import abort, render_template_string
-        
-        html_head = '<!DOCTYPE html><html lang="en"><head><meta charset="UTF-8"><link href="https://fonts.cdnfonts.com/css/white-rabbit-2" rel="stylesheet"><title>#title#</title><style>body{height:100%;background-color:#333;color:#fff;direction:ltr;font-family:"White Rabbit","Courier New",Courier,monospace;font-size:2em;font-variant-numeric:slashed-zero;text-align:center;text-shadow:0 1px 3px rgba(0,0,0,.5);unicode-bidi:bidi-override}h1,h3{color:#0C0;padding-bottom:10px;text-shadow:-1px-1px 0 rgba(0,0,0,.3)}a{color:#0C0;text-decoration:none}a:hover{font-weight:bold;text-decoration:underline}table{width:50%;border-collapse:collapse;margin:20px auto}table th,table td{border:1px solid#1e1e1e;padding:1rem;text-align:left;font-size:1.5rem}table thead{background-color:#1e1e1e}.note{font-size:1em;margin-top:20px;line-height:1.5em}small{font-size:1.2rem;margin-bottom:1rem;display:block;line-height:1.5rem}@media(max-width:1199.98px){table{width:80%}table th,table td{font-size:2.5rem}}</style></head><body>'
-        html_foot = f'<div class="note"><p><a href="https://pwncrack.org" target="_blank">pwncrack.org</a><br />key: {self.key}</p><p><a href="https://pwncrack.org/nets.html" target="_blank">Your Nets</a> | <a href="https://pwncrack.org/leaderboard.html" target="_blank">Leaderboard</a> | <a href="https://pwncrack.org/stats.html" target="_blank">Global Stats</a></p></div></body></html>'
-        
-        if not os.path.isfile(self.potfile_path):
-            html_page  = html_head.replace('#title#','pwncrack | No Passwords!')
-            html_page += '<h3>No downloaded passwords yet.</h3>'
-            html_page += html_foot
-            return render_template_string(html_page), 200
-            
+        from flask import abort, current_app, jsonify, render_template
+        if request.method != "GET":
+            abort(405)
+        if path == "/" or not path:
+            api = False
+        elif path == "api/results":
+            api = True
+        else:
+            abort(404)
+        if self.results_template is None:
+            self.results_template = current_app.jinja_env.from_string(RESULTS_TEMPLATE)
+        q = request.args.get('q', '').strip()
         try:
-            if request.method == "GET":
-                if path == "/" or not path:
-                    html_page  = html_head.replace('#title#','pwncrack | Passwords!')
-                    html_page += '<h1>Results</h1><table><thead><tr><th>AP</th><th>Pass</th></tr></thead><tbody>'
-                    
-                    with open(self.potfile_path, 'r') as file:
-                        for line in file:
-                            bits = line.strip().split(":")
-                            # BUGFIX: Safely handle passwords that contain colon characters
-                            if len(bits) >= 5:
-                                AP = bits[3]
-                                Pass = ":".join(bits[4:])
-                                html_page += f'<tr><td>{AP}</td><td>{Pass}</td></tr>'
-                                
-                    html_page += '</tbody></table>'
-                    html_page += html_foot
-                    return render_template_string(html_page), 200
-                else:
-                    abort(404)
+            per_page = min(MAX_PER_PAGE, max(1, int(request.args.get('per_page', PER_PAGE))))
+            page = max(1, int(request.args.get('page', 1)))
+        except ValueError:
+            per_page, page = PER_PAGE, 1
+        try:
+            rows = self.results.query(self.potfile_path, q)
+            exists = rows is not None
+            total = len(rows) if exists else 0
+            pages = max(1, (total + per_page - 1) // per_page)
+            page = min(page, pages)
+            rows = rows[(page - 1) * per_page:page * per_page] if exists else []
+            if api:
+                return jsonify(total=total, page=page, pages=pages, per_page=per_page, q=q,
+                               results=[{'ap': AP, 'password': Pass} for AP, Pass in rows])
+            title = 'pwncrack | Passwords!' if exists else 'pwncrack | No Passwords!'
+            return render_template(self.results_template, title=title, exists=exists, error=None, rows=rows, q=q,
+                                   total=total, page=page, pages=pages, per_page=per_page, key=self.key), 200
         except Exception as e:
             logging.error(f"[pwncrack] Webhook error: {repr(e)}")
-            html_page  = html_head.replace('#title#','pwncrack | Error!')
-            html_page += f'<p>Error loading results: {repr(e)}</p>'
-            html_page += html_foot
-            return render_template_string(html_page), 500
\ No newline at end of file
+            if api:
+                return jsonify(error=repr(e)), 500
+            return render_template(self.results_template, title='pwncrack | Error!', error=repr(e), key=self.key), 500
@@ -1,8 +1,20 @@
 import logging
 import os
+import io
+import csv
+import json
 import glob
+import threading
 import pwnagotchi.plugins as plugins
-from flask import abort, send_from_directory, render_template_string, request, make_response
+from flask import abort, send_from_directory, render_template_string, request, Response, stream_with_context
+
+PER_PAGE = 100
+MAX_PER_PAGE = 1000
+EXPORT_FORMATS = {
+    "txt": ("text/plain; charset=utf-8", "txt"),
+    "csv": ("text/csv; charset=utf-8", "csv"),
+    "jsonl": ("application/x-ndjson; charset=utf-8", "jsonl"),
+}
 
 TEMPLATE = """
 {% extends "base.html" %}
@@ -101,70 +113,57 @@ TEMPLATE = """
 {% endblock %}
 {% block script %}
     var searchInput = document.getElementById("searchText");
-    searchInput.onkeyup = function() {
-        var filter, table, tr, td, i, j, txtValue, rowContainsFilter;
-        filter = searchInput.value.toUpperCase();
-        table = document.getElementById("tableOptions");
-        if (table) {
-            tr = table.getElementsByTagName("tr");
-
-            for (i = 0; i < tr.length; i++) {
-                // Skip header rows if they exist and you don't want to filter them
-                // For example, if your header is in a <thead>, you could get rows from <tbody> instead
-                // Or check if tr[i].parentNode.tagName === 'THEAD' and continue
-
-                rowContainsFilter = false; // Flag to check if any td in the current row matches
-                tds = tr[i].getElementsByTagName("td");
-
-                for (j = 0; j < tds.length; j++) {
-                    let currentTd = tds[j];
-                    if (currentTd) {
-                        txtValue = currentTd.textContent || currentTd.innerText;
-                        if (txtValue.toUpperCase().indexOf(filter) > -1) {
-                            rowContainsFilter = true;
-                            break; // Found a match in this row, no need to check other tds
-                        }
-                    }
-                }
-
-                if (rowContainsFilter) {
-                    tr[i].style.display = "";
-                } else {
-                    // Only hide if it's not a header row (th)
-                    // This check is basic, if you have th in tbody, you might need a more specific check
-                    if (tr[i].getElementsByTagName("th").length === 0) {
-                        tr[i].style.display = "none";
-                    }
-                }
-            }
+    searchInput.onkeyup = function(e) {
+        if (e.key === "Enter") {
+            document.getElementById("searchForm").submit();
         }
     }
 {% endblock %}
 
 {% block content %}
-    <input type="text" id="searchText" placeholder="Search for ..." title="Type in a filter">
+    {% macro link(p=page, o=order, so=show_other) -%}
+        ?order={{ o }}&show_other={{ 1 if so else 0 }}&page={{ p }}&per_page={{ per_page }}&q={{ q | urlencode }}
+    {%- endmacro %}
+    <form id="searchForm" method="get">
+        <input type="hidden" name="order" value="{{ order }}">
+        <input type="hidden" name="show_other" value="{{ 1 if show_other else 0 }}">
+        <input type="hidden" name="per_page" value="{{ per_page }}">
+        <input type="text" id="searchText" name="q" value="{{ q }}" placeholder="Search for ..." title="Type in a filter and press enter">
+    </form>
     <div style="margin-bottom:10px;">
     Sort:
     {% if order == "asc" %}
         <strong>Ascending</strong> |
-        <a href="?order=desc">Descending</a>
+        <a href="{{ link(p=1, o='desc') }}">Descending</a>
     {% else %}
-        <a href="?order=asc">Ascending</a> |
+        <a href="{{ link(p=1, o='asc') }}">Ascending</a> |
         <strong>Descending</strong>
     {% endif %}
     |
-    <a href="?order={{ order }}&export=1">Export Results</a>
+    {% if show_other %}
+        <a href="{{ link(so=False) }}">Hide Other</a>
+    {% else %}
+        <a href="{{ link(so=True) }}">Show Other</a>
+    {% endif %}
+    |
+    Export:
+    <a href="{{ link() }}&export=1">Text</a> |
+    <a href="{{ link() }}&export=1&format=csv">CSV</a> |
+    <a href="{{ link() }}&export=1&format=jsonl">JSON Lines</a>
     </div>
     <table id="tableOptions">
         <tr>
             <th>SSID</th>
             <th>Password</th>
+            {% if show_other %}
             <th>Other</th>
+            {% endif %}
         </tr>
         {% for p in passwords %}
             <tr>
                 <td data-label="SSID">{{p["ssid"]}}</td>
                 <td data-label="Password">{{p["password"]}}</td>
+                {% if show_other %}
                 <td data-label="Other">
                     {% set other = p.get("other_fields") %}
                     {% if other %}
@@ -177,20 +176,179 @@ TEMPLATE = """
                         <span>None</span>
                     {% endif %}
                 </td>
+                {% endif %}
             </tr>
         {% endfor %}
     </table>
+    <div style="margin-top:10px;">
+    {% if page > 1 %}
+        <a href="{{ link(p=page - 1) }}">&laquo; Previous</a> |
+    {% endif %}
+    Page {{ page }} of {{ pages }} ({{ total }} passwords)
+    {% if page < pages %}
+        | <a href="{{ link(p=page + 1) }}">Next &raquo;</a>
+    {% endif %}
+    </div>
 {% endblock %}
 """
 
+class PotfileIndex:
+    """Merged (ssid, password) entries of every potfile, tailing each file from its last byte offset.
+
+    Parsed rows are kept per file: a potfile that was replaced (new inode, as
+    an atomic rewrite does), truncated or removed is re-read on its own and the
+    merged entries are rebuilt from memory, the other potfiles aren't touched.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.files = {}  # path -> [inode, offset, unfinished last line, rows]
+        self.entries = {}
+        self.sorted_cache = {}
+
+    def update(self, base_dir):
+        with self.lock:
+            paths = sorted(glob.glob(os.path.join(base_dir, "*.potfile")))
+            stats = {}
+            for pf_path in paths:
+                try:
+                    stats[pf_path] = os.stat(pf_path)
+                except OSError:
+                    continue
+            remerge = False
+            for pf_path in [p for p in self.files if p not in stats]:
+                del self.files[pf_path]
+                remerge = True
+            for pf_path, st in stats.items():
+                state = self.files.get(pf_path)
+                if state is not None and (st.st_ino != state[0] or st.st_size < state[1]):
+                    # rotated or truncated, earlier lines may be gone
+                    logging.info("[sorted_pwn] %s was replaced, re-reading it" % pf_path)
+                    state = None
+                    remerge = True
+                if state is None:
+                    state = self.files[pf_path] = [st.st_ino, 0, b"", []]
+                if st.st_size > state[1]:
+                    rows = self._read_from(pf_path, state)
+                elif state[2]:
+                    # unchanged since the last read, so the held back line is all there is: no trailing newline
+                    rows = self._parse_lines([state[2]])
+                    state[2] = b""
+                    state[3].extend(rows)
+                else:
+                    continue
+                if not remerge:
+                    self._merge(rows)
+            if remerge:
+                self.entries = {}
+                self.sorted_cache = {}
+                for pf_path in sorted(self.files):
+                    self._merge(self.files[pf_path][3])
+
+    def _read_from(self, pf_path, state):
+        logging.info("[sorted_pwn] reading %s from byte %d" % (pf_path, state[1]))
+        with open(pf_path, "rb") as f:
+            f.seek(state[1])
+            data = f.read()
+        state[1] += len(data)
+        # a line still being written waits for its newline, or for the next update to find the file unchanged
+        complete, _, state[2] = (state[2] + data).rpartition(b"\n")
+        rows = self._parse_lines(complete.split(b"\n"))
+        state[3].extend(rows)
+        return rows
+
+    def _parse_lines(self, raw_lines):
+        rows = []
+        for raw in raw_lines:
+            line = raw.decode("utf-8", errors="ignore").strip()
+            if not line or ":" not in line:
+                continue
+            fields = line.split(":")
+            if len(fields) < 2:
+                continue
+
+            # to deal with both pwncrack and wpa-sec format
+            ssid = fields[-2].strip() # 2nd to last
+            password = fields[-1].strip() # last one
+            other_fields = fields[:-2]   # everything before ssid/password (bssid, client)
+            rows.append((ssid, password, other_fields))
+        return rows
+
+    def _merge(self, rows):
+        added = 0
+        for ssid, password, other_fields in rows:
+            key = (ssid, password)
+            if key not in self.entries:
+                self.entries[key] = {
+                    "ssid": ssid,
+                    "password": password,
+                    "other_fields": other_fields,   # list of other fields usually bssid etc.
+                }
+                added += 1
+            else: # keep additional occurrences if you want
+                self.entries[key].setdefault("duplicates", []).append({
+                    "other_fields": other_fields
+                })
+        if added:
+            self.sorted_cache = {}
+
+    def sorted(self, reverse=False):
+        with self.lock:
+            if reverse not in self.sorted_cache:
+                self.sorted_cache[reverse] = sorted(self.entries.values(), key=lambda x: (x["ssid"].lower(), x["password"]), reverse=reverse)
+            return self.sorted_cache[reverse]
+
+    def query(self, reverse=False, q=""):
+        passwords = self.sorted(reverse)
+        if q:
+            needle = q.lower()
+            passwords = [p for p in passwords if needle in p["ssid"].lower() or needle in p["password"].lower()]
+        return passwords
+
+
+def other_text(p):
+    other = p.get("other_fields")
+    if isinstance(other, list):
+        other = ", ".join(other)
+    return other or ""
+
+
+def export_lines(passwords, fmt, show_other):
+    """Yield the export one row at a time so the response never holds the whole file."""
+    if fmt == "csv":
+        buf = io.StringIO()
+        writer = csv.writer(buf)
+        writer.writerow(["SSID", "Password", "Other"] if show_other else ["SSID", "Password"])
+        for p in passwords:
+            writer.writerow([p["ssid"], p["password"], other_text(p)] if show_other else [p["ssid"], p["password"]])
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+        yield buf.getvalue()
+    elif fmt == "jsonl":
+        for p in passwords:
+            row = {"ssid": p["ssid"], "password": p["password"]}
+            if show_other:
+                row["other"] = p.get("other_fields") or []
+            yield json.dumps(row) + "\n"
+    else:
+        yield "SSID\tPassword\tOther\n"
+        for p in passwords:
+            if show_other:
+                yield "%s:%s:%s\n" % (p.get("ssid", ""), p.get("password", ""), other_text(p))
+            else:
+                yield "%s:%s\n" % (p.get("ssid", ""), p.get("password", ""))
+
+
 class sorted_pwn(plugins.Plugin):
     __author__ = '37124354+dbukovac@users.noreply.github.com edited by avipars'
-    __version__ = '0.0.2.6'
+    __version__ = '0.0.3'
     __license__ = 'GPL3'
     __description__ = 'List cracked passwords from any potfile found in the handshakes directory'
     __github__ = 'https://github.com/evilsocket/pwnagotchi-plugins-contrib/blob/df9758065bd672354b3fa2a3299f4a8d80c8fd6a/wpa-sec-list.py'
     def __init__(self):
         self.ready = False
+        self.index = PotfileIndex()
 
     def on_loaded(self):
         logging.info("[sorted_pwn] plugin loaded")
@@ -204,89 +362,50 @@ class sorted_pwn(plugins.Plugin):
             return "Plugin not ready"
 
         if path == "/" or not path:
+            export = request.args.get("export", "0") == "1"
+            fmt = request.args.get("format", "txt").lower()
+            if export and fmt not in EXPORT_FORMATS:
+                abort(400)
             try:
                 order = request.args.get("order", "asc").lower()
                 reverse_sort = order == "desc"
-                export = request.args.get("export", "0") == "1"
-                show_other = request.args.get("show_other", "0") == "1" # TODO hide other fields in table if user wants
+                # the table shows other fields unless asked not to, exports leave them out unless asked
+                show_other = request.args.get("show_other", "0" if export else "1") == "1"
+                q = request.args.get("q", "").strip()
                 base_dir = self.config['bettercap']['handshakes']
-                potfile_paths = glob.glob(os.path.join(base_dir, "*.potfile"))
-
-                unique_entries = {}
-                for pf_path in potfile_paths:
-                    logging.info("[sorted_pwn] trying to open %s" % pf_path)
-                    with open(pf_path, "r", encoding="utf-8", errors="ignore") as f:
-                        for line in f:
-                            line = line.strip()
-                            if not line or ":" not in line:
-                                continue
-                            fields = line.split(":")
-                            if len(fields) < 2:
-                                continue
-
-                            # to deal with both pwncrack and wpa-sec format
-                            ssid = fields[-2].strip() # 2nd to last
-                            password = fields[-1].strip() # last one
-                            other_fields = fields[:-2]   # everything before ssid/password (bssid, client)
-
-                            key = (ssid, password)
-                            if key not in unique_entries:
-                                unique_entries[key] = {
-                                    "ssid": ssid,
-                                    "password": password,
-                                    "other_fields": other_fields,   # list of other fields usually bssid etc.
-                                }
-                            else: # keep additional occurrences if you want
-                                unique_entries[key].setdefault("duplicates", []).append({ 
-                                    "other_fields": other_fields   
-                                })
-
-                sorted_passwords = sorted(unique_entries.values(), key=lambda x: (x["ssid"].lower(), x["password"]), reverse=reverse_sort)  # Convert to sorted list
-
-                html = render_template_string(
-                    TEMPLATE,
-                    title="Unique Passwords List",
-                    passwords=sorted_passwords,
-                    order=order
-                )
+                self.index.update(base_dir)
+                passwords = self.index.query(reverse_sort, q)
 
                 if export:
-                    lines = []
-                    lines.append("SSID\tPassword\tOther")
-
-                    for p in sorted_passwords:
-
-                        if show_other:
-                            other = p.get("other_fields")
-                            if isinstance(other, list):
-                                other = ", ".join(other)
-
-                            lines.append(
-                                "%s:%s:%s" % (
-                                    p.get("ssid", ""),
-                                    p.get("password", ""),
-                                    other or ""
-                                )
-                            )
-                        else:
-                                lines.append(
-                                "%s:%s" % (
-                                    p.get("ssid", ""),
-                                    p.get("password", ""),
-                                )
-                            )
-
-                    txt_data = "\n".join(lines)
-
-                    response = make_response(txt_data)
-                    response.headers["Content-Type"] = "text/plain; charset=utf-8"
+                    content_type, suffix = EXPORT_FORMATS[fmt]
+                    response = Response(stream_with_context(export_lines(passwords, fmt, show_other)), content_type=content_type)
                     response.headers["Content-Disposition"] = (
-                        "attachment; filename=sorted_pwn_passwords_%s.txt" % order
+                        "attachment; filename=sorted_pwn_passwords_%s.%s" % (order, suffix)
                     )
                     return response
-                return html
 
-              
+                try:
+                    per_page = min(MAX_PER_PAGE, max(1, int(request.args.get("per_page", PER_PAGE))))
+                    page = max(1, int(request.args.get("page", 1)))
+                except ValueError:
+                    per_page, page = PER_PAGE, 1
+                total = len(passwords)
+                pages = max(1, (total + per_page - 1) // per_page)
+                page = min(page, pages)
+
+                return render_template_string(
+                    TEMPLATE,
+                    title="Unique Passwords List",
+                    passwords=passwords[(page - 1) * per_page:page * per_page],
+                    order=order,
+                    show_other=show_other,
+                    q=q,
+                    page=page,
+                    pages=pages,
+                    per_page=per_page,
+                    total=total
+                )
+
             except Exception as e:
                 logging.error("[sorted_pwn] error while loading potfiles: %s" % e)
                 logging.debug(e, exc_info=True)
@@ -1,9 +1,20 @@
 #!/usr/bin/env python3
+import io
 import os
+import sys
 import logging
 import subprocess
+import re
+import json
+import math
+import hashlib
+import tarfile
+import tempfile
 import threading
 import asyncio
+import concurrent.futures
+import zipfile
+from array import array
 from time import sleep, time
 
 # CRITICAL: Monkey-patch APScheduler BEFORE importing telegram.ext
@@ -35,6 +46,7 @@ except Exception as e:
 # NOW import telegram (which will use the patched APScheduler)
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, BotCommand
 from telegram.ext import Application, CommandHandler, CallbackQueryHandler, MessageHandler, filters, ContextTypes
+from telegram.error import RetryAfter
 import pwnagotchi
 import pwnagotchi.plugins as plugins
 import pwnagotchi.ui.view as view
@@ -43,6 +55,19 @@ import requests
 import psutil
 import schedule
 from datetime import datetime
+try:
+    from PIL import Image, ImageDraw
+except ImportError:
+    Image = None
+
+_plugin_dir = os.path.dirname(os.path.abspath(__file__))
+if _plugin_dir not in sys.path:
+    sys.path.append(_plugin_dir)
+try:
+    from handshake_catalog import open_catalog
+except ImportError:
+    def open_catalog(handshake_dir):
+        return None
 
 # Suppress verbose HTTP logging from telegram library
 logging.getLogger("httpx").setLevel(logging.WARNING)
@@ -65,6 +90,28 @@ MILESTONE_LEVELS = [100, 500, 1000, 5000, 10000]
 
 WEBHOOK_FILE = "/etc/pwnagotchi/telepwn_webhooks.toml"
 SCHEDULE_FILE = "/etc/pwnagotchi/telepwn_schedules.toml"
+COUNTER_FILE = "/etc/pwnagotchi/telepwn_counter.json"
+DELIVERY_SPOOL = "/etc/pwnagotchi/telepwn_delivery.json"
+DELIVERY_WINDOW = 60
+DELIVERY_MAX_QUEUE = 100
+DELIVERY_RETRY = 30
+DELIVERY_SEND_TIMEOUT = 300
+BACKUP_SOURCES = ["/etc/pwnagotchi/"]  # plus the handshakes directory
+BACKUP_STATE_DIR = "/root/.telepwn_backup"
+BACKUP_FULL_EVERY = 7
+BACKUP_META = ".telepwn_backup.json"
+STATS_INTERVAL = 15
+STATS_FIELDS = ("cpu", "memory", "temp", "disk_read", "disk_write", "handshake_rate")
+STATS_WINDOWS = {"hour": 3600, "day": 86400}
+LOG_LINES = 50
+LOG_MAX_LINES = 200
+LOG_LEVELS = {"DEBUG": 10, "INFO": 20, "WARNING": 30, "ERROR": 40, "CRITICAL": 50}
+LOG_TAIL_BLOCK = 8192
+LOG_TAIL_MAX_BYTES = 4 * 1024 * 1024
+FOLLOW_POLL = 2
+FOLLOW_BATCH_INTERVAL = 5
+FOLLOW_MAX_LINES = 40
+FOLLOW_TIMEOUT = 1800
 
 INITIAL_MENU = [[InlineKeyboardButton("📋 Menu", callback_data="show_menu")]]
 
@@ -96,6 +143,831 @@ MAIN_MENU = [
 ]
 
 
+class HandshakeCounter:
+    """Number of files in the handshake directory, kept current without a scan per handshake.
+
+    With the shared catalog the count comes from its counters and is refreshed
+    by its change listener. Without it, the count is the same number of regular,
+    non-hidden files, persisted with the directory mtime of the last listing. A
+    restart trusts the saved count while that mtime is unchanged. The directory
+    is listed again at most once per run, on the first handshake event after it
+    changed. From then on each event for a file not seen before adds one, and
+    bettercap appending to a known capture changes nothing. Files that other
+    tools add or remove are picked up by the next listing.
+    """
+
+    def __init__(self, handshake_dir, path=COUNTER_FILE, on_change=None):
+        self.logger = logging.getLogger("TelePwn")
+        self.handshake_dir = handshake_dir
+        self.path = path
+        self.on_change = on_change
+        self.lock = threading.Lock()
+        self.count = 0
+        self.names = None  # listed lazily, see handshake_saved()
+        self.dir_mtime_ns = None
+        self.catalog = None
+
+        state = {}
+        try:
+            with open(path, "r") as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            self.logger.warning(f"[TelePwn] Ignoring unreadable counter state: {e}")
+
+        self.catalog = open_catalog(handshake_dir)
+        if self.catalog is not None:
+            self.count = self.catalog.count()
+        elif state.get("count") is not None and state.get("dir_mtime_ns") is not None \
+                and state["dir_mtime_ns"] == self._dir_mtime_ns():
+            self.count = state["count"]
+            self.dir_mtime_ns = state["dir_mtime_ns"]
+        else:
+            self._rescan()
+
+        # milestones below the count at first start belong to old captures, don't announce them
+        reached = [level for level in MILESTONE_LEVELS if level <= self.count]
+        self.milestone = state.get("milestone", reached[-1] if reached else 0)
+        self._save()
+        if self.catalog is not None:
+            self.catalog.add_listener(self._catalog_changed)
+
+    def _dir_mtime_ns(self):
+        try:
+            return os.stat(self.handshake_dir).st_mtime_ns
+        except OSError:
+            return None
+
+    def _rescan(self):
+        dir_mtime_ns = self._dir_mtime_ns()
+        try:
+            with os.scandir(self.handshake_dir) as it:
+                self.names = {entry.name for entry in it if not entry.name.startswith(".") and entry.is_file()}
+            self.count = len(self.names)
+            self.dir_mtime_ns = dir_mtime_ns
+        except OSError as e:
+            self.logger.error(f"[TelePwn] Cannot scan {self.handshake_dir}: {e}")
+
+    def _save(self):
+        tmp_path = self.path + ".tmp"
+        try:
+            with open(tmp_path, "w") as f:
+                # dir_mtime_ns is the directory as of the last listing, newer captures make the next start list it again
+                json.dump({"count": self.count, "dir_mtime_ns": self.dir_mtime_ns, "milestone": self.milestone}, f)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            self.logger.warning(f"[TelePwn] Failed to save counter state: {e}")
+
+    def close(self):
+        if self.catalog is not None:
+            self.catalog.remove_listener(self._catalog_changed)
+
+    def _catalog_changed(self, changed, removed):
+        with self.lock:
+            count = self.catalog.count()
+            if count == self.count:
+                return
+            self.count = count
+            self._save()
+        if self.on_change:
+            self.on_change()
+
+    def handshake_saved(self, filename):
+        """Account for a handshake event: one more file, or nothing when the capture was already counted."""
+        if self.catalog is not None or not filename:
+            # the catalog sees the file on its own and calls back
+            return
+        name = os.path.basename(filename)
+        with self.lock:
+            count = self.count
+            if self.names is None:
+                if self._dir_mtime_ns() == self.dir_mtime_ns:
+                    # no file added or removed since the saved count
+                    return
+                self._rescan()
+            elif name not in self.names and not name.startswith(".") \
+                    and os.path.isfile(os.path.join(self.handshake_dir, name)):
+                self.names.add(name)
+                self.count += 1
+            if self.count == count:
+                return
+            self._save()
+        if self.on_change:
+            self.on_change()
+
+    def next_milestone(self):
+        """The milestone level just crossed, if any. Each level is returned once."""
+        with self.lock:
+            crossed = [level for level in MILESTONE_LEVELS if self.milestone < level <= self.count]
+            if not crossed:
+                return None
+            self.milestone = crossed[-1]
+            self._save()
+            return self.milestone
+
+
+class DeliveryQueue:
+    """Coalesces handshake notifications into one digest message and one bundle per window.
+
+    The first capture opens a window of `window` seconds; everything captured
+    until it closes is sent together by `sender(batch)` on the worker thread.
+    A capture of a file already queued is merged into its entry. Above
+    `max_entries` the oldest (policy "drop_oldest") or the incoming
+    ("drop_newest") entry is dropped and only counted. The queue and the batch
+    in flight are spooled to disk, so captures made while the bot is
+    reconnecting, or before a restart, are still delivered.
+    """
+
+    POLICIES = ("drop_oldest", "drop_newest")
+
+    def __init__(self, sender, path=DELIVERY_SPOOL, window=DELIVERY_WINDOW, max_entries=DELIVERY_MAX_QUEUE,
+                 policy="drop_oldest"):
+        self.logger = logging.getLogger("TelePwn")
+        self.sender = sender
+        self.path = path
+        self.window = window
+        self.max_entries = max(1, max_entries)
+        self.policy = policy if policy in self.POLICIES else "drop_oldest"
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.stop = threading.Event()
+        self.entries = {}
+        self.dropped = 0
+        self.opened = None
+        self.inflight = None
+        try:
+            with open(path, "r") as f:
+                state = json.load(f)
+            self.entries = {entry["key"]: entry for entry in state.get("entries", [])}
+            self.dropped = state.get("dropped", 0)
+            self.inflight = state.get("inflight")
+            if self.entries:
+                self.opened = min(entry["first"] for entry in self.entries.values())
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            self.logger.warning(f"[TelePwn] Ignoring unreadable delivery spool: {e}")
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _save(self):
+        tmp_path = self.path + ".tmp"
+        try:
+            with open(tmp_path, "w") as f:
+                json.dump({"entries": list(self.entries.values()), "dropped": self.dropped,
+                           "inflight": self.inflight}, f)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            self.logger.warning(f"[TelePwn] Failed to spool deliveries: {e}")
+
+    def add(self, path, ap_name, client_mac):
+        now = time()
+        key = path or f"{ap_name}/{client_mac}"
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                entry["count"] += 1
+                entry["last"] = now
+                entry["client"] = client_mac
+            elif len(self.entries) >= self.max_entries and self.policy == "drop_newest":
+                self.dropped += 1
+            else:
+                if len(self.entries) >= self.max_entries:
+                    oldest = min(self.entries, key=lambda k: self.entries[k]["first"])
+                    del self.entries[oldest]
+                    self.dropped += 1
+                self.entries[key] = {"key": key, "path": path, "ap": ap_name, "client": client_mac,
+                                     "count": 1, "first": now, "last": now}
+            if self.opened is None:
+                self.opened = now
+            self._save()
+        self.wakeup.set()
+
+    def close(self):
+        self.stop.set()
+        self.wakeup.set()
+
+    def _take_batch(self):
+        """The batch to send now, or the number of seconds to wait for one."""
+        with self.lock:
+            if self.inflight is not None:
+                return self.inflight
+            if self.opened is None:
+                return None
+            remaining = self.opened + self.window - time()
+            if remaining > 0:
+                return remaining
+            self.inflight = {"entries": sorted(self.entries.values(), key=lambda e: e["first"]),
+                             "dropped": self.dropped, "message_sent": False}
+            self.entries = {}
+            self.dropped = 0
+            self.opened = None
+            self._save()
+            return self.inflight
+
+    def _run(self):
+        while not self.stop.is_set():
+            batch = self._take_batch()
+            if not isinstance(batch, dict):
+                self.wakeup.wait(batch)
+                self.wakeup.clear()
+                continue
+            try:
+                self.sender(batch)
+            except RetryAfter as e:
+                retry_after = e.retry_after
+                if hasattr(retry_after, "total_seconds"):
+                    retry_after = retry_after.total_seconds()
+                self.logger.warning(f"[TelePwn] Telegram flood control, retrying delivery in {retry_after}s")
+                self.stop.wait(float(retry_after) + 1)
+                continue
+            except ConnectionError:
+                # bot is (re)connecting, the batch stays spooled
+                self.stop.wait(DELIVERY_RETRY)
+                continue
+            except Exception as e:
+                self.logger.warning(f"[TelePwn] Handshake delivery failed, retrying in {DELIVERY_RETRY}s: {e}")
+                with self.lock:
+                    # the digest may already be out, don't send it twice
+                    self._save()
+                self.stop.wait(DELIVERY_RETRY)
+                continue
+            with self.lock:
+                self.inflight = None
+                self._save()
+
+
+class BackupManager:
+    """Incremental backups of BACKUP_SOURCES and the handshakes directory.
+
+    The manifest keeps (size, mtime_ns, sha256) per file of the last uploaded
+    snapshot. A run only hashes files whose size or mtime moved and archives the
+    ones whose content changed, plus the list of deleted paths, into a delta.
+    Every `full_every` deltas (or on request) a full snapshot restarts the chain.
+    Each archive starts with a BACKUP_META member describing its place in the
+    chain, which is all telepwn_restore.py needs to replay it.
+    """
+
+    def __init__(self, sources=None, state_dir=BACKUP_STATE_DIR, full_every=BACKUP_FULL_EVERY):
+        self.logger = logging.getLogger("TelePwn")
+        self.sources = sources or BACKUP_SOURCES + [HANDSHAKE_DIR]
+        self.state_dir = state_dir
+        self.full_every = full_every
+        self.lock = threading.Lock()
+        self.state = {"seq": 0, "full_seq": None, "deltas_since_full": 0, "files": {}}
+        try:
+            with open(os.path.join(state_dir, "manifest.json"), "r") as f:
+                self.state.update(json.load(f))
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            self.logger.warning(f"[TelePwn] Unreadable backup manifest, next backup will be full: {e}")
+
+    @staticmethod
+    def _hash(path):
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(block)
+        return digest.hexdigest()
+
+    def _scan(self):
+        state_dir = os.path.abspath(self.state_dir) + os.sep
+        for source in self.sources:
+            for root, dirs, files in os.walk(source):
+                for name in files:
+                    path = os.path.join(root, name)
+                    if path.startswith(state_dir) or name.endswith(".tmp"):
+                        continue
+                    try:
+                        st = os.stat(path)
+                    except OSError:
+                        continue
+                    yield path, st
+
+    def prepare(self, full=False):
+        """Build the next archive.
+
+        Returns (fileobj, name, meta, state) to upload and then pass to commit(),
+        or None when nothing changed since the last backup. The archive is an
+        unnamed temporary file in the state directory: on the SD card rather than
+        in /tmp, which is RAM on most images, and gone once closed.
+        """
+        old = self.state["files"]
+        full = full or self.state["full_seq"] is None or self.state["deltas_since_full"] + 1 >= self.full_every
+        files = {}
+        changed = []
+        for path, st in self._scan():
+            known = old.get(path)
+            if known and known[0] == st.st_size and known[1] == st.st_mtime_ns:
+                files[path] = known
+                if full:
+                    changed.append(path)
+                continue
+            try:
+                digest = self._hash(path)
+            except OSError as e:
+                self.logger.warning(f"[TelePwn] Skipping {path} in backup: {e}")
+                continue
+            files[path] = [st.st_size, st.st_mtime_ns, digest]
+            if full or not known or known[2] != digest:
+                changed.append(path)
+        deleted = sorted(path for path in old if path not in files)
+        if not full and not changed and not deleted:
+            self.state["files"] = files  # only mtimes moved
+            return None
+
+        seq = self.state["seq"] + 1
+        meta = {
+            "seq": seq,
+            "kind": "full" if full else "delta",
+            "base": seq if full else self.state["full_seq"],
+            "created": datetime.now().isoformat(timespec="seconds"),
+            "deleted": [] if full else deleted,
+            "files": len(changed),
+        }
+        os.makedirs(self.state_dir, exist_ok=True)
+        spool = tempfile.TemporaryFile(dir=self.state_dir)
+        try:
+            with tarfile.open(fileobj=spool, mode="w:gz") as tar:
+                raw = json.dumps(meta).encode()
+                info = tarfile.TarInfo(BACKUP_META)
+                info.size = len(raw)
+                info.mtime = int(time())
+                tar.addfile(info, io.BytesIO(raw))
+                for path in changed:
+                    try:
+                        tar.add(path, arcname=path.lstrip("/"), recursive=False)
+                    except OSError as e:
+                        self.logger.warning(f"[TelePwn] Skipping {path} in backup: {e}")
+                        files.pop(path, None)
+            spool.seek(0)
+        except BaseException:
+            spool.close()
+            raise
+        state = {
+            "seq": seq,
+            "full_seq": seq if full else self.state["full_seq"],
+            "deltas_since_full": 0 if full else self.state["deltas_since_full"] + 1,
+            "files": files,
+        }
+        name = f"telepwn_{meta['kind']}_{seq:05d}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.tar.gz"
+        return spool, name, meta, state
+
+    def commit(self, state):
+        """Adopt the snapshot once its archive is safely uploaded."""
+        os.makedirs(self.state_dir, exist_ok=True)
+        path = os.path.join(self.state_dir, "manifest.json")
+        with open(path + ".tmp", "w") as f:
+            json.dump(state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + ".tmp", path)
+        self.state = state
+
+
+class PluginInventory:
+    """Installed plugins and their `enabled` flags, cached until a plugin directory or the config changes.
+
+    The plugin list is keyed on the mtimes of PLUGIN_DIRS and the states on the
+    config file's (mtime, size), so opening the menu costs a few stat() calls.
+    A toggle rewrites only the `enabled` line of that plugin in the config text;
+    whatever else the file holds, comments and layout included, is kept as is.
+    """
+
+    TABLE_RE = re.compile(r"^\s*\[([^\[\]]+)\]\s*(#.*)?$")
+    KEY_RE = re.compile(r"^(\s*)((?:[A-Za-z0-9_-]+|\"[^\"]*\"|'[^']*')(?:\s*\.\s*(?:[A-Za-z0-9_-]+|\"[^\"]*\"|'[^']*'))*)(\s*=\s*)(true|false)\b(.*)$")
+    BARE_KEY_RE = re.compile(r"^[A-Za-z0-9_-]+$")
+
+    def __init__(self, dirs=PLUGIN_DIRS, config_file=CONFIG_FILE):
+        self.logger = logging.getLogger("TelePwn")
+        self.dirs = dirs
+        self.config_file = config_file
+        self.lock = threading.Lock()
+        self.dirs_key = None
+        self.names = []
+        self.config_key = None
+        self.plugins_config = {}
+
+    @staticmethod
+    def _mtime_ns(path):
+        try:
+            return os.stat(path).st_mtime_ns
+        except OSError:
+            return None
+
+    def _config_key(self):
+        try:
+            st = os.stat(self.config_file)
+        except OSError:
+            return None
+        return st.st_mtime_ns, st.st_size
+
+    def plugins(self):
+        with self.lock:
+            key = tuple(self._mtime_ns(directory) for directory in self.dirs)
+            if key != self.dirs_key:
+                found = set()
+                for directory in self.dirs:
+                    try:
+                        if os.path.exists(directory):
+                            for filename in os.listdir(directory):
+                                if filename.endswith(".py") and filename != "__init__.py":
+                                    found.add(filename[:-3])
+                    except Exception as e:
+                        self.logger.error(f"Failed to scan {directory}: {e}")
+                self.names = sorted(found)
+                self.dirs_key = key
+            return list(self.names)
+
+    def states(self):
+        with self.lock:
+            key = self._config_key()
+            if key != self.config_key:
+                try:
+                    with open(self.config_file, "r") as f:
+                        self.plugins_config = toml.load(f).get("main", {}).get("plugins", {})
+                    self.config_key = key
+                except Exception as e:
+                    self.logger.error(f"Failed to load plugin states: {e}")
+            return {name: bool(settings.get("enabled", False)) for name, settings in self.plugins_config.items()
+                    if isinstance(settings, dict)}
+
+    @staticmethod
+    def _split_key(key):
+        return [part.strip().strip("\"'") for part in re.findall(r"\"[^\"]*\"|'[^']*'|[^.]+", key)]
+
+    def _quote(self, name):
+        return name if self.BARE_KEY_RE.match(name) else json.dumps(name)
+
+    def _edit(self, text, plugin_name, state):
+        """Config text with the plugin's `enabled` key set to `state`, or None when no simple edit fits."""
+        value = "true" if state else "false"
+        target = ["main", "plugins", plugin_name, "enabled"]
+        lines = text.splitlines(keepends=True)
+        table = []
+        table_line = None
+        first_table = None
+        for i, line in enumerate(lines):
+            match = self.TABLE_RE.match(line)
+            if match:
+                table = self._split_key(match.group(1))
+                if first_table is None:
+                    first_table = i
+                if table == target[:3]:
+                    table_line = i
+                continue
+            if line.lstrip().startswith("[["):
+                table = None
+                continue
+            match = self.KEY_RE.match(line)
+            if table is not None and match and table + self._split_key(match.group(2)) == target:
+                lines[i] = match.group(1) + match.group(2) + match.group(3) + value + match.group(5) + \
+                    ("\n" if line.endswith("\n") else "")
+                return "".join(lines)
+        newline = "\r\n" if "\r\n" in text else "\n"
+        if table_line is not None:
+            lines.insert(table_line + 1, f"enabled = {value}{newline}")
+        else:
+            # a dotted key only means the same thing before the first table header
+            at = len(lines) if first_table is None else first_table
+            while at and not lines[at - 1].strip():
+                at -= 1
+            if at and not lines[at - 1].endswith("\n"):
+                lines[at - 1] += newline
+            lines.insert(at, f"main.plugins.{self._quote(plugin_name)}.enabled = {value}{newline}")
+        return "".join(lines)
+
+    def set_enabled(self, plugin_name, state):
+        with self.lock:
+            with open(self.config_file, "r", newline="") as f:
+                text = f.read()
+            edited = self._edit(text, plugin_name, state)
+            config = None
+            try:
+                config = toml.loads(edited)
+                if config.get("main", {}).get("plugins", {}).get(plugin_name, {}).get("enabled") is not state:
+                    config = None
+            except Exception:
+                config = None
+            if config is None:
+                # the line edit didn't produce the expected document, rewrite it from the parsed config
+                self.logger.warning(f"[TelePwn] Rewriting {self.config_file} to toggle {plugin_name}")
+                config = toml.loads(text)
+                config.setdefault("main", {}).setdefault("plugins", {}).setdefault(plugin_name, {})["enabled"] = state
+                edited = toml.dumps(config)
+            tmp_path = self.config_file + ".tmp"
+            with open(tmp_path, "w", newline="") as f:
+                f.write(edited)
+                f.flush()
+                os.fsync(f.fileno())
+            try:
+                os.chmod(tmp_path, os.stat(self.config_file).st_mode & 0o7777)
+            except OSError:
+                pass
+            os.replace(tmp_path, self.config_file)
+            # the document was just parsed, no need to read it back
+            self.plugins_config = config.get("main", {}).get("plugins", {})
+            self.config_key = self._config_key()
+
+
+class LogFilter:
+    """Line predicate for the log views: minimum level and/or a case-insensitive keyword."""
+
+    LEVEL_RE = re.compile(r"\[(DEBUG|INFO|WARNING|ERROR|CRITICAL)\]")
+
+    def __init__(self, level=None, keyword=None):
+        self.level = LOG_LEVELS.get(level.upper()) if level else None
+        self.keyword = keyword.lower() if keyword else None
+
+    @classmethod
+    def from_args(cls, args):
+        """Split '/logs 100 error deauth' style arguments into (count or None, LogFilter)."""
+        count = None
+        level = None
+        words = []
+        for arg in args:
+            if arg.isdigit() and count is None:
+                count = int(arg)
+            elif arg.upper() in LOG_LEVELS and level is None:
+                level = arg
+            else:
+                words.append(arg)
+        return count, cls(level, " ".join(words) or None)
+
+    def __bool__(self):
+        return self.level is not None or self.keyword is not None
+
+    def __call__(self, line):
+        if self.level is not None:
+            match = self.LEVEL_RE.search(line)
+            if not match or LOG_LEVELS[match.group(1)] < self.level:
+                return False
+        return self.keyword is None or self.keyword in line.lower()
+
+    def describe(self):
+        parts = []
+        if self.level is not None:
+            parts.append(next(name for name, value in LOG_LEVELS.items() if value == self.level) + "+")
+        if self.keyword:
+            parts.append(f'"{self.keyword}"')
+        return " ".join(parts)
+
+
+def tail_lines(path, count, line_filter=None):
+    """Last `count` lines of `path` matching `line_filter`, reading backwards one block at a time.
+
+    Only the end of the file is read; a filtered search gives up after
+    LOG_TAIL_MAX_BYTES so a rare keyword can't make it read a whole huge log.
+    """
+    found = []
+    with open(path, "rb") as f:
+        pos = f.seek(0, os.SEEK_END)
+        tail = b""
+        scanned = 0
+        while pos > 0 and len(found) < count and scanned < LOG_TAIL_MAX_BYTES:
+            step = min(LOG_TAIL_BLOCK, pos)
+            pos -= step
+            f.seek(pos)
+            chunk = f.read(step) + tail
+            scanned += step
+            lines = chunk.split(b"\n")
+            # the first piece may continue in the previous block, unless we reached the start
+            tail = lines.pop(0) if pos > 0 else b""
+            for raw in reversed(lines):
+                line = raw.decode("utf-8", errors="replace").rstrip("\r")
+                if line and (not line_filter or line_filter(line)):
+                    found.append(line)
+                    if len(found) == count:
+                        break
+    found.reverse()
+    return found
+
+
+class LogFollower:
+    """Offset cursor on a log file that survives rotation.
+
+    The open file is tracked by inode: when the path points at a new file the
+    rest of the old one is read before switching, and a file that shrank below
+    the cursor (copytruncate) is read again from the start. read() runs on an
+    executor thread, so close() waits for a read in progress.
+    """
+
+    def __init__(self, path, line_filter=None):
+        self.path = path
+        self.filter = line_filter
+        self.lock = threading.Lock()
+        self.closed = False
+        self.file = None
+        self.inode = None
+        self.partial = b""
+        try:
+            self._open(at_end=True)
+        except FileNotFoundError:
+            pass
+
+    def _open(self, at_end):
+        self.file = open(self.path, "rb")
+        self.inode = os.fstat(self.file.fileno()).st_ino
+        self.partial = b""
+        if at_end:
+            self.file.seek(0, os.SEEK_END)
+
+    @property
+    def offset(self):
+        return self.file.tell() if self.file else 0
+
+    def _drain(self):
+        data = self.file.read(LOG_TAIL_MAX_BYTES)
+        if not data:
+            return []
+        lines = (self.partial + data).split(b"\n")
+        self.partial = lines.pop()
+        decoded = (raw.decode("utf-8", errors="replace").rstrip("\r") for raw in lines)
+        return [line for line in decoded if line and (not self.filter or self.filter(line))]
+
+    def read(self):
+        """New matching lines since the last call."""
+        with self.lock:
+            if self.closed:
+                return []
+            return self._read()
+
+    def _read(self):
+        if self.file is None:
+            try:
+                self._open(at_end=False)
+            except FileNotFoundError:
+                return []
+        lines = self._drain()
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            # rotated away and not recreated yet, keep reading the old file
+            return lines
+        if st.st_ino != self.inode:
+            lines += self._drain()
+            self.file.close()
+            self._open(at_end=False)
+            lines += self._drain()
+        elif st.st_size < self.offset:
+            self.file.seek(0)
+            self.partial = b""
+            lines += self._drain()
+        return lines
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+
+def read_temperature():
+    try:
+        with open("/sys/class/thermal/thermal_zone0/temp", "r") as f:
+            return int(f.read().strip()) / 1000
+    except (OSError, ValueError):
+        return float("nan")
+
+
+class StatsRing:
+    """Fixed-size ring of samples: one array per field plus a timestamp array, no per-sample objects."""
+
+    def __init__(self, capacity, fields=STATS_FIELDS):
+        self.capacity = capacity
+        self.fields = fields
+        self.lock = threading.Lock()
+        self.times = array("d", [0.0]) * capacity
+        self.columns = {field: array("f", [float("nan")]) * capacity for field in fields}
+        self.next = 0
+        self.size = 0
+
+    def append(self, timestamp, values):
+        with self.lock:
+            self.times[self.next] = timestamp
+            for field in self.fields:
+                self.columns[field][self.next] = values.get(field, float("nan"))
+            self.next = (self.next + 1) % self.capacity
+            self.size = min(self.size + 1, self.capacity)
+
+    def latest(self):
+        with self.lock:
+            if not self.size:
+                return None
+            i = (self.next - 1) % self.capacity
+            return {field: self.columns[field][i] for field in self.fields}
+
+    def window(self, seconds):
+        """(timestamps, {field: values}) of the samples taken in the last `seconds`, oldest first."""
+        with self.lock:
+            start = (self.next - self.size) % self.capacity
+            order = [(start + k) % self.capacity for k in range(self.size)]
+            cutoff = time() - seconds
+            order = [i for i in order if self.times[i] >= cutoff]
+            return ([self.times[i] for i in order],
+                    {field: [self.columns[field][i] for i in order] for field in self.fields})
+
+
+class StatsSampler:
+    """Samples system load every `interval` seconds on its own thread, so /stats never waits."""
+
+    def __init__(self, handshake_count, interval=STATS_INTERVAL, keep=STATS_WINDOWS["day"]):
+        self.logger = logging.getLogger("TelePwn")
+        self.handshake_count = handshake_count
+        self.interval = interval
+        self.ring = StatsRing(max(1, int(keep // interval)))
+        self.stop = threading.Event()
+        self.last = None
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _counters(self):
+        try:
+            disk = psutil.disk_io_counters()
+        except Exception:
+            disk = None
+        count = self.handshake_count()
+        return (time(), disk.read_bytes if disk else None, disk.write_bytes if disk else None, count)
+
+    def sample(self):
+        # cpu_percent(None) measures since the previous call, i.e. over the last interval
+        now = self._counters()
+        values = {
+            "cpu": psutil.cpu_percent(interval=None),
+            "memory": psutil.virtual_memory().percent,
+            "temp": read_temperature(),
+        }
+        if self.last is not None:
+            elapsed = max(now[0] - self.last[0], 1e-3)
+            if now[1] is not None and self.last[1] is not None:
+                values["disk_read"] = (now[1] - self.last[1]) / elapsed / 1024
+                values["disk_write"] = (now[2] - self.last[2]) / elapsed / 1024
+            if now[3] is not None and self.last[3] is not None:
+                values["handshake_rate"] = max(0, now[3] - self.last[3]) * 3600 / elapsed
+        self.last = now
+        self.ring.append(now[0], values)
+
+    def _run(self):
+        psutil.cpu_percent(interval=None)
+        self.last = self._counters()
+        while not self.stop.wait(self.interval):
+            try:
+                self.sample()
+            except Exception as e:
+                self.logger.error(f"[TelePwn] Stats sample failed: {e}")
+
+    def close(self):
+        self.stop.set()
+
+    def summary(self, seconds=STATS_WINDOWS["hour"]):
+        latest = self.ring.latest()
+        if latest is None:
+            return None
+        _, columns = self.ring.window(seconds)
+        result = {}
+        for field in STATS_FIELDS:
+            values = [v for v in columns[field] if not math.isnan(v)]
+            result[field] = (latest[field],
+                             sum(values) / len(values) if values else float("nan"),
+                             max(values) if values else float("nan"))
+        rates = [v for v in columns["handshake_rate"] if not math.isnan(v)]
+        result["handshakes"] = round(sum(rates) * self.interval / 3600)
+        return result
+
+    def chart(self, seconds=STATS_WINDOWS["hour"], width=480, row_height=56):
+        """Sparklines of every field over the last `seconds` as PNG bytes, None without PIL or samples."""
+        if Image is None:
+            return None
+        times, columns = self.ring.window(seconds)
+        if len(times) < 2:
+            return None
+        labels = {"cpu": "CPU %", "memory": "Memory %", "temp": "Temp C", "disk_read": "Disk read KB/s",
+                  "disk_write": "Disk write KB/s", "handshake_rate": "Handshakes/h"}
+        image = Image.new("RGB", (width, row_height * len(STATS_FIELDS)), "white")
+        draw = ImageDraw.Draw(image)
+        span = max(times[-1] - times[0], 1)
+        for row, field in enumerate(STATS_FIELDS):
+            top = row * row_height
+            points = [(t, v) for t, v in zip(times, columns[field]) if not math.isnan(v)]
+            values = [v for _, v in points]
+            low, high = (min(values), max(values)) if values else (0, 0)
+            draw.line([(0, top + row_height - 1), (width, top + row_height - 1)], fill=(220, 220, 220))
+            draw.text((4, top + 2), f"{labels[field]}  {values[-1]:.1f} (max {high:.1f})" if values else labels[field],
+                      fill="black")
+            if len(points) > 1:
+                scale = (high - low) or 1
+                line = [(int((t - times[0]) / span * (width - 1)),
+                         int(top + row_height - 4 - (v - low) / scale * (row_height - 20))) for t, v in points]
+                draw.line(line, fill=(0, 120, 0), width=2)
+        out = io.BytesIO()
+        image.save(out, "png")
+        out.seek(0)
+        return out
+
+
 class TelePwn(plugins.Plugin):
     __author__ = "WPA2"
     __version__ = "2.0.0.1"
@@ -128,8 +1000,14 @@ class TelePwn(plugins.Plugin):
         self.user_last_share = {}
         self.user_share_count = {}
         self.pending_screenshots = {}
-        self.last_handshake_count = 0
+        self.counter = None
+        self.delivery = None
+        self.handshake_dir = HANDSHAKE_DIR
+        self.backups = BackupManager()
+        self.stats = None
+        self.followers = {}
         self.last_plugin_list = []
+        self.inventory = PluginInventory()
         self.user_states = {}
         self.schedule_thread = None
         self.bot_loop = None  # Store the bot's event loop
@@ -182,6 +1060,12 @@ class TelePwn(plugins.Plugin):
                 self.options["auto_start"] = plugins_config.get("auto_start", True)
                 self.options["community_enabled"] = plugins_config.get("community_enabled", False)
                 self.options["community_chat_id"] = plugins_config.get("community_chat_id", "")
+                self.options["batch_window"] = plugins_config.get("batch_window", DELIVERY_WINDOW)
+                self.options["max_queue"] = plugins_config.get("max_queue", DELIVERY_MAX_QUEUE)
+                self.options["queue_policy"] = plugins_config.get("queue_policy", "drop_oldest")
+                # the same directory bettercap and the other plugins use
+                self.handshake_dir = config.get("bettercap", {}).get("handshakes", HANDSHAKE_DIR)
+                self.backups.sources = BACKUP_SOURCES + [self.handshake_dir]
         except Exception as e:
             self.logger.error(f"[TelePwn] Failed to load config: {e}")
             return
@@ -196,6 +1080,10 @@ class TelePwn(plugins.Plugin):
             TelePwn._instance = self
 
         self.load_config()
+        self.counter = HandshakeCounter(self.handshake_dir, on_change=self._handshake_count_changed)
+        self.stats = StatsSampler(lambda: self.counter.count if self.counter else None)
+        self.delivery = DeliveryQueue(self._deliver_batch, window=self.options["batch_window"],
+                                      max_entries=self.options["max_queue"], policy=self.options["queue_policy"])
         self.start_scheduler()
         
         if self.options.get("community_enabled"):
@@ -210,6 +1098,12 @@ class TelePwn(plugins.Plugin):
                 self.stop_bot()
                 self.stop_scheduler()
                 TelePwn._instance = None
+        if self.counter is not None:
+            self.counter.close()
+        if self.delivery is not None:
+            self.delivery.close()
+        if self.stats is not None:
+            self.stats.close()
 
     def load_config(self):
         try:
@@ -230,55 +1124,104 @@ class TelePwn(plugins.Plugin):
 
     def on_handshake(self, agent, filename, access_point, client_station):
         try:
-            if self.application and self.bot_loop and self.options.get("send_message", False):
+            if self.delivery is not None and self.options.get("send_message", False):
                 ap_name = access_point.get('hostname', 'Unknown')
                 client_mac = client_station.get('mac', 'Unknown')
-                message = f"🤝 New handshake: {ap_name} - {client_mac}"
-                
-                # Send notification message
-                asyncio.run_coroutine_threadsafe(
-                    self.application.bot.send_message(
-                        chat_id=int(self.options["chat_id"]),
-                        text=message
-                    ),
-                    self.bot_loop
-                )
-                
-                # Send the .pcap file if enabled
-                if self.options.get("send_handshake_file", False) and filename:
-                    handshake_path = os.path.join(HANDSHAKE_DIR, filename)
-                    if os.path.exists(handshake_path):
-                        asyncio.run_coroutine_threadsafe(
-                            self._send_handshake_file(handshake_path, ap_name, client_mac),
-                            self.bot_loop
-                        )
-                
-            if self.options.get("community_enabled"):
-                self.check_milestone(agent)
+                handshake_path = os.path.join(self.handshake_dir, filename) if filename else None
+                # delivered by the queue's worker, batched with whatever else is captured in the window
+                self.delivery.add(handshake_path, ap_name, client_mac)
+
+            if self.counter is not None:
+                self.counter.handshake_saved(filename)
         except Exception as e:
             self.logger.error(f"Error sending handshake: {e}")
 
-    async def _send_handshake_file(self, filepath, ap_name, client_mac):
-        """Send the handshake .pcap file to Telegram"""
+    def _deliver_batch(self, batch):
+        """Runs on the delivery thread, hands the batch to the bot loop and waits for it."""
+        if not (self.application and self.bot_loop and self.bot_loop.is_running()):
+            raise ConnectionError("bot not connected")
+        done = threading.Event()
+        outcome = {}
+
+        async def send():
+            try:
+                await self._send_batch(batch)
+                outcome["sent"] = True
+            finally:
+                done.set()
+
+        future = asyncio.run_coroutine_threadsafe(send(), self.bot_loop)
         try:
-            with open(filepath, 'rb') as pcap_file:
-                caption = f"🤝 {ap_name} - {client_mac}"
+            future.result(timeout=DELIVERY_SEND_TIMEOUT)
+        except concurrent.futures.TimeoutError:
+            # a retry while this send is still going would deliver the batch twice:
+            # cancel it and wait until it has really ended, it may still finish first
+            future.cancel()
+            while not done.wait(DELIVERY_RETRY):
+                if not self.bot_loop.is_running():
+                    break
+            if not outcome.get("sent"):
+                raise TimeoutError(f"delivery not confirmed after {DELIVERY_SEND_TIMEOUT}s")
+
+    async def _send_batch(self, batch):
+        entries = batch["entries"]
+        chat_id = int(self.options["chat_id"])
+        if not batch["message_sent"]:
+            if len(entries) == 1 and not batch["dropped"]:
+                message = f"🤝 New handshake: {entries[0]['ap']} - {entries[0]['client']}"
+            else:
+                lines = [f"🤝 {sum(e['count'] for e in entries)} new handshakes from {len(entries)} networks:"]
+                for e in entries:
+                    lines.append(f"• {e['ap']} - {e['client']}" + (f" (x{e['count']})" if e['count'] > 1 else ""))
+                if batch["dropped"]:
+                    lines.append(f"... and {batch['dropped']} more not queued")
+                message = "\n".join(lines)
+                if len(message) > MAX_MESSAGE_LENGTH:
+                    message = message[:MAX_MESSAGE_LENGTH - 4] + "\n..."
+            await self.application.bot.send_message(chat_id=chat_id, text=message)
+            batch["message_sent"] = True
+
+        if not self.options.get("send_handshake_file", False):
+            return
+        paths = [e["path"] for e in entries if e["path"] and os.path.exists(e["path"])]
+        if len(paths) == 1:
+            with open(paths[0], 'rb') as pcap_file:
                 await self.application.bot.send_document(
-                    chat_id=int(self.options["chat_id"]),
+                    chat_id=chat_id,
                     document=pcap_file,
-                    caption=caption
+                    caption=f"🤝 {entries[0]['ap']} - {entries[0]['client']}" if len(entries) == 1 else None
                 )
-            self.logger.info(f"[TelePwn] Sent handshake file: {filepath}")
-        except Exception as e:
-            self.logger.error(f"[TelePwn] Failed to send handshake file: {e}")
+        elif paths:
+            bundle = io.BytesIO()
+            with zipfile.ZipFile(bundle, "w", zipfile.ZIP_DEFLATED) as zf:
+                for path in paths:
+                    zf.write(path, os.path.basename(path))
+            bundle.seek(0)
+            await self.application.bot.send_document(
+                chat_id=chat_id,
+                document=bundle,
+                filename=f"handshakes_{datetime.now().strftime('%Y%m%d_%H%M%S')}.zip",
+                caption=f"🤝 {len(paths)} handshake files"
+            )
+        self.logger.info(f"[TelePwn] Delivered {len(entries)} handshakes ({len(paths)} files)")
+
+    def count_handshakes(self):
+        if self.counter is not None:
+            return self.counter.count
+        catalog = open_catalog(self.handshake_dir)
+        if catalog is not None:
+            return catalog.count()
+        return len([f for f in os.listdir(self.handshake_dir) if os.path.isfile(os.path.join(self.handshake_dir, f))])
 
-    def check_milestone(self, agent):
+    def _handshake_count_changed(self):
+        if self.options.get("community_enabled"):
+            self.check_milestone()
+
+    def check_milestone(self):
         try:
-            current_count = len([f for f in os.listdir(HANDSHAKE_DIR) if os.path.isfile(os.path.join(HANDSHAKE_DIR, f))])
-            
-            if current_count in MILESTONE_LEVELS and current_count != self.last_handshake_count:
-                self.last_handshake_count = current_count
-                
+            current_count = self.counter.next_milestone()
+
+            if current_count is not None:
                 message = f"🎉 MILESTONE UNLOCKED! 🎉\n\nYou just captured your {current_count}th handshake!\n\nShare this achievement with the community?"
                 keyboard = [
                     [InlineKeyboardButton("📤 Share Milestone!", callback_data="share_milestone")],
@@ -349,6 +1292,7 @@ class TelePwn(plugins.Plugin):
                 self.application.add_handler(CommandHandler("kill", self.pwnkill))
                 self.application.add_handler(CommandHandler("clear", self.clear))
                 self.application.add_handler(CommandHandler("logs", self.logs))
+                self.application.add_handler(CommandHandler("follow", self.follow_log))
                 self.application.add_handler(CommandHandler("inbox", self.inbox))
                 self.application.add_handler(CommandHandler("plugins", self.plugins_menu))
                 self.application.add_handler(CommandHandler("stats", self.system_stats))
@@ -410,10 +1354,11 @@ class TelePwn(plugins.Plugin):
                 BotCommand("restart_auto", "Restart in auto mode"),
                 BotCommand("kill", "Kill daemon"),
                 BotCommand("clear", "Clear screen"),
-                BotCommand("logs", "View logs"),
+                BotCommand("logs", "View logs ([lines] [level] [keyword])"),
+                BotCommand("follow", "Stream new log lines ([level] [keyword] or stop)"),
                 BotCommand("inbox", "Check inbox"),
                 BotCommand("plugins", "Manage plugins"),
-                BotCommand("stats", "System stats"),
+                BotCommand("stats", "System stats (add chart, hour or day for a graph)"),
             ])
             self.logger.info("[TelePwn] Bot commands set successfully!")
             
@@ -462,20 +1407,37 @@ class TelePwn(plugins.Plugin):
             sleep(60)
 
     def _scheduled_backup(self):
+        if not self.backups.lock.acquire(blocking=False):
+            self.logger.info("[TelePwn] Backup already running, skipping scheduled run")
+            return
         try:
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            backup_path = f"/home/pi/telepwn_backup_{timestamp}.tar.gz"
-            subprocess.run(["sudo", "tar", "czf", backup_path, "/etc/pwnagotchi/", "/home/pi/handshakes/"], check=True)
-            if self.bot_loop:
+            backup = self.backups.prepare()
+            if backup is None:
+                self.logger.info("[TelePwn] Scheduled backup: nothing changed")
+                return
+            archive, name, meta, state = backup
+            with archive:
+                if not self.bot_loop:
+                    raise ConnectionError("bot not connected")
                 asyncio.run_coroutine_threadsafe(
                     self.application.bot.send_document(
                         chat_id=int(self.options["chat_id"]),
-                        document=open(backup_path, 'rb')
+                        document=archive,
+                        filename=name,
+                        caption=self._backup_caption(meta)
                     ),
                     self.bot_loop
-                )
+                ).result(timeout=600)
+            self.backups.commit(state)
         except Exception as e:
             self.logger.error(f"Scheduled backup failed: {e}")
+        finally:
+            self.backups.lock.release()
+
+    def _backup_caption(self, meta):
+        if meta["kind"] == "full":
+            return f"💾 Full backup #{meta['seq']} ({meta['files']} files)"
+        return f"💾 Incremental backup #{meta['seq']} on #{meta['base']} ({meta['files']} changed, {len(meta['deleted'])} deleted)"
 
     async def send_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE, text: str, keyboard=None):
         try:
@@ -511,6 +1473,8 @@ class TelePwn(plugins.Plugin):
 /screenshot - Take screenshot
 /backup - Create backup
 /stats - System statistics
+/logs [lines] [level] [keyword] - Recent log lines
+/follow [level] [keyword] - Stream new log lines, /follow stop to end
 
 **Tip:** Use the menu buttons for easier navigation!"""
         
@@ -592,7 +1556,7 @@ class TelePwn(plugins.Plugin):
 
     async def handshake_count(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         try:
-            count = len([f for f in os.listdir(HANDSHAKE_DIR) if os.path.isfile(os.path.join(HANDSHAKE_DIR, f))])
+            count = self.count_handshakes()
             
             keyboard = [[InlineKeyboardButton("📋 Back to Menu", callback_data="show_menu")]]
             await self.send_message(update, context, f"🤝 Handshakes: {count}", keyboard)
@@ -698,7 +1662,7 @@ class TelePwn(plugins.Plugin):
             return
         
         try:
-            handshakes = len([f for f in os.listdir(HANDSHAKE_DIR) if os.path.isfile(os.path.join(HANDSHAKE_DIR, f))])
+            handshakes = self.count_handshakes()
             caption = f"📸 Shared by @{username}\n\n#screenshot #pwnagotchi"
             
             with open(screenshot_path, "rb") as photo:
@@ -742,7 +1706,7 @@ class TelePwn(plugins.Plugin):
             screenshot_path = "/root/telepwn_milestone.png"
             display.image().rotate(self.screen_rotation).save(screenshot_path, "png")
             
-            handshakes = len([f for f in os.listdir(HANDSHAKE_DIR) if os.path.isfile(os.path.join(HANDSHAKE_DIR, f))])
+            handshakes = self.count_handshakes()
             caption = f"📸 Shared by @{username}\n🎉 Milestone: {handshakes} handshakes!\n\n#milestone #{handshakes}handshakes #pwnagotchi"
             
             with open(screenshot_path, "rb") as photo:
@@ -779,20 +1743,29 @@ class TelePwn(plugins.Plugin):
         await context.bot.send_message(chat_id=update.effective_chat.id, text="✅ Cancelled")
 
     async def create_backup(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        await self.send_message(update, context, "💾 Creating backup...")
+        keyboard = [[InlineKeyboardButton("📋 Back to Menu", callback_data="show_menu")]]
+        # the scheduler thread may hold it, never wait for it on the bot loop
+        if not self.backups.lock.acquire(blocking=False):
+            await self.send_message(update, context, "⏳ A backup is already running", keyboard)
+            return
         try:
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            backup_path = f"/home/pi/telepwn_backup_{timestamp}.tar.gz"
-            subprocess.run(["sudo", "tar", "czf", backup_path, "/etc/pwnagotchi/", "/home/pi/handshakes/"], check=True)
-            
-            with open(backup_path, "rb") as backup:
-                await context.bot.send_document(chat_id=update.effective_chat.id, document=backup)
-            
-            keyboard = [[InlineKeyboardButton("📋 Back to Menu", callback_data="show_menu")]]
+            await self.send_message(update, context, "💾 Creating backup...")
+            full = "full" in (getattr(context, "args", None) or [])
+            backup = await asyncio.get_running_loop().run_in_executor(None, self.backups.prepare, full)
+            if backup is None:
+                await self.send_message(update, context, "✅ Nothing changed since the last backup", keyboard)
+                return
+            archive, name, meta, state = backup
+            with archive:
+                await context.bot.send_document(chat_id=update.effective_chat.id, document=archive,
+                                                filename=name, caption=self._backup_caption(meta))
+            self.backups.commit(state)
+
             await self.send_message(update, context, "✅ Backup sent", keyboard)
         except Exception as e:
-            keyboard = [[InlineKeyboardButton("📋 Back to Menu", callback_data="show_menu")]]
             await self.send_message(update, context, f"⛔ Failed: {e}", keyboard)
+        finally:
+            self.backups.lock.release()
 
     async def restart_manual(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         try:
@@ -852,12 +1825,71 @@ class TelePwn(plugins.Plugin):
 
     async def logs(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         try:
-            log_output = subprocess.check_output(["tail", "-n", "50", LOG_PATH], text=True)
+            count, line_filter = LogFilter.from_args(getattr(context, "args", None) or [])
+            count = min(count or LOG_LINES, LOG_MAX_LINES)
+            lines = await asyncio.get_running_loop().run_in_executor(None, tail_lines, LOG_PATH, count, line_filter)
+            log_output = "\n".join(lines)
+            title = f"📜 Logs ({line_filter.describe()}):" if line_filter else "📜 Logs:"
             keyboard = [[InlineKeyboardButton("📋 Back to Menu", callback_data="show_menu")]]
-            await self.send_message(update, context, f"📜 Logs:\n```\n{log_output}\n```", keyboard)
+            await self.send_message(update, context, f"{title}\n```\n{log_output or 'no matching lines'}\n```", keyboard)
         except Exception as e:
             await self.send_message(update, context, f"⛔ Failed: {e}")
 
+    async def follow_log(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        chat_id = update.effective_chat.id
+        if chat_id != int(self.options.get("chat_id")):
+            return
+        args = getattr(context, "args", None) or []
+        running = self.followers.pop(chat_id, None)
+        if running is not None:
+            running.cancel()
+        if args and args[0].lower() in ("stop", "off"):
+            await self.send_message(update, context, "📜 Stopped following the log" if running else "📜 Not following the log")
+            return
+        _, line_filter = LogFilter.from_args(args)
+        loop = asyncio.get_running_loop()
+        follower = await loop.run_in_executor(None, LogFollower, LOG_PATH, line_filter)
+        self.followers[chat_id] = loop.create_task(self._follow(context.bot, chat_id, follower))
+        what = f" ({line_filter.describe()})" if line_filter else ""
+        await self.send_message(update, context, f"📜 Following the log{what} for {FOLLOW_TIMEOUT // 60} minutes, /follow stop to end")
+
+    async def _follow(self, bot, chat_id, follower):
+        pending = []
+        last_sent = 0
+        started = time()
+        loop = asyncio.get_running_loop()
+        try:
+            while time() - started < FOLLOW_TIMEOUT:
+                await asyncio.sleep(FOLLOW_POLL)
+                # file reads stay off the bot loop
+                pending += await loop.run_in_executor(None, follower.read)
+                # at most one message per FOLLOW_BATCH_INTERVAL, only the newest lines of a burst
+                if not pending or time() - last_sent < FOLLOW_BATCH_INTERVAL:
+                    continue
+                skipped = max(0, len(pending) - FOLLOW_MAX_LINES)
+                text = "\n".join(pending[skipped:])
+                if skipped:
+                    text = f"... {skipped} lines skipped\n" + text
+                try:
+                    await bot.send_message(chat_id=chat_id, text=text[-MAX_MESSAGE_LENGTH:])
+                except RetryAfter as e:
+                    retry_after = e.retry_after
+                    if hasattr(retry_after, "total_seconds"):
+                        retry_after = retry_after.total_seconds()
+                    await asyncio.sleep(float(retry_after))
+                    continue
+                pending = []
+                last_sent = time()
+            await bot.send_message(chat_id=chat_id, text="📜 Stopped following the log (timeout)")
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            self.logger.error(f"[TelePwn] Log follow failed: {e}")
+        finally:
+            follower.close()
+            if self.followers.get(chat_id) is asyncio.current_task():
+                del self.followers[chat_id]
+
     async def inbox(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         try:
             inbox_output = subprocess.check_output(["pwngrid", "--inbox"], text=True)
@@ -881,26 +1913,11 @@ class TelePwn(plugins.Plugin):
         await self.send_message(update, context, "🔩 Plugins:", keyboard)
 
     def get_plugins(self):
-        plugins_found = set()
-        for directory in PLUGIN_DIRS:
-            try:
-                if os.path.exists(directory):
-                    for filename in os.listdir(directory):
-                        if filename.endswith(".py") and filename != "__init__.py":
-                            plugins_found.add(filename[:-3])
-            except Exception as e:
-                self.logger.error(f"Failed to scan {directory}: {e}")
-
-        try:
-            with open(CONFIG_FILE, "r") as f:
-                config = toml.load(f)
-                plugins_config = config.get("main", {}).get("plugins", {})
-                for plugin in plugins_found:
-                    self.plugin_states[plugin] = plugins_config.get(plugin, {}).get("enabled", False)
-        except Exception as e:
-            self.logger.error(f"Failed to load plugin states: {e}")
-
-        self.last_plugin_list = sorted(plugins_found)
+        plugins_found = self.inventory.plugins()
+        states = self.inventory.states()
+        for plugin in plugins_found:
+            self.plugin_states[plugin] = states.get(plugin, False)
+        self.last_plugin_list = plugins_found
         return self.last_plugin_list
 
     async def toggle_plugin(self, update: Update, context: ContextTypes.DEFAULT_TYPE, plugin_name):
@@ -908,21 +1925,7 @@ class TelePwn(plugins.Plugin):
         new_state = not current_state
         
         try:
-            with open(CONFIG_FILE, "r") as f:
-                config = toml.load(f)
-
-            if "main" not in config:
-                config["main"] = {}
-            if "plugins" not in config["main"]:
-                config["main"]["plugins"] = {}
-
-            if plugin_name not in config["main"]["plugins"]:
-                config["main"]["plugins"][plugin_name] = {}
-            config["main"]["plugins"][plugin_name]["enabled"] = new_state
-
-            with open(CONFIG_FILE, "w") as f:
-                toml.dump(config, f)
-
+            self.inventory.set_enabled(plugin_name, new_state)
             self.plugin_states[plugin_name] = new_state
             subprocess.run(["sudo", "killall", "-USR1", "pwnagotchi"], check=True)
             
@@ -934,15 +1937,46 @@ class TelePwn(plugins.Plugin):
 
     async def system_stats(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         try:
-            cpu_usage = psutil.cpu_percent(interval=1)
-            memory = psutil.virtual_memory()
-            try:
-                with open("/sys/class/thermal/thermal_zone0/temp", "r") as f:
-                    temp = int(f.read().strip()) / 1000
-            except:
-                temp = "N/A"
-            msg = f"📊 Stats:\nCPU: {cpu_usage}%\nMemory: {memory.percent}%\nTemp: {temp}°C"
             keyboard = [[InlineKeyboardButton("📋 Back to Menu", callback_data="show_menu")]]
+            args = getattr(context, "args", None) or []
+            summary = self.stats.summary() if self.stats else None
+            if summary is None:
+                # no sample yet, answer with what is instant
+                memory = psutil.virtual_memory()
+                temp = read_temperature()
+                msg = f"📊 Stats:\nCPU: {psutil.cpu_percent(interval=None)}%\nMemory: {memory.percent}%\nTemp: {'N/A' if math.isnan(temp) else f'{temp:.1f}°C'}"
+                await self.send_message(update, context, msg, keyboard)
+                return
+
+            def line(name, field, unit):
+                now, avg, peak = summary[field]
+                if math.isnan(now):
+                    return f"{name}: N/A"
+                return f"{name}: {now:.1f}{unit} (1h avg {avg:.1f}, max {peak:.1f})"
+
+            def rate(field):
+                # a rate needs two samples, the first one has none yet
+                value = summary[field][0]
+                return "n/a" if math.isnan(value) else f"{value:.1f} KB/s"
+            msg = "\n".join([
+                "📊 Stats:",
+                line("CPU", "cpu", "%"),
+                line("Memory", "memory", "%"),
+                line("Temp", "temp", "°C"),
+                f"Disk: read {rate('disk_read')}, write {rate('disk_write')}",
+                f"Handshakes: {summary['handshakes']} in the last hour",
+            ])
+            window = next((name for name in STATS_WINDOWS if name in args), "hour" if "chart" in args else None)
+            chart = None
+            if window:
+                # drawing the chart takes a while on a Pi, keep it off the bot loop
+                chart = await asyncio.get_running_loop().run_in_executor(None, self.stats.chart, STATS_WINDOWS[window])
+            if chart is not None:
+                await context.bot.send_photo(chat_id=update.effective_chat.id, photo=chart,
+                                             caption=msg, reply_markup=InlineKeyboardMarkup(keyboard))
+                return
+            if window:
+                msg += "\n(charts need Pillow and a few samples)"
             await self.send_message(update, context, msg, keyboard)
         except Exception as e:
             await self.send_message(update, context, f"⛔ Failed: {e}")
@@ -967,7 +2001,7 @@ class TelePwn(plugins.Plugin):
 
         try:
             file = await context.bot.get_file(document.file_id)
-            file_path = os.path.join(HANDSHAKE_DIR, file_name)
+            file_path = os.path.join(self.handshake_dir, file_name)
 
             if os.path.exists(file_path):
                 await update.message.reply_text(f"⛔ {file_name} already exists")
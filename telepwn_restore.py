@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+# Restore tool for TelePwn backups. Not a plugin and standard library only, so it
+# runs on the machine being recovered, before pwnagotchi or telegram are installed:
+#
+#   python3 telepwn_restore.py [--target DIR] telepwn_full_*.tar.gz telepwn_delta_*.tar.gz ...
+import argparse
+import json
+import os
+import sys
+import tarfile
+
+BACKUP_META = ".telepwn_backup.json"  # first member of every archive, see BackupManager in telepwn.py
+
+
+def read_backup_meta(path):
+    with tarfile.open(path, "r:gz") as tar:
+        member = tar.next()
+        if member is None or member.name != BACKUP_META:
+            raise ValueError(f"{path} is not a TelePwn backup")
+        return json.load(tar.extractfile(member))
+
+
+def restore_backup_chain(archives, target="/"):
+    """Replay the newest full snapshot among `archives` and the deltas built on it into `target`."""
+    metas = []
+    for path in archives:
+        try:
+            metas.append((read_backup_meta(path), path))
+        except (OSError, ValueError, tarfile.TarError) as e:
+            print(f"skipping {path}: {e}")
+    fulls = [(meta, path) for meta, path in metas if meta["kind"] == "full"]
+    if not fulls:
+        raise ValueError("no full snapshot among the given archives")
+    base, base_path = max(fulls, key=lambda item: item[0]["seq"])
+    chain = [(base, base_path)] + sorted(((meta, path) for meta, path in metas
+                                          if meta["kind"] == "delta" and meta["base"] == base["seq"]),
+                                         key=lambda item: item[0]["seq"])
+    expected = base["seq"]
+    for meta, path in chain:
+        if meta["seq"] != expected:
+            print(f"warning: backup {expected} is missing, restoring up to {expected - 1}")
+            break
+        with tarfile.open(path, "r:gz") as tar:
+            for member in tar:
+                if member.name == BACKUP_META:
+                    continue
+                if member.name.startswith("/") or ".." in member.name.split("/"):
+                    print(f"refusing unsafe member {member.name} in {path}")
+                    continue
+                if hasattr(tarfile, "tar_filter"):
+                    # keeps modes and owners, still refuses links out of the target
+                    tar.extract(member, target, filter="tar")
+                else:
+                    tar.extract(member, target)
+        for deleted in meta["deleted"]:
+            try:
+                os.remove(os.path.join(target, deleted.lstrip("/")))
+            except FileNotFoundError:
+                pass
+        print(f"applied {meta['kind']} {meta['seq']} ({meta['files']} files, {len(meta['deleted'])} deleted) from {path}")
+        expected += 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description="replay a TelePwn full backup and its incremental backups")
+    parser.add_argument("--target", default="/", help="directory to restore into (default: /)")
+    parser.add_argument("archives", nargs="+")
+    args = parser.parse_args()
+    try:
+        restore_backup_chain(args.archives, args.target)
+    except ValueError as e:
+        sys.exit(f"error: {e}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,27 @@
-import logging, os, glob, pwnagotchi
+import logging, os, io, sys, glob, json, threading, pwnagotchi
 import pwnagotchi.plugins as plugins
-from flask import abort, send_from_directory, render_template_string, make_response, send_file
+from flask import abort, request, send_from_directory, render_template_string, make_response, send_file, Response, stream_with_context
 import zipfile
 
+_plugin_dir = os.path.dirname(os.path.abspath(__file__))
+if _plugin_dir not in sys.path:
+    sys.path.append(_plugin_dir)
+try:
+    from handshake_catalog import open_catalog, potfile_keys
+except ImportError:
+    def open_catalog(handshake_dir):
+        return None
+
+    # installed without handshake_catalog.py, same format as its potfile_keys()
+    def potfile_keys(path):
+        with open(path, 'r', encoding='utf-8', errors='ignore') as f:
+            for line in f:
+                fields = line.strip().split(':')
+                if len(fields) < 4:
+                    continue
+                bssid, ssid = (fields[0], fields[2]) if len(fields[0]) == 12 else (fields[1], fields[3])
+                yield normalize_ssid(ssid), bssid.lower()
+
 TEMPLATE = """
 {% extends "base.html" %}
 {% set active_page = "handshakes" %}
@@ -127,21 +146,328 @@ TEMPLATE = """
 {% endblock %}
 """
 
+HANDSHAKE_EXTENSIONS = ['pcap', '22000', '16800']
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
+def normalize_ssid(ssid):
+    return ssid.replace("_", "").replace(" ", "").replace(".", "")
+
+
+def handshake_key(stem):
+    # capture names are SSID_BSSID, the SSID itself may contain underscores
+    ssid, sep, bssid = stem.rpartition('_')
+    if not sep or not ssid or not bssid:
+        return None
+    return normalize_ssid(ssid), bssid.lower()
+
+
 class Handshake:
     def __init__(self, name, path, ext):
         self.name = name
         self.path = path
         self.ext = ext
 
+
+class ZipStreamBuffer(io.RawIOBase):
+    """Unseekable sink for ZipFile, collects written bytes until the generator drains them."""
+
+    def __init__(self):
+        super().__init__()
+        self.chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self.chunks.append(bytes(b))
+        return len(b)
+
+    def drain(self):
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+class BundleSlice(io.RawIOBase):
+    """Read-only view of the first `size` bytes of a bundle, the archive its manifest describes.
+
+    Appends only write past that point, so a download keeps reading a
+    complete zip while the worker adds to the file.
+    """
+
+    def __init__(self, f, size):
+        super().__init__()
+        self.f = f
+        self.size = size
+        self.pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, b):
+        length = min(len(b), self.size - self.pos)
+        if length <= 0:
+            return 0
+        self.f.seek(self.pos)
+        data = self.f.read(length)
+        b[:len(data)] = data
+        self.pos += len(data)
+        return len(data)
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self.pos, io.SEEK_END: self.size}[whence]
+        self.pos = max(0, base + offset)
+        return self.pos
+
+    def tell(self):
+        return self.pos
+
+    def close(self):
+        self.f.close()
+        super().close()
+
+
+class PotfileIndex:
+    """Set of normalized (ssid, bssid) keys from the *.potfile files of a directory, re-parsed only when one changes.
+
+    Reads the same potfiles with the same parser as the handshake catalog, so
+    a capture counts as cracked whether or not the catalog is available.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.signature = None
+        self.keys = frozenset()
+
+    def get(self, directory):
+        signature = []
+        for potfile_path in sorted(glob.glob(os.path.join(directory, '*.potfile'))):
+            try:
+                st = os.stat(potfile_path)
+            except OSError as e:
+                logging.error(f"[Uncracked] error reading potfile: {e}")
+                continue
+            signature.append((potfile_path, st.st_mtime_ns, st.st_size))
+        if not signature:
+            logging.error("[Uncracked] potfile not found")
+        signature = tuple(signature)
+        with self.lock:
+            if signature != self.signature:
+                self.keys = self._parse(path for path, _, _ in signature)
+                self.signature = signature
+            return self.keys
+
+    def _parse(self, potfile_paths):
+        keys = set()
+        for potfile_path in potfile_paths:
+            try:
+                keys.update(potfile_keys(potfile_path))
+            except Exception as e:
+                logging.error(f"[Uncracked] error reading potfile: {e}")
+        logging.debug(f"[Uncracked] indexed {len(keys)} potfile entries")
+        return frozenset(keys)
+
+
+class BundleWorker:
+    """Keeps one ready-to-serve zip per extension, appending new captures and rebuilding only when entries must go.
+
+    New entries are written after the old central directory rather than over
+    it, so the first `size` bytes of a bundle are always the previous complete
+    archive. The manifest, saved only once an append is on disk, records that
+    size and the generation kept in the zip comment: a bundle longer than its
+    manifest is an interrupted append and is truncated back instead of being
+    appended to twice.
+
+    Downloads read only those first `size` bytes, so appends and rebuilds run
+    alongside them. The lock only keeps a bundle and its manifest in step: it
+    covers the swap of a rebuilt file and the manifest update, never the
+    copying of captures.
+    """
+
+    def __init__(self, plugin, bundle_dir, interval):
+        self.plugin = plugin
+        self.bundle_dir = bundle_dir
+        self.interval = interval
+        self.wakeup = threading.Event()
+        self.running = False
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def start(self):
+        if self.running:
+            return
+        os.makedirs(self.bundle_dir, exist_ok=True)
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        self.wakeup.set()
+
+    def bundle_path(self, ext):
+        return os.path.join(self.bundle_dir, f"handshakes_{ext}.zip")
+
+    def manifest_path(self, ext):
+        return os.path.join(self.bundle_dir, f"handshakes_{ext}.json")
+
+    def open_bundle(self, ext):
+        """(BundleSlice, manifest) of the complete bundle to serve, None when there is none."""
+        with self.lock:
+            manifest = self.load_manifest(ext)
+            if manifest is None:
+                return None
+            try:
+                f = open(self.bundle_path(ext), 'rb')
+            except OSError:
+                return None
+        try:
+            if not self.ends_at(f, manifest):
+                f.close()
+                return None
+        except OSError:
+            f.close()
+            return None
+        return BundleSlice(f, manifest['size']), manifest
+
+    def run(self):
+        while self.running:
+            for ext in HANDSHAKE_EXTENSIONS:
+                if not self.running:
+                    break
+                try:
+                    self.refresh(ext)
+                except Exception as e:
+                    logging.error(f"[Uncracked] error refreshing {ext} bundle: {e}")
+            self.wakeup.wait(self.interval)
+            self.wakeup.clear()
+
+    def load_manifest(self, ext):
+        try:
+            with open(self.manifest_path(ext), 'r') as f:
+                manifest = json.load(f)
+            if not all(key in manifest for key in ('entries', 'gen', 'size', 'dead')):
+                return None  # written before appends were crash-safe
+            manifest['entries'] = {name: tuple(sig) for name, sig in manifest['entries'].items()}
+            return manifest
+        except (OSError, ValueError, KeyError, AttributeError):
+            return None
+
+    def save_manifest(self, ext, manifest):
+        tmp_path = self.manifest_path(ext) + ".tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(manifest, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.manifest_path(ext))
+
+    @staticmethod
+    def generation_tag(gen):
+        return f"uncracked:{gen}".encode()
+
+    def ends_at(self, f, manifest):
+        """Whether the archive recorded in `manifest` ends in `f` where it says: end of central directory plus our comment."""
+        tag = self.generation_tag(manifest['gen'])
+        end_length = 22 + len(tag)
+        if manifest['size'] < end_length or os.fstat(f.fileno()).st_size < manifest['size']:
+            return False
+        f.seek(manifest['size'] - end_length)
+        end = f.read(end_length)
+        return end.startswith(b'PK\x05\x06') and end.endswith(tag)
+
+    def recover(self, ext, manifest):
+        """Entries of the bundle as recorded, undoing an unfinished append; None when the bundle can't be trusted."""
+        if manifest is None:
+            return None
+        path = self.bundle_path(ext)
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            return None
+        if size == manifest['size']:
+            return manifest['entries']
+        if size < manifest['size']:
+            return None
+        with open(path, 'r+b') as f:
+            if not self.ends_at(f, manifest):
+                return None
+            # downloads never read past manifest['size']
+            f.truncate(manifest['size'])
+        logging.warning(f"[Uncracked] dropped an unfinished append to the {ext} bundle")
+        return manifest['entries']
+
+    def refresh(self, ext):
+        directory = self.plugin.get_handshakes_dir()
+        wanted = {}
+        for name, path, _ in self.plugin.iter_uncracked([ext]):
+            wanted[os.path.relpath(path, directory)] = self.plugin.file_signature(path)
+
+        # only this thread writes bundles and manifests, no lock needed to read them
+        manifest = self.load_manifest(ext)
+        current = self.recover(ext, manifest)
+        if current == wanted:
+            return
+        # the stale central directories left behind by appends are reclaimed by a rebuild
+        if (current is not None and manifest['dead'] <= manifest['size'] // 4
+                and all(wanted.get(name) == sig for name, sig in current.items())):
+            added = [name for name in wanted if name not in current]
+            self.append(ext, manifest, wanted, added, directory)
+            logging.info(f"[Uncracked] updated {ext} bundle: {len(added)} added, {len(wanted)} total")
+        else:
+            self.rebuild(ext, manifest, wanted, directory)
+            logging.info(f"[Uncracked] rebuilt {ext} bundle: {len(wanted)} total")
+
+    def append(self, ext, manifest, wanted, added, directory):
+        size = manifest['size']
+        with open(self.bundle_path(ext), 'r+b') as f:
+            try:
+                with zipfile.ZipFile(f, 'a', compression=zipfile.ZIP_STORED) as zipf:
+                    dead = manifest['dead'] + size - zipf.start_dir
+                    zipf.start_dir = size
+                    for name in added:
+                        zipf.write(os.path.join(directory, name), name)
+                f.flush()
+                os.fsync(f.fileno())
+            except BaseException:
+                f.truncate(size)
+                raise
+            new_size = f.tell()
+        with self.lock:
+            self.save_manifest(ext, {'entries': wanted, 'gen': manifest['gen'], 'size': new_size, 'dead': dead})
+
+    def rebuild(self, ext, manifest, wanted, directory):
+        gen = manifest['gen'] + 1 if manifest else 1
+        tmp_path = self.bundle_path(ext) + ".tmp"
+        with open(tmp_path, 'wb') as f:
+            with zipfile.ZipFile(f, 'w', compression=zipfile.ZIP_STORED) as zipf:
+                zipf.comment = self.generation_tag(gen)
+                for name in wanted:
+                    zipf.write(os.path.join(directory, name), name)
+            f.flush()
+            os.fsync(f.fileno())
+            size = f.tell()
+        # a manifest left at the old generation doesn't match the new bundle, the next round rebuilds.
+        # Downloads of the old bundle keep their open file.
+        with self.lock:
+            os.replace(tmp_path, self.bundle_path(ext))
+            self.save_manifest(ext, {'entries': wanted, 'gen': gen, 'size': size, 'dead': 0})
+
+
 class UncrackedV2(plugins.Plugin):
     __author__ = 'NeonLightning'
-    __version__ = '1.0.5.1'
+    __version__ = '1.0.6'
     __license__ = 'GPL3'
     __editor__ = "avipars" # added in pwncrack potfile
     __description__ = 'Download handshake not found in wpa-sec or pwncrack from web-ui.'
 
     def __init__(self):
         self.ready = False
+        self.potfile_index = PotfileIndex()
+        self.bundles = None
 
     def on_loaded(self):
         logging.info("[Uncracked] plugin loaded")
@@ -149,69 +475,104 @@ class UncrackedV2(plugins.Plugin):
     def on_config_changed(self, config):
         self.config = config
         self.ready = True
+        if self.options.get('bundles', True) and self.bundles is None:
+            self.bundles = BundleWorker(self,
+                                        self.options.get('bundle_dir', '/root/.uncracked_bundles'),
+                                        self.options.get('bundle_interval', 300))
+            self.bundles.start()
 
-    def get_potfile(self):
-        base_dir = get_handshakes_dir(self)
-        return os.path.join(base_dir, "wpa-sec.cracked.potfile")
+    def on_handshake(self, agent, filename, access_point, client_station):
+        if self.bundles:
+            self.bundles.wakeup.set()
+
+    def on_unload(self, ui):
+        if self.bundles:
+            self.bundles.stop()
+            self.bundles = None
 
     def get_handshakes_dir(self):
         return self.config['bettercap']['handshakes']
 
     def read_potfile(self):
-        potfile_path = get_potfile(self)
-        try:
-            with open(potfile_path, 'r') as file_in:
-                lines = file_in.readlines()
-            return set((line.split(":")[2].replace("_", "").replace(" ", "").replace(".", ""), line.split(":")[0]) for line in lines if line.strip())
-        except FileNotFoundError:
-            logging.error("[Uncracked] potfile not found")
-            return set()
-        except Exception as e:
-            logging.error(f"[Uncracked] error reading potfile: {e}")
-            return set()
+        return self.potfile_index.get(self.get_handshakes_dir())
 
-    def find_uncracked_handshakes(self, unique_lines):
+    def get_catalog(self):
+        return open_catalog(self.get_handshakes_dir())
+
+    def file_signature(self, path):
+        catalog = self.get_catalog()
+        signature = catalog.stat(os.path.basename(path)) if catalog else None
+        if signature is None:
+            st = os.stat(path)
+            signature = (st.st_size, st.st_mtime_ns)
+        return tuple(signature)
+
+    def iter_uncracked(self, extensions=None):
+        """Single pass over the handshakes directory, yields (name, path, ext) for captures missing from the potfile."""
+        extensions = list(extensions or HANDSHAKE_EXTENSIONS)
+        catalog = self.get_catalog()
+        if catalog:
+            directory = self.get_handshakes_dir()
+            for name, ext, _, _ in catalog.uncracked(extensions):
+                yield name[:-len(ext) - 1], os.path.join(directory, name), ext
+            return
+        cracked = self.read_potfile()
+        with os.scandir(self.get_handshakes_dir()) as it:
+            for entry in it:
+                stem, _, ext = entry.name.rpartition('.')
+                if ext not in extensions or not entry.is_file():
+                    continue
+                key = handshake_key(stem)
+                if key is None or key in cracked:
+                    continue
+                yield stem, entry.path, ext
+
+    def find_uncracked_handshakes(self):
         handshakes = []
         try:
-            for ext in ['.pcap', '.16800', '.22000']:
-                pcapfiles = glob.glob(get_handshakes_dir(self), f"*{ext}")
-                for path in pcapfiles:
-                    name = os.path.basename(path)[:-len(ext)]
-                    fullpathNoExt = path[:-len(ext)]
-                    parts = name.split('_')
-                    if len(parts) < 2:
-                        continue 
-                    ssid = parts[0]
-                    bssid = parts[1]
-                    if not any(f"{potfile_ssid}_{potfile_bssid}" == f"{ssid}_{bssid}" for potfile_ssid, potfile_bssid in unique_lines):
-                        handshakes.append(Handshake(name, fullpathNoExt, [ext]))
+            for name, path, ext in self.iter_uncracked():
+                handshakes.append(Handshake(name, path[:-len(ext) - 1], [f".{ext}"]))
             handshakes = sorted(handshakes, key=lambda x: x.name.lower())
         except Exception as e:
             logging.error(f"[Uncracked] error finding uncracked handshakes: {e}")
         return handshakes
-    
+
     def compress_and_send(self, extension=None):
+        # bundles exist per extension only: one for "all" would hold every capture a second time on the
+        # card, so /download keeps streaming
+        bundle = self.bundles.open_bundle(extension) if self.bundles and extension else None
+        if bundle:
+            reader, manifest = bundle
+            logging.info(f"[Uncracked] Sending prebuilt {extension} bundle")
+            try:
+                response = make_response(send_file(reader, mimetype='application/zip', as_attachment=True,
+                                                   download_name=f"handshakes_{extension}.zip", conditional=False,
+                                                   etag=f"{manifest['gen']}-{manifest['size']}"))
+                response.content_length = manifest['size']
+                # If-None-Match answered with 304, Range with 206
+                response.make_conditional(request, accept_ranges=True, complete_length=manifest['size'])
+            except BaseException:
+                reader.close()
+                raise
+            response.headers['Cache-Control'] = 'no-cache'
+            self.bundles.wakeup.set()
+            return response
+        if self.options.get('stream_downloads', True):
+            return self.stream_zip(extension)
         logging.info("[Uncracked] Compressing and sending")
-        directory_to_compress = get_handshakes_dir(self)
+        directory_to_compress = self.get_handshakes_dir()
         logging.debug(f"[Uncracked] Compressing and sending {directory_to_compress}")
         zip_suffix = f"_{extension}" if extension else ""
         zip_file_path = f"/tmp/handshakes{zip_suffix}.zip"
         logging.info(f"[Uncracked] Compressing and sending {zip_file_path}")
-        default_extensions = ['pcap', '22000', '16800']
-        extensions = extension.split(',') if extension else default_extensions
+        extensions = extension.split(',') if extension else HANDSHAKE_EXTENSIONS
         if os.path.exists(zip_file_path):
             os.remove(zip_file_path)
         try:
             with zipfile.ZipFile(zip_file_path, 'w') as zipf:
-                for root, _, files in os.walk(directory_to_compress):
-                    for file in files:
-                        file_extension = file.split('.')[-1]
-                        if file_extension in extensions:
-                            file_path = os.path.join(root, file)
-                            ssid_bssid_ext = '.'.join(file.split('.')[:-1])
-                            if not self.is_in_potfile(ssid_bssid_ext):
-                                zipf.write(file_path, os.path.relpath(file_path, directory_to_compress))
-                                logging.debug(f"[Uncracked] Added file to zip archive: {file_path}")
+                for name, file_path, ext in self.iter_uncracked(extensions):
+                    zipf.write(file_path, os.path.relpath(file_path, directory_to_compress))
+                    logging.debug(f"[Uncracked] Added file to zip archive: {file_path}")
             logging.debug(f"[Uncracked] Added files to zip archive")
             response = make_response(send_file(zip_file_path, as_attachment=True))
             response.headers['Cache-Control'] = 'no-store, no-cache, must-revalidate, max-age=0'
@@ -222,25 +583,56 @@ class UncrackedV2(plugins.Plugin):
             logging.error(f"[Uncracked] Error compressing and sending file: {e}")
             abort(500)
 
-    def is_in_potfile(self, ssid_bssid_ext):
-        potfile_path = get_potfile(self)
-        try:
-            with open(potfile_path, 'r') as file_in:
-                lines = file_in.readlines()
-            lines = [line.strip() for line in lines if line.strip()]
-            for line in lines:
-                fields = line.split(":")
-                ssid = fields[2].replace("_", "").replace(" ", "").replace(".", "")
-                bssid = fields[0]
-                if f"{ssid}_{bssid}" in ssid_bssid_ext:
-                    return True
-            return False
-        except FileNotFoundError:
-            logging.error("[Uncracked] potfile not found")
-            return False
-        except Exception as e:
-            logging.error(f"[Uncracked] error reading potfile: {e}")
-            return False
+    def iter_zip(self, extensions):
+        """Yield a zip archive of the uncracked captures piece by piece, pcaps are stored as is."""
+        directory = self.get_handshakes_dir()
+        buffer = ZipStreamBuffer()
+        with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_STORED) as zipf:
+            for name, file_path, ext in self.iter_uncracked(extensions):
+                # a file can only be skipped before its local header is out
+                try:
+                    src = open(file_path, 'rb')
+                except OSError as e:
+                    logging.error(f"[Uncracked] skipping {file_path}: {e}")
+                    continue
+                with src:
+                    try:
+                        zinfo = zipfile.ZipInfo.from_file(file_path, os.path.relpath(file_path, directory))
+                    except OSError as e:
+                        logging.error(f"[Uncracked] skipping {file_path}: {e}")
+                        continue
+                    try:
+                        with zipf.open(zinfo, 'w') as dest:
+                            yield buffer.drain()
+                            while True:
+                                chunk = src.read(STREAM_CHUNK_SIZE)
+                                if not chunk:
+                                    break
+                                dest.write(chunk)
+                                yield buffer.drain()
+                    except OSError as e:
+                        # half an entry is already sent, end the response short rather than as a broken zip
+                        logging.error(f"[Uncracked] aborting download, failed reading {file_path}: {e}")
+                        raise
+                logging.debug(f"[Uncracked] Streamed file: {file_path}")
+        yield buffer.drain()
+
+    def stream_zip(self, extension=None):
+        zip_suffix = f"_{extension}" if extension else ""
+        extensions = extension.split(',') if extension else HANDSHAKE_EXTENSIONS
+        logging.info(f"[Uncracked] Streaming handshakes{zip_suffix}.zip")
+        headers = {
+            'Content-Disposition': f'attachment; filename=handshakes{zip_suffix}.zip',
+            'Cache-Control': 'no-store, no-cache, must-revalidate, max-age=0',
+            'Pragma': 'no-cache',
+            'Expires': '0',
+        }
+        chunks = (chunk for chunk in self.iter_zip(extensions) if chunk)
+        return Response(stream_with_context(chunks), mimetype='application/zip', headers=headers)
+
+    def is_in_potfile(self, ssid_bssid):
+        key = handshake_key(ssid_bssid)
+        return key is not None and key in self.read_potfile()
 
     def on_webhook(self, path, request):
         try:
@@ -248,8 +640,7 @@ class UncrackedV2(plugins.Plugin):
                 return "Plugin not ready"
             if path == "/" or not path:
                 logging.info(f"[Uncracked] Loaded webhook")
-                unique_lines = self.read_potfile()
-                data = self.find_uncracked_handshakes(unique_lines)
+                data = self.find_uncracked_handshakes()
                 return render_template_string(TEMPLATE, title="Handshakes | " + pwnagotchi.name(), handshakes=data)
             elif path == "download":
                 logging.debug("[Uncracked] Compressing and sending on webhook")
@@ -271,13 +662,19 @@ class UncrackedV2(plugins.Plugin):
             abort(500)
 
     def serve_file(self, path):
-        dir = get_handshakes_dir(self)
+        dir = self.get_handshakes_dir()
         try:
             logging.info(f"[Uncracked] serving {dir}/{path}")
-            response = send_from_directory(directory=dir, path=path, as_attachment=True)
-            response.headers['Cache-Control'] = 'no-store, no-cache, must-revalidate, max-age=0'
-            response.headers['Pragma'] = 'no-cache'
-            response.headers['Expires'] = '0'
+            # conditional send_file answers If-None-Match/If-Modified-Since with 304 and Range with 206
+            catalog = self.get_catalog()
+            validators = catalog.validators(path) if catalog else None
+            if validators:
+                etag, last_modified = validators
+                response = send_from_directory(directory=dir, path=path, as_attachment=True, conditional=True,
+                                               etag=etag, last_modified=last_modified)
+            else:
+                response = send_from_directory(directory=dir, path=path, as_attachment=True, conditional=True)
+            response.headers['Cache-Control'] = 'no-cache'
             return response
         except FileNotFoundError:
             logging.error(f"[Uncracked] file not found: {path}")
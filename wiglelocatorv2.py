@@ -1,33 +1,531 @@
 import requests
 import os
+import re
+import csv
+import gzip
+import math
+import time
+import sqlite3
 import logging
+import threading
+import xml.etree.ElementTree as ET
 from pwnagotchi.plugins import Plugin
 
+CELL_SIZE = 0.01  # degrees per grid cell of the network index, roughly one kilometre
+IMPORT_BATCH = 5000
+IMPORT_POLL = 600
+IMPORT_SETTLE = 60  # seconds between polls while an export may still be copied in
+IMPORT_EXTENSIONS = ('.csv', '.csv.gz', '.kml', '.kml.gz')
+NEAREST_LIMIT = 25
+NEAREST_MAX_RINGS = 10
+
+TEMPLATE = """
+{% extends "base.html" %}
+{% set active_page = "plugins" %}
+
+{% block title %}
+    {{ title }}
+{% endblock %}
+
+{% block styles %}
+{{ super() }}
+    <style>
+        table {
+            table-layout: auto;
+            width: 100%;
+        }
+
+        table, th, td {
+            border: 1px solid black;
+            border-collapse: collapse;
+        }
+
+        th, td {
+            padding: 15px;
+            text-align: left;
+        }
+
+        table tr:nth-child(even) {
+            background-color: #eee;
+        }
+
+        table th {
+            background-color: black;
+            color: white;
+        }
+    </style>
+{% endblock %}
+
+{% block content %}
+    <p>{{ total }} networks in the local index.</p>
+    {% if lat is none %}
+        <p>No GPS fix yet, pass ?lat=..&amp;lon=.. to search around a position.</p>
+    {% else %}
+        <p>Nearest known networks around {{ '%.5f' | format(lat) }}, {{ '%.5f' | format(lon) }}:</p>
+        <table>
+            <tr>
+                <th>BSSID</th>
+                <th>SSID</th>
+                <th>Distance</th>
+                <th>Position</th>
+                <th>Best signal</th>
+                <th>Samples</th>
+            </tr>
+            {% for n in networks %}
+                <tr>
+                    <td>{{ n.bssid }}</td>
+                    <td>{{ n.ssid }}</td>
+                    <td>{{ n.distance | round | int }} m</td>
+                    <td>{{ '%.5f' | format(n.lat) }}, {{ '%.5f' | format(n.lon) }}</td>
+                    <td>{{ n.rssi if n.rssi is not none else '' }}</td>
+                    <td>{{ n.samples }}</td>
+                </tr>
+            {% endfor %}
+        </table>
+    {% endif %}
+{% endblock %}
+"""
+
+
+def distance(lat1, lon1, lat2, lon2):
+    x = math.radians(lon2 - lon1) * math.cos(math.radians((lat1 + lat2) / 2))
+    y = math.radians(lat2 - lat1)
+    return 6371000 * math.hypot(x, y)
+
+
+def open_export(path):
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', encoding='utf-8', errors='replace', newline='')
+    return open(path, 'r', encoding='utf-8', errors='replace', newline='')
+
+
+def read_csv_export(path):
+    """Yield (bssid, ssid, lat, lon, rssi, seen) from a WiGLE CSV export, one line at a time."""
+    with open_export(path) as export:
+        first = export.readline()
+        # WiGLE puts a 'WigleWifi-1.x,appRelease=...' line above the column header
+        header = first if not first.startswith('WigleWifi') else export.readline()
+        reader = csv.DictReader(export, fieldnames=next(csv.reader([header])))
+        for row in reader:
+            if row.get('Type', 'WIFI') != 'WIFI' or not row.get('MAC'):
+                continue
+            try:
+                lat = float(row['CurrentLatitude'])
+                lon = float(row['CurrentLongitude'])
+                rssi = float(row['RSSI']) if row.get('RSSI') else None
+            except (KeyError, TypeError, ValueError):
+                continue
+            if lat == 0 and lon == 0:
+                continue
+            yield row['MAC'].lower(), row.get('SSID') or '', lat, lon, rssi, row.get('FirstSeen') or ''
+
+
+def read_kml_export(path):
+    """Yield (bssid, ssid, lat, lon, rssi, seen) from a WiGLE KML export, dropping each placemark once read."""
+    stack = []
+    with open_export(path) as export:
+        for event, elem in ET.iterparse(export, events=('start', 'end')):
+            if event == 'start':
+                stack.append(elem)
+                continue
+            stack.pop()
+            if not elem.tag.endswith('Placemark'):
+                continue
+            fields = {child.tag.rsplit('}', 1)[-1]: (child.text or '').strip() for child in elem.iter()}
+            description = fields.get('description', '')
+            netid = re.search(r'Network ID:\s*([0-9A-Fa-f:]{17})', description)
+            kind = re.search(r'Type:\s*(\w+)', description)
+            coordinates = fields.get('coordinates', '').split(',')
+            if netid and (not kind or kind.group(1) == 'WIFI') and len(coordinates) >= 2:
+                signal = re.search(r'Signal:\s*(-?[\d.]+)', description)
+                seen = re.search(r'Time:\s*([^\n<]+)', description)
+                try:
+                    lon, lat = float(coordinates[0]), float(coordinates[1])
+                    yield (netid.group(1).lower(), fields.get('name', ''), lat, lon,
+                           float(signal.group(1)) if signal else None, seen.group(1).strip() if seen else '')
+                except ValueError:
+                    pass
+            # keep memory flat on multi-GB files
+            if stack:
+                stack[-1].remove(elem)
+
+
+class TokenBucket:
+    """Paces WiGLE requests: `rate` tokens per second, bursts of up to `capacity`."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0
+
+    def pause(self, seconds):
+        # a Retry-After answer empties the bucket and blocks it for the given time
+        self.tokens = 0
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+    def wait_time(self):
+        now = time.monotonic()
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+
+class LocationStore:
+    """Per-BSSID WiGLE results with their fetch time, and the lookups still waiting for a connection."""
+
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS locations (
+                bssid TEXT PRIMARY KEY,
+                essid TEXT,
+                lat REAL,
+                lon REAL,
+                found INTEGER NOT NULL,
+                fetched REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS pending (
+                bssid TEXT PRIMARY KEY,
+                essid TEXT,
+                queued REAL NOT NULL
+            );
+        """)
+        self.db.commit()
+
+    def get(self, bssid, ttl, miss_ttl):
+        """Cached (found, location) for a BSSID, or None when missing or expired."""
+        with self.lock:
+            row = self.db.execute("SELECT lat, lon, found, fetched FROM locations WHERE bssid = ?",
+                                  (bssid.lower(),)).fetchone()
+        if row is None:
+            return None
+        lat, lon, found, fetched = row
+        if time.time() - fetched > (ttl if found else miss_ttl):
+            return None
+        return bool(found), ({'lat': lat, 'lon': lon} if found else None)
+
+    def enqueue(self, bssid, essid):
+        with self.lock:
+            self.db.execute("INSERT OR IGNORE INTO pending VALUES (?, ?, ?)", (bssid.lower(), essid, time.time()))
+            self.db.commit()
+
+    def pending(self, limit):
+        with self.lock:
+            return self.db.execute("SELECT bssid, essid FROM pending ORDER BY queued LIMIT ?", (limit,)).fetchall()
+
+    def pending_count(self):
+        with self.lock:
+            return self.db.execute("SELECT COUNT(*) FROM pending").fetchone()[0]
+
+    def record(self, bssid, essid, location):
+        with self.lock:
+            self.db.execute("INSERT OR REPLACE INTO locations VALUES (?, ?, ?, ?, ?, ?)",
+                            (bssid, essid, location['lat'] if location else None,
+                             location['lon'] if location else None, 1 if location else 0, time.time()))
+            self.db.execute("DELETE FROM pending WHERE bssid = ?", (bssid,))
+
+    def commit(self):
+        with self.lock:
+            self.db.commit()
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+
+class NetworkIndex:
+    """Networks imported from WiGLE exports, by BSSID and by grid cell.
+
+    Every observation moves the stored position towards its own, weighted by
+    signal strength, so the position converges on the access point rather than
+    on wherever it was first seen. The weighted sums are kept per export file
+    in `contributions`: importing a file again replaces what it contributed
+    before instead of counting its observations twice.
+    """
+
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.create_function('grid_cell', 1, lambda v: int(math.floor(v / CELL_SIZE)))
+        # the command line importer may write while the plugin reads
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS networks (
+                bssid TEXT PRIMARY KEY,
+                ssid TEXT,
+                lat REAL NOT NULL,
+                lon REAL NOT NULL,
+                weight REAL NOT NULL,
+                rssi REAL,
+                samples INTEGER NOT NULL,
+                seen TEXT,
+                cell_lat INTEGER NOT NULL,
+                cell_lon INTEGER NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS networks_cell ON networks (cell_lat, cell_lon);
+            CREATE TABLE IF NOT EXISTS imports (
+                name TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                networks INTEGER NOT NULL,
+                imported REAL NOT NULL
+            );
+        """)
+        migrate = self.db.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'contributions'").fetchone() is None
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS contributions (
+                source TEXT NOT NULL,
+                bssid TEXT NOT NULL,
+                ssid TEXT,
+                weight REAL NOT NULL,
+                wlat REAL NOT NULL,
+                wlon REAL NOT NULL,
+                rssi REAL,
+                samples INTEGER NOT NULL,
+                seen TEXT,
+                PRIMARY KEY (source, bssid)
+            );
+            CREATE INDEX IF NOT EXISTS contributions_bssid ON contributions (bssid);
+            CREATE TEMP TABLE IF NOT EXISTS touched (bssid TEXT PRIMARY KEY);
+        """)
+        if migrate:
+            # networks imported before contributions were kept: one anonymous source that no file replaces
+            self.db.execute("""
+                INSERT INTO contributions (source, bssid, ssid, weight, wlat, wlon, rssi, samples, seen)
+                SELECT '', bssid, ssid, weight, lat * weight, lon * weight, rssi, samples, seen FROM networks
+            """)
+        self.db.commit()
+
+    @staticmethod
+    def signal_weight(rssi):
+        return 10 ** (((rssi if rssi is not None else -80) + 100) / 20.0)
+
+    def imported(self, path):
+        st = os.stat(path)
+        with self.lock:
+            row = self.db.execute("SELECT size, mtime_ns FROM imports WHERE name = ?",
+                                  (os.path.abspath(path),)).fetchone()
+        return row == (st.st_size, st.st_mtime_ns)
+
+    def import_file(self, path):
+        """Stream a WiGLE .csv or .kml export (optionally gzipped) into the index, returns the row count.
+
+        The import is one transaction: networks change only once the whole
+        file is read, and an import cut short leaves the index as it was.
+        """
+        st = os.stat(path)
+        source = os.path.abspath(path)
+        reader = read_kml_export if path.endswith(('.kml', '.kml.gz')) else read_csv_export
+        count = 0
+        batch = []
+
+        def flush():
+            with self.lock:
+                self.db.executemany("""
+                    INSERT INTO contributions (source, bssid, ssid, weight, wlat, wlon, rssi, samples, seen)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, 1, ?)
+                    ON CONFLICT(source, bssid) DO UPDATE SET
+                        ssid = CASE WHEN excluded.ssid != '' THEN excluded.ssid ELSE contributions.ssid END,
+                        weight = contributions.weight + excluded.weight,
+                        wlat = contributions.wlat + excluded.wlat,
+                        wlon = contributions.wlon + excluded.wlon,
+                        rssi = max(coalesce(contributions.rssi, excluded.rssi), coalesce(excluded.rssi, contributions.rssi)),
+                        samples = contributions.samples + 1,
+                        seen = max(contributions.seen, excluded.seen)
+                """, batch)
+                self.db.executemany("INSERT OR IGNORE INTO touched VALUES (?)", [(row[1],) for row in batch])
+            batch.clear()
+
+        try:
+            with self.lock:
+                self.db.execute("DELETE FROM touched")
+                # what an earlier import of this file added is replaced, not added to
+                self.db.execute("INSERT OR IGNORE INTO touched SELECT bssid FROM contributions WHERE source = ?",
+                                (source,))
+                self.db.execute("DELETE FROM contributions WHERE source = ?", (source,))
+            for bssid, ssid, lat, lon, rssi, seen in reader(path):
+                weight = self.signal_weight(rssi)
+                batch.append((source, bssid, ssid, weight, lat * weight, lon * weight, rssi, seen))
+                count += 1
+                if len(batch) >= IMPORT_BATCH:
+                    flush()
+            if batch:
+                flush()
+            with self.lock:
+                self._rebuild_touched()
+                self.db.execute("INSERT OR REPLACE INTO imports VALUES (?, ?, ?, ?, ?)",
+                                (source, st.st_size, st.st_mtime_ns, count, time.time()))
+                self.db.commit()
+        except BaseException:
+            with self.lock:
+                self.db.rollback()
+            raise
+        return count
+
+    def _rebuild_touched(self):
+        # networks rows are the sums over every file that saw the BSSID
+        self.db.execute("""
+            INSERT OR REPLACE INTO networks (bssid, ssid, lat, lon, weight, rssi, samples, seen, cell_lat, cell_lon)
+            SELECT bssid, ssid, lat, lon, weight, rssi, samples, seen, grid_cell(lat), grid_cell(lon) FROM (
+                SELECT c.bssid AS bssid,
+                       (SELECT s.ssid FROM contributions s WHERE s.bssid = c.bssid AND s.ssid != ''
+                        ORDER BY s.seen DESC LIMIT 1) AS ssid,
+                       SUM(c.wlat) / SUM(c.weight) AS lat, SUM(c.wlon) / SUM(c.weight) AS lon,
+                       SUM(c.weight) AS weight, MAX(c.rssi) AS rssi, SUM(c.samples) AS samples, MAX(c.seen) AS seen
+                FROM contributions c WHERE c.bssid IN (SELECT bssid FROM touched) GROUP BY c.bssid
+            )
+        """)
+        self.db.execute("""
+            DELETE FROM networks WHERE bssid IN (SELECT bssid FROM touched)
+                AND bssid NOT IN (SELECT bssid FROM contributions)
+        """)
+        self.db.execute("DELETE FROM touched")
+
+    def lookup(self, bssid):
+        with self.lock:
+            row = self.db.execute("SELECT lat, lon FROM networks WHERE bssid = ?", (bssid.lower(),)).fetchone()
+        return {'lat': row[0], 'lon': row[1]} if row else None
+
+    def count(self):
+        with self.lock:
+            return self.db.execute("SELECT COUNT(*) FROM networks").fetchone()[0]
+
+    def nearest(self, lat, lon, limit=NEAREST_LIMIT):
+        """The `limit` indexed networks closest to (lat, lon), searching outwards one ring of cells at a time."""
+        cell_lat, cell_lon = int(math.floor(lat / CELL_SIZE)), int(math.floor(lon / CELL_SIZE))
+        rows = []
+        last_ring = NEAREST_MAX_RINGS
+        for ring in range(NEAREST_MAX_RINGS + 1):
+            with self.lock:
+                rows = self.db.execute("""
+                    SELECT bssid, ssid, lat, lon, rssi, samples FROM networks
+                    WHERE cell_lat BETWEEN ? AND ? AND cell_lon BETWEEN ? AND ?
+                """, (cell_lat - ring, cell_lat + ring, cell_lon - ring, cell_lon + ring)).fetchall()
+            # the square can hold enough networks while a closer one sits just across its edge,
+            # one more ring settles the order
+            if len(rows) >= limit and last_ring == NEAREST_MAX_RINGS:
+                last_ring = min(ring + 1, NEAREST_MAX_RINGS)
+            if ring >= last_ring:
+                break
+        networks = [dict(bssid=bssid, ssid=ssid, lat=n_lat, lon=n_lon, rssi=rssi, samples=samples,
+                         distance=distance(lat, lon, n_lat, n_lon))
+                    for bssid, ssid, n_lat, n_lon, rssi, samples in rows]
+        networks.sort(key=lambda n: n['distance'])
+        return networks[:limit]
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+
+class RateLimited(Exception):
+    def __init__(self, retry_after):
+        super().__init__(f'rate limited for {retry_after}s')
+        self.retry_after = retry_after
+
 
 class WigleLocatorV2(Plugin):
     __author__ = 'WPA2'
     __editor__ = 'avipars'
-    __version__ = '1.0.0.2'
+    __version__ = '1.1.0'
     __license__ = 'GPL3'
     __description__ = 'Fetches AP location data from WiGLE and saves it with handshake files'
 
+    API_URL = 'https://api.wigle.net/api/v2/network/detail'
+    # internet_available fires about once a minute while connected, lookups only run inside that window
+    ONLINE_GRACE = 120
+    BATCH_SIZE = 50
+
     def __init__(self):
         self.api_key = None  # API key will be set in config.toml
-        self.is_disabled = False
-        
+        self.ready = False
+        self.store = None
+        self.networks = None
+        self.import_dir = None
+        self.importer = None
+        self.agent = None
+        self.session = requests.Session()
+        self.bucket = None
+        self.last_online = 0
+        self.wakeup = threading.Event()
+        self.stop = threading.Event()
+        self.worker = None
+        self.timeout = 30
+
     def on_loaded(self):
-        if self.is_disabled:
-            logging.info("[WigleLocatorV2] plugin loaded but disabled due to 429 error.")
-            return
+        home = os.path.join(os.path.expanduser('~'), 'WigleLocatorV2')
+        os.makedirs(home, exist_ok=True)
+        if 'api_url' in self.options:
+            self.API_URL = self.options['api_url']
+        self.store = LocationStore(self.options.get('db_path', os.path.join(home, 'locations.db')))
+        self.networks = NetworkIndex(self.options.get('index_path', os.path.join(home, 'networks.db')))
+        # WiGLE .csv/.kml exports (optionally .gz) dropped here are imported in the background
+        self.import_dir = self.options.get('import_dir', os.path.join(home, 'imports'))
+        os.makedirs(self.import_dir, exist_ok=True)
+        self.timeout = self.options.get('timeout', 30)
+        self.ttl = self.options.get('cache_ttl', 30) * 86400
+        self.miss_ttl = self.options.get('miss_ttl', 7) * 86400
+        # WiGLE's detail quota is small and daily, default to one request every two minutes with short bursts
+        self.bucket = TokenBucket(self.options.get('requests_per_hour', 30) / 3600.0,
+                                  self.options.get('burst', 5))
+        self.default_retry_after = self.options.get('retry_after', 3600)
+        self.worker = threading.Thread(target=self._lookup_worker, name='WigleLocatorV2', daemon=True)
+        self.worker.start()
+        self.importer = threading.Thread(target=self._import_worker, name='WigleLocatorV2-import', daemon=True)
+        self.importer.start()
+        self.ready = True
         logging.info(f"[WigleLocatorV2] plugin fully loaded with configuration: {self.options}")
 
+    def on_unload(self, ui):
+        self.stop.set()
+        self.wakeup.set()
+        if self.worker is not None:
+            self.worker.join(timeout=self.timeout + 5)
+        if self.importer is not None:
+            self.importer.join(timeout=5)
+        self.session.close()
+        if self.store is not None:
+            self.store.close()
+        if self.networks is not None and (self.importer is None or not self.importer.is_alive()):
+            self.networks.close()
+
+    def on_ready(self, agent):
+        self.agent = agent
+
     def on_webhook(self, path, request):
+        from flask import abort, render_template_string
         if not self.ready:
             return "Plugin not ready"
 
         if path == "/" or not path:
-            return self.api_key
-          
+            try:
+                lat = float(request.args['lat'])
+                lon = float(request.args['lon'])
+            except (KeyError, ValueError):
+                lat = lon = None
+                gps = self.agent.session().get('gps', {}) if self.agent else {}
+                if gps.get('Latitude'):
+                    lat, lon = gps['Latitude'], gps['Longitude']
+            try:
+                limit = min(500, max(1, int(request.args.get('limit', NEAREST_LIMIT))))
+            except ValueError:
+                limit = NEAREST_LIMIT
+            networks = self.networks.nearest(lat, lon, limit) if lat is not None else []
+            return render_template_string(TEMPLATE, title="WigleLocatorV2", lat=lat, lon=lon,
+                                          networks=networks, total=self.networks.count())
+        abort(404)
+
     def on_config_changed(self, config):
         # Load the WiGLE API key from config.toml
         self.api_key = config.get('main', {}).get('plugins', {}).get('WigleLocatorV2', {}).get('api_key', None)
@@ -37,35 +535,117 @@ class WigleLocatorV2(Plugin):
         else:
             logging.info('[WigleLocatorV2] API key successfully loaded.')
 
+    def on_internet_available(self, agent):
+        self.agent = agent
+        self.last_online = time.monotonic()
+        self.wakeup.set()
+
     def on_handshake(self, agent, filename, access_point, client_station):
         logging.info(f"[WigleLocatorV2] Handshake event captured. Access Point: {access_point['hostname']}, Client Station: {client_station['mac']}")
-        
-        if self.is_disabled:
-            logging.info("[WigleLocatorV2] Plugin is disabled due to previous rate limit error. Skipping API request.")
+        if not self.ready:
             return
-
-        config = agent.config()
-        display = agent.view()
+        self.agent = agent
 
         bssid = access_point["mac"]
         essid = access_point["hostname"]
 
-        # Fetch the AP location from WiGLE
-        location = self._get_location_from_wigle(bssid)
+        # imported exports first, most networks around us are already known
+        known = self.networks.lookup(bssid)
+        if known is not None:
+            self._show_location(essid, known)
+            return
+
+        cached = self.store.get(bssid, self.ttl, self.miss_ttl)
+        if cached is not None:
+            found, location = cached
+            if found:
+                self._show_location(essid, location)
+            else:
+                logging.debug(f'[WigleLocatorV2] No location known for BSSID: {bssid} (cached)')
+            return
 
-        if location:
+        # never block the event dispatch on WiGLE, the worker picks it up once we are online
+        self.store.enqueue(bssid, essid)
+        self.wakeup.set()
+
+    def _show_location(self, essid, location):
+        logging.info(f'[WigleLocatorV2] Location for {essid}: Latitude {location["lat"]}, Longitude {location["lon"]}')
+        if self.agent is not None:
             # Display location on Pwnagotchi UI (if UI is enabled)
+            display = self.agent.view()
             display.set("status", f'AP Location: {location["lat"]}, {location["lon"]}')
             display.update(force=True)
-            logging.info(f'[WigleLocatorV2] Location found: Latitude {location["lat"]}, Longitude {location["lon"]}')
 
-            # Save the location information to the handshake folder
-            self._save_location(essid, location)
-        else:
-            logging.warning(f'[WigleLocatorV2] No location found for BSSID: {bssid}')
+    def _online(self):
+        return time.monotonic() - self.last_online < self.ONLINE_GRACE
+
+    def _import_worker(self):
+        # (size, mtime_ns) of the files not imported yet as of the previous poll
+        last_seen = {}
+        while not self.stop.is_set():
+            try:
+                names = sorted(os.listdir(self.import_dir))
+            except OSError as e:
+                logging.error(f'[WigleLocatorV2] Cannot read import directory {self.import_dir}: {e}')
+                names = []
+            seen = {}
+            for name in names:
+                path = os.path.join(self.import_dir, name)
+                if self.stop.is_set() or not name.endswith(IMPORT_EXTENSIONS):
+                    continue
+                try:
+                    if self.networks.imported(path):
+                        continue
+                    st = os.stat(path)
+                    seen[path] = (st.st_size, st.st_mtime_ns)
+                    if last_seen.get(path) != seen[path]:
+                        # possibly still being copied in, import once it stays the same for a poll
+                        continue
+                    logging.info(f'[WigleLocatorV2] Importing {path}')
+                    count = self.networks.import_file(path)
+                    logging.info(f'[WigleLocatorV2] Imported {count} observations from {path}')
+                    del seen[path]
+                except (OSError, ET.ParseError, csv.Error, sqlite3.Error) as e:
+                    logging.error(f'[WigleLocatorV2] Import of {path} failed: {e}')
+                    # retried at the regular interval, not every settle poll
+                    seen.pop(path, None)
+            last_seen = seen
+            self.stop.wait(IMPORT_SETTLE if seen else IMPORT_POLL)
+
+    def _lookup_worker(self):
+        while not self.stop.is_set():
+            self.wakeup.wait(60)
+            self.wakeup.clear()
+            while not self.stop.is_set() and self.api_key and self._online():
+                batch = self.store.pending(self.BATCH_SIZE)
+                if not batch:
+                    break
+                logging.debug(f"[WigleLocatorV2] Resolving {len(batch)} queued BSSIDs")
+                try:
+                    for bssid, essid in batch:
+                        delay = self.bucket.wait_time()
+                        while delay > 0 and not self.stop.is_set():
+                            self.stop.wait(min(delay, 60))
+                            delay = self.bucket.wait_time()
+                        if self.stop.is_set() or not self._online():
+                            break
+                        self.bucket.take()
+                        location = self._get_location_from_wigle(bssid)
+                        self.store.record(bssid, essid, location)
+                        if location:
+                            self._show_location(essid, location)
+                except RateLimited as e:
+                    logging.warning(f'[WigleLocatorV2] WiGLE API rate limit exceeded, pausing lookups for {e.retry_after}s.')
+                    self.bucket.pause(e.retry_after)
+                except requests.exceptions.RequestException as e:
+                    # most likely the connection went away, wait for the next internet_available
+                    logging.warning(f'[WigleLocatorV2] WiGLE request failed, deferring lookups: {e}')
+                    self.last_online = 0
+                finally:
+                    self.store.commit()
 
     def _get_location_from_wigle(self, bssid):
-   
+
         headers = {
             'Authorization': 'Basic ' + self.api_key
         }
@@ -73,51 +653,49 @@ class WigleLocatorV2(Plugin):
             'netid': bssid,
         }
 
-        response = requests.get('https://api.wigle.net/api/v2/network/detail', headers=headers, params=params)
+        response = self.session.get(self.API_URL, headers=headers, params=params, timeout=self.timeout)
         logging.info(f"[WigleLocatorV2] WiGLE API request for BSSID {bssid}, response code: {response.status_code}")
 
         if response.status_code == 200:
             data = response.json()
             # Log only the relevant details (SSID, latitude, and longitude)
-            if data['success'] and data['results']:
+            if data.get('success') and data.get('results'):
                 result = data['results'][0]
                 ssid = result.get('ssid', 'N/A')
-                trilat = result.get('trilat', 'N/A')
-                trilong = result.get('trilong', 'N/A')
+                trilat = result.get('trilat')
+                trilong = result.get('trilong')
                 logging.info(f"[WigleLocatorV2] WiGLE API result: SSID={ssid}, Lat={trilat}, Long={trilong}")
 
                 # Return the first result's location details
-                return {
-                    'lat': trilat,
-                    'lon': trilong
-                }
-            else:
-                logging.warning(f'[WigleLocatorV2] No location data found for BSSID: {bssid}')
-        elif response.status_code == 429:
-            logging.error(f'[WigleLocatorV2] WiGLE API rate limit exceeded. Try again tomorrow. Disabling plugin to prevent further requests.')
-            self.is_disabled = True  # Disable the plugin on rate limit exceed to prevent further requests
-        else:
-            logging.error(f'[WigleLocatorV2] Error fetching WiGLE data: {response.status_code}')
-        return None
-
-    def _save_location(self, essid, location):
-        # Replace spaces in the ESSID with underscores to avoid issues in file naming
-        essid_safe = essid.replace(" ", "_")
-
-        # Dynamically detect the current user's home directory
-        user_home = os.path.expanduser('~')
-        save_dir = os.path.join(user_home, 'WigleLocatorV2')
-
-        # Ensure the directory exists
-        if not os.path.exists(save_dir):
-            os.makedirs(save_dir)
-
-        # Create a file in the custom directory with the ESSID name and location data
-        location_file = os.path.join(save_dir, f'{essid_safe}_location.txt')
-
-        logging.info(f"[WigleLocatorV2] Attempting to save location data to {location_file}")
-        with open(location_file, 'w') as f:
-            f.write(f'ESSID: {essid}\n')
-            f.write(f'Latitude: {location["lat"]}\n')
-            f.write(f'Longitude: {location["lon"]}\n')
-        logging.info(f'[WigleLocatorV2] Successfully saved location data to {location_file}')
+                if trilat is not None and trilong is not None:
+                    return {
+                        'lat': trilat,
+                        'lon': trilong
+                    }
+            logging.warning(f'[WigleLocatorV2] No location data found for BSSID: {bssid}')
+            return None
+        if response.status_code == 429:
+            try:
+                retry_after = int(response.headers.get('Retry-After', self.default_retry_after))
+            except ValueError:
+                retry_after = self.default_retry_after
+            raise RateLimited(retry_after)
+        # anything else is treated like a network failure, the lookup stays queued
+        response.raise_for_status()
+        raise requests.exceptions.RequestException(f'unexpected response {response.status_code}')
+
+
+if __name__ == '__main__':
+    # bulk import without the agent: python3 wiglelocatorv2.py [--db networks.db] export.csv.gz export.kml ...
+    import argparse
+    parser = argparse.ArgumentParser(description='Import WiGLE CSV/KML exports into the WigleLocatorV2 network index.')
+    parser.add_argument('--db', default=os.path.join(os.path.expanduser('~'), 'WigleLocatorV2', 'networks.db'))
+    parser.add_argument('exports', nargs='+')
+    args = parser.parse_args()
+    os.makedirs(os.path.dirname(os.path.abspath(args.db)), exist_ok=True)
+    index = NetworkIndex(args.db)
+    for export in args.exports:
+        started = time.monotonic()
+        print(f'{export}: {index.import_file(export)} observations in {time.monotonic() - started:.1f}s')
+    print(f'{index.count()} networks indexed in {args.db}')
+    index.close()